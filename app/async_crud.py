@@ -0,0 +1,235 @@
+import datetime as dt
+
+from sqlalchemy import String, any_, bindparam, delete, insert, select, text, tuple_, update
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.ext.asyncio import AsyncSession
+from . import models, schemas
+from .config import settings
+from .crud import TRACKING_COLUMNS, insert_anchors_statement, to_timestamp, update_trackings_statements
+
+# asyncio versions of the functions in crud.py, used by the endpoints
+
+async def get_tracking(db: AsyncSession, tracking_id: int):
+    result = await db.execute(select(models.Tracking).where(models.Tracking.tracking_id == tracking_id))
+    return result.scalars().first()
+
+async def get_tracking_by_transaction_id(db: AsyncSession, transaction_id: str):
+    result = await db.execute(select(models.Tracking).where(models.Tracking.transaction_id == transaction_id))
+    return result.scalars().first()
+
+async def get_tracking_by_anonymized_data(db: AsyncSession, transaction_id: str, anonymized_data: str):
+    result = await db.execute(select(models.Tracking)
+                              .where(models.Tracking.transaction_id == transaction_id)
+                              .where(models.Tracking.anonymized_data == anonymized_data))
+    return result.scalars().first()
+
+async def get_merkle_proofs(db: AsyncSession, pairs: list) -> dict:
+    """ Merkle proofs of the trackings with the given (transaction_id, anonymized_data) """
+    proofs = {}
+    for i in range(0, len(pairs), settings.bulk_insert_chunk_size):
+        chunk = pairs[i:i + settings.bulk_insert_chunk_size]
+        result = await db.execute(select(models.Tracking.transaction_id, models.Tracking.anonymized_data,
+                                         models.Tracking.merkle_proof)
+                                  .where(models.Tracking.anonymized_data.in_([anonymized for _, anonymized in chunk]))
+                                  .where(models.Tracking.merkle_proof.isnot(None)))
+        proofs.update({(transaction_id, anonymized): proof for transaction_id, anonymized, proof in result})
+    return proofs
+
+async def get_anchors(db: AsyncSession, blockchain_id: int, anonymized: list) -> dict:
+    """ (transaction_id, merkle_proof) of the anonymized data already anchored on the blockchain, by anonymized data """
+    anchors = {}
+    table = models.Anchor.__table__
+    for i in range(0, len(anonymized), settings.bulk_insert_chunk_size):
+        chunk = anonymized[i:i + settings.bulk_insert_chunk_size]
+        result = await db.execute(select(table.c.anonymized_data, table.c.transaction_id, table.c.merkle_proof)
+                                  .where(table.c.blockchain_id == blockchain_id)
+                                  .where(table.c.anonymized_data.in_(chunk)))
+        anchors.update({anonymized_data: (transaction_id, merkle_proof) for anonymized_data, transaction_id, merkle_proof in result})
+    return anchors
+
+async def insert_anchors(db: AsyncSession, anchors: list):
+    """ anchors: list of dicts (blockchain_id, anonymized_data, transaction_id, merkle_proof). Does not commit """
+    for i in range(0, len(anchors), settings.bulk_insert_chunk_size):
+        await db.execute(insert_anchors_statement(db.bind.dialect.name), anchors[i:i + settings.bulk_insert_chunk_size])
+
+async def get_trackings(db: AsyncSession, skip: int = 0, limit: int = 100):
+    result = await db.execute(select(models.Tracking).offset(skip).limit(limit))
+    return result.scalars().all()
+
+async def create_tracking(db: AsyncSession, tracking: schemas.TrackingCreate):
+    db_tracking = models.Tracking(**tracking.dict(include=set(TRACKING_COLUMNS)))
+    db.add(db_tracking)
+    await db.commit()
+    await db.refresh(db_tracking)
+    return db_tracking
+
+async def get_existing_transaction_ids(db: AsyncSession, transaction_ids: list) -> set:
+    existing = set()
+    for i in range(0, len(transaction_ids), settings.bulk_insert_chunk_size):
+        chunk = transaction_ids[i:i + settings.bulk_insert_chunk_size]
+        result = await db.execute(select(models.Tracking.transaction_id)
+                                  .where(models.Tracking.transaction_id.in_(chunk)))
+        existing.update(result.scalars())
+    return existing
+
+async def create_trackings(db: AsyncSession, trackings: list) -> list:
+    """ Inserts all trackings in a single transaction and returns their tracking_id, in order """
+    rows = [tracking.dict(include=set(TRACKING_COLUMNS)) for tracking in trackings]
+    if not rows:
+        return []
+    if db.bind.dialect.name == 'postgresql' and len(rows) >= settings.bulk_copy_threshold:
+        tracking_ids = await _copy_trackings(db, rows)
+    elif not db.bind.dialect.implicit_returning:
+        db_trackings = [models.Tracking(**row) for row in rows]
+        db.add_all(db_trackings)
+        await db.flush()
+        tracking_ids = [db_tracking.tracking_id for db_tracking in db_trackings]
+    else:
+        tracking_ids = []
+        for i in range(0, len(rows), settings.bulk_insert_chunk_size):
+            statement = insert(models.Tracking).values(rows[i:i + settings.bulk_insert_chunk_size]) \
+                .returning(models.Tracking.tracking_id)
+            tracking_ids.extend((await db.execute(statement)).scalars())
+    await db.commit()
+    return tracking_ids
+
+async def _copy_trackings(db: AsyncSession, rows: list) -> list:
+    # ids are taken from the identity sequence beforehand, since COPY does not return them
+    result = await db.execute(
+        text("SELECT nextval(pg_get_serial_sequence('tracking', 'tracking_id')) FROM generate_series(1, :n)"),
+        {'n': len(rows)})
+    tracking_ids = list(result.scalars())
+    connection = await (await db.connection()).get_raw_connection()
+    await connection.driver_connection.copy_records_to_table(
+        'tracking',
+        records=[(tracking_id, *[row[column] for column in TRACKING_COLUMNS]) for tracking_id, row in zip(tracking_ids, rows)],
+        columns=['tracking_id'] + TRACKING_COLUMNS)
+    return tracking_ids
+
+async def stream_trackings(db: AsyncSession, locator: str = None, blockchain_id: int = None,
+                           start=None, end=None, page_size: int = 1000):
+    """ Yields the trackings (as mappings) in tracking_id order, by keyset pages read through server-side cursors """
+    table = models.Tracking.__table__
+    statement = select(table)
+    if locator:
+        statement = statement.where(table.c.locator == locator)
+    if blockchain_id is not None:
+        statement = statement.where(table.c.blockchain_id == blockchain_id)
+    if start:
+        statement = statement.where(table.c.tracking_dt >= to_timestamp(start))
+    if end:
+        statement = statement.where(table.c.tracking_dt < to_timestamp(end))
+    last_id = 0
+    while True:
+        result = await db.stream(statement.where(table.c.tracking_id > last_id)
+                                 .order_by(table.c.tracking_id).limit(page_size))
+        count = 0
+        async for row in result.mappings():
+            count += 1
+            last_id = row['tracking_id']
+            yield row
+        if count < page_size:
+            return
+
+def _unindex_condition(locator: str, datetime: str):
+    table = models.Tracking.__table__
+    condition = table.c.locator == locator
+    if datetime:
+        condition = condition & (table.c.tracking_dt == to_timestamp(datetime))
+    return condition
+
+async def get_trackings_for_unindex(db: AsyncSession, locator: str, datetime: str):
+    result = await db.execute(select(models.Tracking).where(_unindex_condition(locator, datetime)))
+    return result.scalars().all()
+
+async def delete_trackings_for_unindex(db: AsyncSession, locator: str, datetime: str):
+    """ Deletes the trackings, and the anchors no other tracking holds, in one database transaction """
+    rows = await _delete_returning(db, _unindex_condition(locator, datetime))
+    await delete_erased_anchors(db, rows)
+    await db.commit()
+    return len(rows)
+
+async def delete_trackings_returning(db: AsyncSession, locator: str, datetime: str) -> list:
+    """ Deletes the trackings in a single statement and returns their (locator, tracking_dt, transaction_id,
+        blockchain_id, anonymized_data), for delete_erased_anchors. Does not commit """
+    return await _delete_returning(db, _unindex_condition(locator, datetime))
+
+async def _delete_returning(db: AsyncSession, condition) -> list:
+    """ Deletes the trackings and returns their (locator, tracking_dt, transaction_id, blockchain_id, anonymized_data) """
+    table = models.Tracking.__table__
+    columns = (table.c.locator, table.c.tracking_dt, table.c.transaction_id, table.c.blockchain_id, table.c.anonymized_data)
+    if db.bind.dialect.implicit_returning:
+        return list(await db.execute(table.delete().where(condition).returning(*columns)))
+    # SQLite: read then delete, in the same database transaction
+    rows = list(await db.execute(select(*columns).where(condition)))
+    if rows:
+        await db.execute(table.delete().where(condition))
+    return rows
+
+async def delete_erased_anchors(db: AsyncSession, rows: list):
+    """ Deletes the anchors of the deleted trackings (rows of _delete_returning) that no remaining tracking holds: the
+        next indexation of the same anonymized data is registered again instead of reusing a transaction without a
+        tracking. Does not commit """
+    anchor = models.Anchor.__table__
+    tracking = models.Tracking.__table__
+    keys = list(dict.fromkeys((blockchain_id, anonymized_data, transaction_id)
+                              for _, _, transaction_id, blockchain_id, anonymized_data in rows
+                              if transaction_id is not None and anonymized_data is not None))
+    # trackings of an anchor have its transaction: read through tracking_transaction_id_idx
+    held = select(tracking.c.tracking_id).where(tracking.c.transaction_id == anchor.c.transaction_id) \
+        .where(tracking.c.anonymized_data == anchor.c.anonymized_data) \
+        .where(tracking.c.blockchain_id == anchor.c.blockchain_id).exists()
+    size = settings.erasure_chunk_size
+    for i in range(0, len(keys), size):
+        await db.execute(anchor.delete()
+                         .where(tuple_(anchor.c.blockchain_id, anchor.c.anonymized_data, anchor.c.transaction_id)
+                                .in_(keys[i:i + size]))
+                         .where(~held))
+
+async def delete_trackings_bulk(db: AsyncSession, locators: list, pairs: list) -> tuple:
+    """ Deletes all the trackings of the locators, and the trackings of the (locator, tracking_dt) pairs, in set-based
+        statements, with the anchors no other tracking holds. Returns the deleted (locator, tracking_dt, transaction_id,
+        blockchain_id, anonymized_data) of the pairs and of the locators. Does not commit """
+    table = models.Tracking.__table__
+    deleted_pairs = []
+    if pairs:
+        deleted_pairs = await _delete_returning(db, tuple_(table.c.locator, table.c.tracking_dt)
+                                                .in_([(locator, to_timestamp(datetime)) for locator, datetime in pairs]))
+    deleted = []
+    if locators:
+        if db.bind.dialect.name == 'postgresql':
+            # one array parameter: a single prepared statement for any number of locators
+            condition = table.c.locator == any_(bindparam('locators', locators, type_=ARRAY(String)))
+        else:
+            condition = table.c.locator.in_(locators)
+        deleted = await _delete_returning(db, condition)
+    await delete_erased_anchors(db, deleted_pairs + deleted)
+    return deleted_pairs, deleted
+
+async def insert_tracking(db: AsyncSession, tracking: schemas.TrackingCreate) -> dict:
+    """ Inserts the tracking in a single statement and returns its row. Does not commit """
+    table = models.Tracking.__table__
+    if not db.bind.dialect.implicit_returning:
+        db_tracking = models.Tracking(**tracking.dict(include=set(TRACKING_COLUMNS)))
+        db.add(db_tracking)
+        await db.flush()
+        return {column.name: getattr(db_tracking, column.name) for column in table.c}
+    result = await db.execute(table.insert().values(**tracking.dict(include=set(TRACKING_COLUMNS)))
+                              .returning(*table.c))
+    return dict(result.mappings().one())
+
+async def get_trackings_by_status(db: AsyncSession, status: str, limit: int = 100):
+    result = await db.execute(select(models.Tracking).where(models.Tracking.status == status)
+                              .order_by(models.Tracking.tracking_id).limit(limit))
+    return result.scalars().all()
+
+async def update_trackings_transaction(db: AsyncSession, updates: list):
+    """ updates: list of (tracking_id, transaction_id, status, merkle_proof, locator) """
+    for statement, parameters in update_trackings_statements(updates):
+        await db.execute(statement, parameters)
+    await db.commit()
+
+async def update_trackings_status(db: AsyncSession, transaction_ids: list, status: str):
+    await db.execute(update(models.Tracking).where(models.Tracking.transaction_id.in_(transaction_ids))
+                     .values(status=status, status_dt=dt.datetime.now()).execution_options(synchronize_session=False))
+    await db.commit()
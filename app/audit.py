@@ -0,0 +1,147 @@
+# PrivacyChain integrity audit
+# Checks that the anonymized_data of every tracking still is the input of its transaction on chain
+# (or, with Merkle-batched anchoring, that its inclusion proof leads to the registered root).
+# usage: python -m app.audit [--resume] [--checkpoint audit_checkpoint.json] [--report audit_mismatches.ndjson]
+#
+# Progress is checkpointed after each chunk: --resume continues after the last audited tracking_id.
+# Trackings on a blockchain the audit can not read (no backend, or the in-process MEMORY ledger of the API workers)
+# are counted as skipped.
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import app.backends as backends
+import app.chain as chain
+import app.merkle as merkle
+from app import crud
+from app.config import settings
+from app.database import SessionLocal
+from app.utils import Blockchain
+
+class Audit:
+    """ Streams the tracking table by keyset pages and compares each row with its transaction, read in concurrent batches
+        from the backend of the tracking's blockchain (chain_backends by blockchain_id; the others are skipped) """
+
+    def __init__(self, chain_backends: dict, chunk_size: int, concurrency: int, checkpoint_path: str, report_path: str):
+        self.chain_backends = chain_backends
+        self.chunk_size = chunk_size
+        self.concurrency = concurrency
+        self.checkpoint_path = checkpoint_path
+        self.report_path = report_path
+        self.state = {'last_tracking_id': 0, 'audited': 0, 'mismatches': 0, 'errors': 0, 'skipped': 0, 'elapsed': 0.0}
+
+    def load_checkpoint(self):
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path) as file:
+                self.state.update(json.load(file))
+
+    def save_checkpoint(self):
+        # written aside and renamed, so an interrupted audit never leaves a truncated checkpoint
+        with open(self.checkpoint_path + '.tmp', 'w') as file:
+            json.dump(self.state, file)
+        os.replace(self.checkpoint_path + '.tmp', self.checkpoint_path)
+
+    def run(self) -> dict:
+        started_at = time.monotonic() - self.state['elapsed']
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor, open(self.report_path, 'a') as report:
+            while True:
+                db = SessionLocal()
+                try:
+                    trackings = crud.get_onchain_trackings_after(db, self.state['last_tracking_id'], self.chunk_size)
+                finally:
+                    db.close()
+                if not trackings:
+                    break
+                transaction_ids = {}
+                skipped = 0
+                for tracking in trackings:
+                    if tracking.blockchain_id in self.chain_backends:
+                        transaction_ids.setdefault(tracking.blockchain_id, {})[tracking.transaction_id] = None
+                    else:
+                        skipped += 1
+                txs = {}
+                for blockchain_id, ids in transaction_ids.items():
+                    txs[blockchain_id] = self.fetch(executor, blockchain_id, list(ids))
+                for tracking in trackings:
+                    if tracking.blockchain_id not in txs:
+                        continue
+                    if tracking.transaction_id not in txs[tracking.blockchain_id]:
+                        problem = 'error'
+                    else:
+                        problem = self.check(tracking, txs[tracking.blockchain_id][tracking.transaction_id])
+                    if problem:
+                        self.state['errors' if problem == 'error' else 'mismatches'] += 1
+                        report.write(json.dumps({'tracking_id': tracking.tracking_id,
+                                                 'transaction_id': tracking.transaction_id,
+                                                 'problem': problem}) + '\n')
+                report.flush()
+                self.state['last_tracking_id'] = trackings[-1].tracking_id
+                self.state['audited'] += len(trackings) - skipped
+                self.state['skipped'] += skipped
+                self.state['elapsed'] = time.monotonic() - started_at
+                self.save_checkpoint()
+                print('audit: {audited} trackings ({rate:.0f}/s), {mismatches} mismatches, {errors} errors, '
+                      '{skipped} skipped, last tracking_id {last_tracking_id}'.format(rate=self.state['audited'] / max(self.state['elapsed'], 1e-9),
+                                                                   **self.state))
+        return self.state
+
+    def fetch(self, executor: ThreadPoolExecutor, blockchain_id: int, transaction_ids: list) -> dict:
+        """ Transactions by id; a batch that fails is left out (its trackings are reported as errors) """
+        backend = self.chain_backends[blockchain_id]
+        size = settings.chain_batch_size
+        groups = [transaction_ids[i:i + size] for i in range(0, len(transaction_ids), size)]
+        txs = {}
+        for group, future in [(group, executor.submit(backend.get_many, group)) for group in groups]:
+            try:
+                txs.update(zip(group, future.result()))
+            except Exception as e:
+                print('audit: could not read ' + str(len(group)) + ' transactions: ' + str(e))
+        return txs
+
+    @staticmethod
+    def check(tracking, tx) -> str:
+        """ None when the tracking matches its transaction, or the problem found """
+        if tx is None:
+            return 'not_found'
+        if isinstance(tx, Exception):
+            return 'error'
+        anonymized_data_in_blockchain = tx['input'][2:]
+        if tracking.anonymized_data == anonymized_data_in_blockchain:
+            return None
+        if tracking.merkle_proof and merkle.verify_proof(tracking.anonymized_data, tracking.merkle_proof, anonymized_data_in_blockchain):
+            return None
+        return 'mismatch'
+
+def main():
+    parser = argparse.ArgumentParser(description='Audit the trackings against the transactions registered on chain')
+    parser.add_argument('--resume', action='store_true', help='continue from the checkpoint of a previous run')
+    parser.add_argument('--checkpoint', default='audit_checkpoint.json')
+    parser.add_argument('--report', default='audit_mismatches.ndjson', help='NDJSON file of the trackings that do not match')
+    parser.add_argument('--chunk-size', type=int, default=settings.audit_chunk_size)
+    parser.add_argument('--concurrency', type=int, default=settings.audit_concurrency)
+    args = parser.parse_args()
+
+    if not args.resume:
+        for path in (args.checkpoint, args.report):
+            if os.path.exists(path):
+                os.remove(path)
+    # a client of its own, without the transaction cache: the whole table would evict the API's working set
+    client = chain.ChainClient(settings.chain_url, args.concurrency, settings.chain_timeout,
+                               settings.chain_accounts_refresh_interval)
+    # the MEMORY ledger lives in the API workers: its trackings are skipped, as those of blockchains without backend
+    audit = Audit({int(Blockchain.ETHEREUM.value): backends.EthereumBackend(client)}, args.chunk_size, args.concurrency, args.checkpoint, args.report)
+    if args.resume:
+        audit.load_checkpoint()
+    try:
+        state = audit.run()
+    finally:
+        client.close()
+    print('audit: done, ' + json.dumps(state))
+    # non-zero exit status for schedulers (cron) when something does not match
+    raise SystemExit(1 if state['mismatches'] or state['errors'] else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,267 @@
+import functools
+import hashlib
+import random
+import threading
+import time
+from abc import ABC, abstractmethod
+
+import app.bib as bib
+import app.chain as chain
+import app.metrics as metrics
+import app.nonces as nonces
+from app.config import settings
+from app.utils import Blockchain
+
+def observed(function):
+    """ Records the time and the failures of a backend call """
+    @functools.wraps(function)
+    def wrapper(self, *args, **kwargs):
+        begin = time.perf_counter()
+        try:
+            return function(self, *args, **kwargs)
+        except Exception:
+            metrics.CHAIN_ERRORS.inc(backend=self.name, operation=function.__name__)
+            raise
+        finally:
+            metrics.CHAIN_SECONDS.observe(time.perf_counter() - begin, backend=self.name, operation=function.__name__)
+    return wrapper
+
+class BlockchainBackend(ABC):
+    """ Blockchain where anonymized data is registered.
+
+        Transactions are returned as JSON dicts with (at least) hash, blockNumber and input.
+        get raises when the transaction is not found or can not be read, get_many returns None or the exception (the
+        error of its JSON-RPC item) in its place.
+        submit raises when the content is not sent, submit_batch returns the exception in its place: the other
+        contents of the batch may be on chain already.
+    """
+
+    name = 'backend'
+
+    def submit(self, content: str) -> str:
+        return raise_error(self.submit_batch([content])[0])
+
+    @abstractmethod
+    def submit_batch(self, contents: list) -> list:
+        """ Transaction id of each content, in order, or the exception that kept it from being sent """
+
+    def get(self, transaction_id: str) -> dict:
+        tx = raise_error(self.get_many([transaction_id])[0])
+        if tx is None:
+            raise ValueError('Transaction with hash: ' + transaction_id + ' not found.')
+        return tx
+
+    @abstractmethod
+    def get_many(self, transaction_ids: list) -> list:
+        """ Transactions of the ids, in order (None when not found, the exception when it can not be read) """
+
+    def statuses(self, transaction_ids: list) -> list:
+        """ For each transaction: True (confirmed), False (failed) or None (not mined yet) """
+        return [None if tx is None or isinstance(tx, Exception) or tx.get('blockNumber') is None else True
+                for tx in self.get_many(transaction_ids)]
+
+class EthereumBackend(BlockchainBackend):
+    """ Ethereum node (Ganache) through the shared ChainClient, or through the given client.
+
+        Transactions are sent from a pool of sender accounts, with nonces counted in process (NonceManager). With
+        private keys (PRIVACYCHAIN_CHAIN_PRIVATE_KEYS / PRIVACYCHAIN_CHAIN_MNEMONIC) they are signed here, in the
+        process pool for large batches, and sent raw; without keys, they are sent from the unlocked node accounts.
+    """
+
+    name = 'ethereum'
+
+    def __init__(self, client: chain.ChainClient = None, keys: list = None):
+        self._client = client
+        keys = nonces.sender_keys() if keys is None else keys
+        self._keys = {}
+        if keys:
+            from eth_account import Account  # only with local signing: a slow import, kept out of cold starts
+            self._keys = {Account.from_key(key).address: key for key in keys}
+        self._nonces = None
+        self._nonces_lock = threading.Lock()
+
+    @property
+    def client(self) -> chain.ChainClient:
+        return self._client or chain.get_client()
+
+    @property
+    def nonce_manager(self) -> nonces.NonceManager:
+        if self._nonces is None:
+            with self._nonces_lock:
+                if self._nonces is None:
+                    self._nonces = nonces.NonceManager(self.client, list(self._keys) or self.client.accounts(),
+                                                       settings.chain_nonce_resync_interval)
+        return self._nonces
+
+    def _transactions(self, contents: list) -> list:
+        """ [(address, first nonce, transactions)]: one group of consecutive nonces of an account per JSON-RPC batch """
+        client = self.client
+        manager = self.nonce_manager
+        groups = []
+        if self._keys:
+            chain_id = client.w3.eth.chain_id
+            gas_price = client.gas_price()
+        size = settings.chain_batch_size
+        for i in range(0, len(contents), size):
+            group = [content if content.startswith('0x') else '0x' + content for content in contents[i:i + size]]
+            try:
+                address, nonce = manager.acquire(len(group))
+            except Exception:
+                for address, _, transactions in groups:
+                    manager.release(address, len(transactions), False)
+                raise
+            if self._keys:
+                transactions = [{'to': random.choice(manager.addresses), 'value': 1, 'data': data,
+                                 'nonce': nonce + j, 'gas': nonces.intrinsic_gas(data), 'gasPrice': gas_price,
+                                 'chainId': chain_id}
+                                for j, data in enumerate(group)]
+            else:
+                transactions = [{'to': random.choice(manager.addresses), 'from': address, 'value': hex(1),
+                                 'data': data, 'nonce': hex(nonce + j)}
+                                for j, data in enumerate(group)]
+            groups.append((address, nonce, transactions))
+        return groups
+
+    def _sign(self, groups: list) -> list:
+        """ Raw transactions of each group, signed in the process pool when there are many """
+        if sum(len(transactions) for _, _, transactions in groups) < settings.chain_sign_pool_threshold:
+            return [nonces.sign_transactions(self._keys[address], transactions) for address, _, transactions in groups]
+        executor = bib.get_executor()
+        size = settings.batch_chunk_size
+        futures = [[executor.submit(nonces.sign_transactions, self._keys[address], transactions[i:i + size])
+                    for i in range(0, len(transactions), size)]
+                   for address, _, transactions in groups]
+        return [[raw for future in chunks for raw in future.result()] for chunks in futures]
+
+    def _send(self, contents: list) -> list:
+        """ Transaction id of each content, or the exception that kept it from being sent """
+        try:
+            groups = self._transactions(contents)
+        except Exception as e:
+            return [e] * len(contents)
+        manager = self.nonce_manager
+        results = []
+        done = 0
+        try:
+            if self._keys:
+                calls = [[('eth_sendRawTransaction', [raw]) for raw in raws] for raws in self._sign(groups)]
+            else:
+                calls = [[('eth_sendTransaction', [transaction]) for transaction in transactions]
+                         for _, _, transactions in groups]
+            for (address, _, transactions), group_calls in zip(groups, calls):
+                group_results = self.client.batch_request(group_calls, errors=True)
+                results.extend(group_results)
+                # a rejected transaction leaves a nonce gap: the account is read again from the node
+                manager.release(address, len(transactions), not any(isinstance(result, Exception) for result in group_results))
+                done += 1
+        except Exception as e:
+            results.extend([e] * (len(contents) - len(results)))
+        finally:
+            # the nonces of the groups not sent (or sent in part) may leave gaps: those accounts are read again from the node
+            for address, _, transactions in groups[done:]:
+                manager.release(address, len(transactions), False)
+        return results
+
+    @observed
+    def submit(self, content: str) -> str:
+        return raise_error(self._send([content])[0])
+
+    @observed
+    def submit_batch(self, contents: list) -> list:
+        """ Transactions with consecutive nonces of one sender account per JSON-RPC batch request """
+        if not contents:
+            return []
+        results = self._send(contents)
+        failed = sum(1 for result in results if isinstance(result, Exception))
+        if failed:
+            metrics.CHAIN_ERRORS.inc(failed, backend=self.name, operation='submit_batch')
+        return results
+
+    @observed
+    def get(self, transaction_id: str) -> dict:
+        return self.client.get_transaction(transaction_id)
+
+    @observed
+    def get_many(self, transaction_ids: list) -> list:
+        return self.client.get_transactions(transaction_ids)
+
+    @observed
+    def statuses(self, transaction_ids: list) -> list:
+        receipts = self.client.batch_request([('eth_getTransactionReceipt', [transaction_id])
+                                              for transaction_id in transaction_ids], errors=True)
+        return [None if receipt is None or isinstance(receipt, Exception) else int(receipt.get('status', '0x1'), 16) == 1
+                for receipt in receipts]
+
+class MemoryLedger(BlockchainBackend):
+    """ In-process append-only ledger: each transaction is mined at once in a block of its own.
+
+        Runs the whole pipeline without a node, for load tests and benchmarks. Lost on restart.
+    """
+
+    name = 'memory'
+
+    def __init__(self):
+        self._transactions = {}
+        self._lock = threading.Lock()
+
+    @observed
+    def submit_batch(self, contents: list) -> list:
+        transaction_ids = []
+        with self._lock:
+            for content in contents:
+                block_number = len(self._transactions) + 1
+                content = content[2:] if content.startswith('0x') else content
+                transaction_id = '0x' + hashlib.sha256((str(block_number) + ':' + content).encode()).hexdigest()
+                self._transactions[transaction_id] = {'hash': transaction_id,
+                                                      'blockNumber': block_number,
+                                                      'transactionIndex': 0,
+                                                      'input': '0x' + content}
+                transaction_ids.append(transaction_id)
+        return transaction_ids
+
+    @observed
+    def get_many(self, transaction_ids: list) -> list:
+        return [self._transactions.get(transaction_id.lower()) for transaction_id in transaction_ids]
+
+BACKENDS = {
+    Blockchain.ETHEREUM: EthereumBackend,
+    Blockchain.MEMORY: MemoryLedger,
+}
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+def register(blockchain: Blockchain, factory):
+    """ Registers (or replaces) the backend factory of a blockchain """
+    with _backends_lock:
+        BACKENDS[blockchain] = factory
+        _backends.pop(blockchain, None)
+
+def get_backend(blockchain) -> BlockchainBackend:
+    """ Backend of a blockchain (Blockchain member, name or id), created on first use """
+    blockchain = to_blockchain(blockchain)
+    backend = _backends.get(blockchain)
+    if backend is None:
+        with _backends_lock:
+            if blockchain not in _backends:
+                if blockchain not in BACKENDS:
+                    raise ValueError('No backend for blockchain ' + blockchain.name)
+                _backends[blockchain] = BACKENDS[blockchain]()
+            backend = _backends[blockchain]
+    return backend
+
+def raise_error(result):
+    """ The result of an item of a batch, raised when it is an exception """
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+def to_blockchain(blockchain) -> Blockchain:
+    if isinstance(blockchain, Blockchain):
+        return blockchain
+    if isinstance(blockchain, int) or str(blockchain).isdigit():
+        return Blockchain(str(blockchain))
+    try:
+        return Blockchain[str(blockchain).upper()]
+    except KeyError:
+        raise ValueError('Invalid blockchain: ' + str(blockchain))
@@ -1,5 +1,164 @@
 import uuid
+import hashlib
+import hmac
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import app.metrics as metrics
+from app.utils import HashMethod
+from app.config import settings
+
+HASH_FUNCTIONS = {
+    HashMethod.MD5: hashlib.md5,
+    HashMethod.SHA1: hashlib.sha1,
+    HashMethod.SHA256: hashlib.sha256,
+    HashMethod.SHA512: hashlib.sha512,
+}
+
+def blake2b_keyed(key: bytes):
+    # BLAKE2b keys have at most 64 bytes: a longer pepper is hashed first, as HMAC does
+    return hashlib.blake2b(key=key if len(key) <= hashlib.blake2b.MAX_KEY_SIZE else hashlib.blake2b(key).digest())
+
+# keyed hash methods: the key is the server pepper, the per-record salt stays in the content (salted_content)
+KEYED_HASH_FUNCTIONS = {
+    HashMethod.HMAC_SHA256: lambda key: hmac.new(key, digestmod='sha256'),
+    HashMethod.HMAC_SHA512: lambda key: hmac.new(key, digestmod='sha512'),
+    HashMethod.BLAKE2B: blake2b_keyed,
+}
+
+_executor = None
+_keyed_contexts = {}
 
 def salt():
     return str(uuid.uuid4())
 
+def hash_method(name) -> HashMethod:
+    """ Resolve a hash method by name (e.g. 'SHA256') or by HashMethod member """
+    if isinstance(name, HashMethod):
+        return name
+    try:
+        return HashMethod[str(name).upper()]
+    except KeyError:
+        raise ValueError('Invalid hash method: ' + str(name))
+
+def keyed_context(method: HashMethod):
+    """ Hash object keyed with the pepper, built once per process and copied for each record """
+    context = _keyed_contexts.get(method)
+    if context is None:
+        if not settings.anonymization_pepper:
+            raise ValueError(method.name + ' anonymization needs a pepper (PRIVACYCHAIN_ANONYMIZATION_PEPPER)')
+        context = _keyed_contexts[method] = KEYED_HASH_FUNCTIONS[method](settings.anonymization_pepper.encode())
+    return context
+
+def hash_function(method: HashMethod):
+    """ data -> hash object of the method. Keyed methods copy the keyed context instead of keying a new one """
+    if method not in KEYED_HASH_FUNCTIONS:
+        return HASH_FUNCTIONS[method]
+    context = keyed_context(method)
+
+    def keyed(data: bytes = b''):
+        keyed_hash = context.copy()
+        keyed_hash.update(data)
+        return keyed_hash
+    return keyed
+
+def salted_content(content: str, salt: str) -> str:
+    """ Content with the salt appended inside the canonical form, as in secure anonymization """
+    return content[:-1] + ', salt:' + salt + "}"
+
+def anonymize(content: str, method='SHA256') -> str:
+    method = hash_method(method)
+    new_hash = hash_function(method)
+    with metrics.HASH_SECONDS.time(method=method.name):
+        return new_hash(content.encode()).hexdigest()
+
+def anonymize_many(contents: list, method='SHA256') -> list:
+    method = hash_method(method)
+    new_hash = hash_function(method)
+    with metrics.HASH_SECONDS.time(method=method.name):
+        return [new_hash(content.encode()).hexdigest() for content in contents]
+
+class Anonymizer:
+    """ Incremental anonymization of a content received in chunks (UTF-8 bytes).
+
+        Same digest as anonymize(content) or, with a salt, as anonymize(salted_content(content, salt)): the last
+        character of the content is held back and replaced by the salt suffix when the digest is taken.
+    """
+
+    def __init__(self, method='SHA256', salt: str = None):
+        self.method = hash_method(method)
+        self.salt = salt
+        self._hash = hash_function(self.method)()
+        self._tail = b''
+        self._elapsed = 0.0
+
+    def update(self, chunk: bytes):
+        begin = time.perf_counter()
+        if self.salt is None:
+            self._hash.update(chunk)
+        else:
+            data = self._tail + chunk
+            cut = last_character_start(data)
+            self._hash.update(data[:cut])
+            self._tail = data[cut:]
+        self._elapsed += time.perf_counter() - begin
+
+    def hexdigest(self) -> str:
+        if self.salt is None:
+            digest = self._hash.hexdigest()
+        else:
+            salted = self._hash.copy()
+            salted.update((', salt:' + self.salt + "}").encode())
+            digest = salted.hexdigest()
+        metrics.HASH_SECONDS.observe(self._elapsed, method=self.method.name)
+        return digest
+
+def last_character_start(data: bytes) -> int:
+    """ Offset of the last UTF-8 character of data (len(data) when empty) """
+    if not data:
+        return 0
+    i = len(data) - 1
+    while i > 0 and data[i] & 0xC0 == 0x80:
+        i -= 1
+    return i
+
+def anonymize_file(path: str, method='SHA256', salt: str = None, chunk_size: int = 1 << 20) -> str:
+    """ Anonymization of the content of a (UTF-8) file, read in chunks """
+    anonymizer = Anonymizer(method, salt)
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            anonymizer.update(chunk)
+    return anonymizer.hexdigest()
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ProcessPoolExecutor(max_workers=settings.batch_pool_workers)
+    return _executor
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown()
+        _executor = None
+
+def anonymize_batch(contents: list, method='SHA256'):
+    """ Yields the digests of contents, in order. Large batches are hashed in chunks across a process pool """
+    method = hash_method(method)
+    size = settings.batch_chunk_size
+    if len(contents) < settings.batch_pool_threshold:
+        for i in range(0, len(contents), size):
+            yield from anonymize_many(contents[i:i + size], method)
+        return
+    chunks = [contents[i:i + size] for i in range(0, len(contents), size)]
+    for digests, seconds in get_executor().map(anonymize_chunk, chunks, [method.name] * len(chunks)):
+        # observed here: the metrics of the pool processes are never exposed
+        metrics.HASH_SECONDS.observe(seconds, method=method.name)
+        yield from digests
+
+def anonymize_chunk(contents: list, method: str) -> tuple:
+    """ anonymize_many in a process of the pool: (digests, hashing time in seconds) """
+    new_hash = hash_function(hash_method(method))
+    begin = time.perf_counter()
+    digests = [new_hash(content.encode()).hexdigest() for content in contents]
+    return digests, time.perf_counter() - begin
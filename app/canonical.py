@@ -0,0 +1,103 @@
+import functools
+import json
+
+from app.config import settings
+from app.utils import TypeClassification
+
+PII = 'PII'      # personally identifiable information (identifies the subject by itself)
+PPII = 'PPII'    # potentially personally identifiable information (identifies the subject when combined)
+NPII = 'NPII'    # non personally identifiable information
+
+# schemas by entity type: attribute -> classification, in the order of the canonical form
+DEFAULT_SCHEMAS = {
+    'exam': {'cpf': PII, 'name': PII, 'exam': NPII, 'datetime': PPII, 'result': NPII},
+}
+
+class Schema:
+    """ Compiled schema of an entity type: attribute positions and classifications, resolved once """
+
+    def __init__(self, entity_type: str, attributes: dict):
+        for attribute, classification in attributes.items():
+            if classification not in (PII, PPII, NPII):
+                raise ValueError('Invalid classification of ' + entity_type + '.' + attribute + ': ' + str(classification))
+        self.entity_type = entity_type
+        self.positions = {attribute: position for position, attribute in enumerate(attributes)}
+        self.classifications = dict(attributes)
+        self.pi = frozenset(attribute for attribute, classification in attributes.items() if classification != NPII)
+
+    def attributes(self, content: str) -> list:
+        """ (attribute, value) pairs of a content, in schema order """
+        pairs = parse(content)
+        for attribute, _ in pairs:
+            if attribute not in self.positions:
+                raise ValueError('Attribute ' + attribute + ' is not in the schema of ' + self.entity_type)
+        if len(pairs) != len({attribute for attribute, _ in pairs}):
+            raise ValueError('Repeated attribute in ' + self.entity_type)
+        positions = self.positions
+        return sorted(pairs, key=lambda pair: positions[pair[0]])
+
+    def canonicalize(self, content: str) -> tuple:
+        """ (canonical form of the content, canonical form of its PI attributes) """
+        pairs = self.attributes(content)
+        pi = self.pi
+        return render(pairs), render([pair for pair in pairs if pair[0] in pi])
+
+    def classify(self, content: str, type: TypeClassification) -> dict:
+        classes = (PII, PPII, NPII) if type == TypeClassification.EXPANDED else ('PI', NPII)
+        result = {classification: {} for classification in classes}
+        for attribute, value in self.attributes(content):
+            classification = self.classifications[attribute]
+            if type != TypeClassification.EXPANDED and classification != NPII:
+                classification = 'PI'
+            result[classification][attribute] = value
+        return result
+
+def parse(content: str) -> list:
+    """ (attribute, value) pairs of a JSON object or of the canonical form {attribute:value, ...}; whitespace is not significant """
+    content = content.strip() if content else ''
+    if not (content.startswith('{') and content.endswith('}')):
+        raise ValueError('Content must be an object: {attribute:value, ...}')
+    try:
+        document = json.loads(content)
+    except ValueError:
+        document = None
+    if isinstance(document, dict):
+        return [(attribute.strip(), value if isinstance(value, str) else json.dumps(value, sort_keys=True, separators=(',', ':')))
+                for attribute, value in document.items()]
+    pairs = []
+    for item in content[1:-1].split(','):
+        attribute, separator, value = item.partition(':')
+        if not separator:
+            if item.strip():
+                raise ValueError('Invalid attribute (attribute:value expected): ' + item.strip())
+            continue
+        pairs.append((attribute.strip(), value.strip()))
+    return pairs
+
+def render(pairs: list) -> str:
+    return '{' + ', '.join(attribute + ':' + value for attribute, value in pairs) + '}'
+
+@functools.lru_cache(maxsize=None)
+def definitions() -> dict:
+    """ Schema definitions: the defaults, extended (or replaced, by entity type) by the PRIVACYCHAIN_ENTITY_SCHEMAS_PATH file """
+    schemas = dict(DEFAULT_SCHEMAS)
+    if settings.entity_schemas_path:
+        with open(settings.entity_schemas_path) as file:
+            schemas.update(json.load(file))
+    return schemas
+
+@functools.lru_cache(maxsize=None)
+def get_schema(entity_type: str) -> Schema:
+    """ Compiled schema of an entity type, compiled on first use """
+    attributes = definitions().get(entity_type)
+    if attributes is None:
+        raise ValueError('Unknown entity type: ' + str(entity_type))
+    return Schema(entity_type, attributes)
+
+def canonicalize(content: str, entity_type: str) -> tuple:
+    """ (canonical_data, data to anonymize: the PI attributes) of a content of an entity type """
+    return get_schema(entity_type).canonicalize(content)
+
+def canonicalize_many(contents: list, entity_type: str) -> list:
+    schema = get_schema(entity_type)
+    return [schema.canonicalize(content) for content in contents]
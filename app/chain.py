@@ -0,0 +1,145 @@
+import json
+import os
+import threading
+import time
+from collections.abc import Mapping
+
+import requests
+from requests.adapters import HTTPAdapter
+from hexbytes import HexBytes
+
+from app.config import settings
+from app.txcache import TransactionCache
+
+class HexJsonEncoder(json.JSONEncoder):
+    def default(self, obj):
+        if isinstance(obj, HexBytes):
+            return obj.hex()
+        if isinstance(obj, Mapping):
+            return dict(obj)
+        return super().default(obj)
+
+class ChainClient:
+    """ Web3 client shared by the on-chain endpoints: one keep-alive session pool and a cached account list """
+
+    def __init__(self, url: str, pool_size: int, timeout: float, accounts_refresh_interval: float,
+                 tx_cache: TransactionCache = None):
+        # web3 is imported by the first client, not with the API: it is the slowest import of a worker's cold start
+        from web3 import Web3
+        from web3.middleware import construct_simple_cache_middleware
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.url = url
+        self.timeout = timeout
+        self.w3 = Web3(Web3.HTTPProvider(url, request_kwargs={'timeout': timeout}, session=self.session))
+        # the chain id never changes for a node, no need to ask for it on every transaction
+        self.w3.middleware_onion.add(construct_simple_cache_middleware(dict, {'eth_chainId', 'net_version'}),
+                                     name='static_cache')
+        self.accounts_refresh_interval = accounts_refresh_interval
+        self._accounts = []
+        self._accounts_loaded_at = 0.0
+        self._lock = threading.Lock()
+        self._gas_price = None
+        self._gas_price_loaded_at = 0.0
+        self.tx_cache = tx_cache or TransactionCache(0)
+
+    def accounts(self) -> list:
+        """ Node accounts, refreshed at most every accounts_refresh_interval seconds """
+        if time.monotonic() - self._accounts_loaded_at > self.accounts_refresh_interval or not self._accounts:
+            with self._lock:
+                if time.monotonic() - self._accounts_loaded_at > self.accounts_refresh_interval or not self._accounts:
+                    self._accounts = list(self.w3.eth.accounts)
+                    self._accounts_loaded_at = time.monotonic()
+        return self._accounts
+
+    def gas_price(self) -> int:
+        """ Node gas price, refreshed at most every accounts_refresh_interval seconds """
+        if time.monotonic() - self._gas_price_loaded_at > self.accounts_refresh_interval or self._gas_price is None:
+            with self._lock:
+                if time.monotonic() - self._gas_price_loaded_at > self.accounts_refresh_interval or self._gas_price is None:
+                    self._gas_price = self.w3.eth.gas_price
+                    self._gas_price_loaded_at = time.monotonic()
+        return self._gas_price
+
+    def get_transaction(self, transaction_id: str) -> dict:
+        """ Transaction as a JSON dict, read through the cache of mined transactions """
+        tx = self.tx_cache.get(transaction_id)
+        if tx is None:
+            tx = json.loads(json.dumps(dict(self.w3.eth.get_transaction(transaction_id)), cls=HexJsonEncoder))
+            self.tx_cache.put(transaction_id, tx)
+        return tx
+
+    def get_transactions(self, transaction_ids: list) -> list:
+        """ Transactions as JSON dicts (None when not found, the ValueError of its item when the node returns an error),
+            in order. Those not cached are read in JSON-RPC batch requests """
+        from web3._utils.method_formatters import transaction_result_formatter
+        txs = {transaction_id: self.tx_cache.get(transaction_id) for transaction_id in transaction_ids}
+        missing = [transaction_id for transaction_id, tx in txs.items() if tx is None]
+        results = self.batch_request([('eth_getTransactionByHash', [transaction_id]) for transaction_id in missing],
+                                     errors=True)
+        for transaction_id, result in zip(missing, results):
+            if isinstance(result, Exception):
+                txs[transaction_id] = result
+            elif result is not None:
+                # same format as w3.eth.get_transaction
+                tx = json.loads(json.dumps(transaction_result_formatter(result), cls=HexJsonEncoder))
+                self.tx_cache.put(transaction_id, tx)
+                txs[transaction_id] = tx
+        return [txs[transaction_id] for transaction_id in transaction_ids]
+
+    def batch_request(self, calls: list, errors: bool = False) -> list:
+        """ Sends (method, params) calls as JSON-RPC batch requests and returns their results, in order.
+
+            The error of a call raises ValueError or, with errors, is returned (a ValueError) in place of its result:
+            the other calls of the batch were carried out by the node.
+        """
+        results = []
+        size = settings.chain_batch_size
+        for i in range(0, len(calls), size):
+            payload = [{'jsonrpc': '2.0', 'id': j, 'method': method, 'params': params}
+                       for j, (method, params) in enumerate(calls[i:i + size])]
+            response = self.session.post(self.url, json=payload, timeout=self.timeout)
+            response.raise_for_status()
+            responses = {item['id']: item for item in response.json()}
+            for j in range(len(payload)):
+                if 'error' not in responses[j]:
+                    results.append(responses[j].get('result'))
+                elif errors:
+                    results.append(ValueError(responses[j]['error']))
+                else:
+                    raise ValueError(responses[j]['error'])
+        return results
+
+    def close(self):
+        self.session.close()
+        self.tx_cache.close()
+
+_client = None
+_client_lock = threading.Lock()
+
+def default_pool_size() -> int:
+    # same size as the default threadpool that runs the sync endpoints
+    return min(32, (os.cpu_count() or 1) + 4)
+
+def start() -> ChainClient:
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = ChainClient(settings.chain_url,
+                                  settings.chain_pool_size or default_pool_size(),
+                                  settings.chain_timeout,
+                                  settings.chain_accounts_refresh_interval,
+                                  TransactionCache(settings.tx_cache_size, settings.tx_cache_path))
+    return _client
+
+def stop():
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
+
+def get_client() -> ChainClient:
+    return _client or start()
@@ -1,5 +1,18 @@
+import io
+import logging
+import datetime as dt
+
+from sqlalchemy import bindparam, insert, select, text
+from sqlalchemy.dialects import postgresql, sqlite
 from sqlalchemy.orm import Session
 from . import models, schemas
+from .config import settings
+from .utils import TransactionStatus
+
+logger = logging.getLogger(__name__)
+
+TRACKING_COLUMNS = ['canonical_data', 'anonymized_data', 'blockchain_id', 'transaction_id', 'salt',
+                    'hash_method', 'tracking_dt', 'locator', 'status', 'merkle_proof']
 
 def get_tracking(db: Session, tracking_id: int):
     return db.query(models.Tracking).filter(models.Tracking.tracking_id == tracking_id).first()
@@ -7,38 +20,201 @@ def get_tracking(db: Session, tracking_id: int):
 def get_tracking_by_transaction_id(db: Session, transaction_id: str):
     return db.query(models.Tracking).filter(models.Tracking.transaction_id == transaction_id).first()
 
+def get_tracking_by_anonymized_data(db: Session, transaction_id: str, anonymized_data: str):
+    return db.query(models.Tracking).filter(models.Tracking.transaction_id == transaction_id) \
+        .filter(models.Tracking.anonymized_data == anonymized_data).first()
+
 def get_trackings(db: Session, skip: int = 0, limit: int = 100):
     return db.query(models.Tracking).offset(skip).limit(limit).all()
 
+def get_onchain_trackings_after(db: Session, tracking_id: int, limit: int = 1000):
+    """ Keyset page of the trackings with a transaction, after tracking_id, in order:
+        (tracking_id, blockchain_id, transaction_id, anonymized_data, merkle_proof) """
+    return db.query(models.Tracking.tracking_id, models.Tracking.blockchain_id, models.Tracking.transaction_id,
+                    models.Tracking.anonymized_data, models.Tracking.merkle_proof) \
+        .filter(models.Tracking.tracking_id > tracking_id) \
+        .filter(models.Tracking.transaction_id.isnot(None)) \
+        .order_by(models.Tracking.tracking_id).limit(limit).all()
+
 def create_tracking(db: Session, tracking: schemas.TrackingCreate):
     db_tracking = models.Tracking(canonical_data = tracking.canonical_data, anonymized_data = tracking.anonymized_data, 
                                                     blockchain_id = tracking.blockchain_id, transaction_id = tracking.transaction_id, 
                                                     salt = tracking.salt, hash_method = tracking.hash_method, 
-                                                    tracking_dt = tracking.tracking_dt, locator = tracking.locator)
+                                                    tracking_dt = tracking.tracking_dt, locator = tracking.locator,
+                                                    status = tracking.status, merkle_proof = tracking.merkle_proof)
     db.add(db_tracking)
     db.commit()
     db.refresh(db_tracking)
     return db_tracking
 
+def get_existing_transaction_ids(db: Session, transaction_ids: list) -> set:
+    existing = set()
+    for i in range(0, len(transaction_ids), settings.bulk_insert_chunk_size):
+        chunk = transaction_ids[i:i + settings.bulk_insert_chunk_size]
+        existing.update(row[0] for row in db.query(models.Tracking.transaction_id)
+                        .filter(models.Tracking.transaction_id.in_(chunk)))
+    return existing
+
+def create_trackings(db: Session, trackings: list) -> list:
+    """ Inserts all trackings in a single transaction and returns their tracking_id, in order """
+    rows = [tracking.dict(include=set(TRACKING_COLUMNS)) for tracking in trackings]
+    if not rows:
+        return []
+    if db.bind.dialect.name == 'postgresql' and len(rows) >= settings.bulk_copy_threshold:
+        tracking_ids = _copy_trackings(db, rows)
+    elif not db.bind.dialect.implicit_returning:
+        db_trackings = [models.Tracking(**row) for row in rows]
+        db.add_all(db_trackings)
+        db.flush()
+        tracking_ids = [db_tracking.tracking_id for db_tracking in db_trackings]
+    else:
+        tracking_ids = []
+        for i in range(0, len(rows), settings.bulk_insert_chunk_size):
+            statement = insert(models.Tracking).values(rows[i:i + settings.bulk_insert_chunk_size]) \
+                .returning(models.Tracking.tracking_id)
+            tracking_ids.extend(row[0] for row in db.execute(statement))
+    db.commit()
+    return tracking_ids
+
+def _copy_value(value) -> str:
+    # CSV format of COPY: unquoted empty is NULL, quoted empty is an empty string
+    if value is None:
+        return ''
+    if isinstance(value, int):
+        return str(value)
+    return '"' + str(value).replace('"', '""') + '"'
+
+def _copy_trackings(db: Session, rows: list) -> list:
+    # ids are taken from the identity sequence beforehand, since COPY does not return them
+    tracking_ids = [row[0] for row in db.execute(
+        text("SELECT nextval(pg_get_serial_sequence('tracking', 'tracking_id')) FROM generate_series(1, :n)"),
+        {'n': len(rows)})]
+    buffer = io.StringIO()
+    for tracking_id, row in zip(tracking_ids, rows):
+        buffer.write(','.join([str(tracking_id)] + [_copy_value(row[column]) for column in TRACKING_COLUMNS]) + '\n')
+    buffer.seek(0)
+    cursor = db.connection().connection.cursor()
+    cursor.copy_expert('COPY tracking (tracking_id, ' + ', '.join(TRACKING_COLUMNS) + ') FROM STDIN WITH (FORMAT csv)',
+                       buffer)
+    return tracking_ids
+
+def to_timestamp(value):
+    """ tracking_dt from the ISO 8601 strings received by the endpoints """
+    return dt.datetime.fromisoformat(value) if isinstance(value, str) else value
+
 def get_trackings_for_unindex(db: Session, locator: str, datetime: str):
     if datetime:
-        print('get_trackings_for_unindex: Datetime is NOT EMPTY string')    
+        logger.debug('get_trackings_for_unindex: Datetime is NOT EMPTY string')    
         return db.query(models.Tracking) \
             .filter(models.Tracking.locator == locator) \
-            .filter((models.Tracking.tracking_dt == datetime)).all()        
+            .filter((models.Tracking.tracking_dt == to_timestamp(datetime))).all()        
     else:
-        print('get_trackings_for_unindex: Datetime is EMPTY string')            
+        logger.debug('get_trackings_for_unindex: Datetime is EMPTY string')            
         return db.query(models.Tracking).filter(models.Tracking.locator == locator).all()        
         
 def delete_trackings_for_unindex(db: Session, locator: str, datetime: str):
     if datetime:
-        print('delete_trackings_for_unindex: Datetime is NOT EMPTY string')
+        logger.debug('delete_trackings_for_unindex: Datetime is NOT EMPTY string')
         db_tracking = db.query(models.Tracking) \
             .filter(models.Tracking.locator == locator) \
-            .filter((models.Tracking.tracking_dt == datetime)).delete(synchronize_session='fetch')
+            .filter((models.Tracking.tracking_dt == to_timestamp(datetime))).delete(synchronize_session='fetch')
     else:
-        print('delete_trackings_for_unindex: Datetime is EMPTY string')
+        logger.debug('delete_trackings_for_unindex: Datetime is EMPTY string')
         db_tracking = db.query(models.Tracking) \
             .filter(models.Tracking.locator == locator).delete(synchronize_session='fetch')
     db.commit()
-    return db_tracking
\ No newline at end of file
+    return db_tracking
+
+def get_trackings_by_status(db: Session, status: str, limit: int = 100, after: int = 0):
+    """ Keyset page of the trackings in the status, after tracking_id after, in order """
+    return db.query(models.Tracking).filter(models.Tracking.status == status) \
+        .filter(models.Tracking.tracking_id > after) \
+        .order_by(models.Tracking.tracking_id).limit(limit).all()
+
+def get_unclaimed_trackings(db: Session, lease: float):
+    """ The PENDING trackings, and the SUBMITTING ones whose submission lease has expired, with no status change
+        for lease seconds: left behind by a stopped or crashed worker """
+    expired = dt.datetime.now() - dt.timedelta(seconds=lease)
+    return db.query(models.Tracking) \
+        .filter(models.Tracking.status.in_([TransactionStatus.PENDING.name, TransactionStatus.SUBMITTING.name])) \
+        .filter(models.Tracking.status_dt < expired) \
+        .order_by(models.Tracking.tracking_id).all()
+
+def claim_trackings(db: Session, tracking_ids: list, owner: str, lease: float) -> set:
+    """ Marks SUBMITTING, claimed by owner, the trackings still PENDING, already claimed by owner or whose submission
+        lease (seconds) has expired, and returns their tracking_id: each tracking is submitted by a single worker """
+    table = models.Tracking.__table__
+    now = dt.datetime.now()
+    submitting = TransactionStatus.SUBMITTING.name
+    statement = table.update().where(table.c.tracking_id.in_(tracking_ids)) \
+        .where((table.c.status == TransactionStatus.PENDING.name) |
+               ((table.c.status == submitting) &
+                ((table.c.claimed_by == owner) | (table.c.status_dt < now - dt.timedelta(seconds=lease))))) \
+        .values(status=submitting, claimed_by=owner, status_dt=now)
+    if db.bind.dialect.implicit_returning:
+        claimed = {row[0] for row in db.execute(statement.returning(table.c.tracking_id))}
+    else:
+        # SQLite: no other connection writes before the commit
+        db.execute(statement)
+        claimed = {row[0] for row in db.execute(select(table.c.tracking_id)
+                                                .where(table.c.tracking_id.in_(tracking_ids))
+                                                .where(table.c.status == submitting)
+                                                .where(table.c.claimed_by == owner))}
+    db.commit()
+    return claimed
+
+def update_trackings_statements(updates: list) -> list:
+    """ (statement, parameters) of update_trackings_transaction.
+
+        The trackings with a locator are updated by tracking_id and locator: on a partitioned tracking table
+        (app/partition.py), only the partition of the locator is read.
+    """
+    table = models.Tracking.__table__
+    by_locator = {True: [], False: []}
+    for tracking_id, transaction_id, status, merkle_proof, locator in updates:
+        by_locator[locator is not None].append({'b_tracking_id': tracking_id, 'b_locator': locator,
+                                                'b_transaction_id': transaction_id, 'b_status': status,
+                                                'b_merkle_proof': merkle_proof})
+    statements = []
+    for with_locator, parameters in by_locator.items():
+        if parameters:
+            statement = table.update().where(table.c.tracking_id == bindparam('b_tracking_id'))
+            if with_locator:
+                statement = statement.where(table.c.locator == bindparam('b_locator'))
+            statements.append((statement.values(transaction_id=bindparam('b_transaction_id'), status=bindparam('b_status'),
+                                                merkle_proof=bindparam('b_merkle_proof'), status_dt=dt.datetime.now()),
+                               parameters))
+    return statements
+
+def update_trackings_transaction(db: Session, updates: list):
+    """ updates: list of (tracking_id, transaction_id, status, merkle_proof, locator) """
+    for statement, parameters in update_trackings_statements(updates):
+        db.execute(statement, parameters)
+    db.commit()
+
+def update_trackings_status(db: Session, transaction_ids: list, status: str):
+    db.query(models.Tracking).filter(models.Tracking.transaction_id.in_(transaction_ids)) \
+        .update({'status': status, 'status_dt': dt.datetime.now()}, synchronize_session=False)
+    db.commit()
+
+def insert_anchors_statement(dialect_name: str):
+    """ INSERT into anchor that leaves the anonymized data already anchored (unique index) as it is """
+    dialect = {'postgresql': postgresql, 'sqlite': sqlite}[dialect_name]
+    return dialect.insert(models.Anchor.__table__).on_conflict_do_nothing()
+
+def stream_anchor_keys(db: Session, page_size: int = 10000):
+    """ Yields (blockchain_id, anonymized_data) of all anchors """
+    for row in db.query(models.Anchor.blockchain_id, models.Anchor.anonymized_data).yield_per(page_size):
+        yield row
+
+def create_anchors(db: Session, anchors: list):
+    """ anchors: list of dicts (blockchain_id, anonymized_data, transaction_id, merkle_proof) """
+    if anchors:
+        db.execute(insert_anchors_statement(db.bind.dialect.name), anchors)
+        db.commit()
+
+def delete_anchors(db: Session, transaction_ids: list):
+    # failed transactions must not be reused
+    db.query(models.Anchor).filter(models.Anchor.transaction_id.in_(transaction_ids)) \
+        .delete(synchronize_session=False)
+    db.commit()
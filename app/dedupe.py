@@ -0,0 +1,119 @@
+import hashlib
+import logging
+import math
+import threading
+
+import app.backends as backends
+from app import async_crud, crud
+from app.config import settings
+from app.database import SessionLocal
+
+logger = logging.getLogger(__name__)
+
+class BloomFilter:
+    """ Set membership with false positives (at error_rate, up to capacity keys) and no false negatives """
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+        self._lock = threading.Lock()
+
+    def _positions(self, key: str):
+        # double hashing (Kirsch-Mitzenmacher) from one 128-bit digest
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key: str):
+        positions = self._positions(key)
+        with self._lock:
+            for position in positions:
+                self._bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key: str) -> bool:
+        bits = self._bits
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+class DedupeIndex:
+    """ Anonymized data already anchored on each blockchain: a Bloom filter in memory, in front of the anchor table.
+
+        Only the anonymized data the filter may hold is looked up in the database, so new data costs no query.
+        The filter of a worker does not see the anchors of other workers until it is reloaded (restart): those are
+        caught by the unique index of the anchor table only after their transaction was submitted.
+    """
+
+    def __init__(self, capacity: int, error_rate: float):
+        self.bloom = BloomFilter(capacity, error_rate)
+
+    @staticmethod
+    def key(blockchain_id: int, anonymized_data: str) -> str:
+        return str(blockchain_id) + ':' + anonymized_data
+
+    def load(self):
+        db = SessionLocal()
+        count = 0
+        try:
+            for blockchain_id, anonymized_data in crud.stream_anchor_keys(db):
+                self.bloom.add(self.key(blockchain_id, anonymized_data))
+                count += 1
+        finally:
+            db.close()
+        logger.info('dedupe index loaded: %d anchors', count)
+
+    async def find(self, db, blockchain, anonymized: list) -> dict:
+        """ (transaction_id, merkle_proof) of the anonymized data already anchored on the blockchain """
+        blockchain_id = blockchain_id_of(blockchain)
+        candidates = list(dict.fromkeys(anonymized_data for anonymized_data in anonymized
+                                        if self.key(blockchain_id, anonymized_data) in self.bloom))
+        if not candidates:
+            return {}
+        return await async_crud.get_anchors(db, blockchain_id, candidates)
+
+    async def remember(self, db, blockchain, anchors: list):
+        """ Inserts the anchors [(anonymized_data, transaction_id, merkle_proof)]. Does not commit """
+        rows = anchor_rows(blockchain, anchors)
+        await async_crud.insert_anchors(db, rows)
+        self.add(rows)
+
+    def remember_sync(self, db, blockchain, anchors: list):
+        """ Inserts (and commits) the anchors [(anonymized_data, transaction_id, merkle_proof)] """
+        rows = anchor_rows(blockchain, anchors)
+        crud.create_anchors(db, rows)
+        self.add(rows)
+
+    def add(self, rows: list):
+        for row in rows:
+            self.bloom.add(self.key(row['blockchain_id'], row['anonymized_data']))
+
+def blockchain_id_of(blockchain) -> int:
+    return int(backends.to_blockchain(blockchain).value)
+
+def anchor_rows(blockchain, anchors: list) -> list:
+    blockchain_id = blockchain_id_of(blockchain)
+    return [{'blockchain_id': blockchain_id, 'anonymized_data': anonymized_data,
+             'transaction_id': transaction_id, 'merkle_proof': merkle_proof}
+            for anonymized_data, transaction_id, merkle_proof in anchors]
+
+_index = None
+_index_lock = threading.Lock()
+
+def start() -> DedupeIndex:
+    global _index
+    with _index_lock:
+        if _index is None:
+            index = DedupeIndex(settings.dedupe_capacity, settings.dedupe_error_rate)
+            index.load()
+            _index = index
+    return _index
+
+def stop():
+    global _index
+    _index = None
+
+def get_index() -> DedupeIndex:
+    """ The dedupe index of this process, loaded on first use; None when deduplication is off """
+    if not settings.dedupe:
+        return None
+    return _index or start()
@@ -6,46 +6,55 @@
 
 from __future__ import annotations
 
-import hashlib
+import csv
+import io
 import json
+import logging
+import re
 from typing import Optional
-from fastapi import responses
 
-import uvicorn
 from fastapi import FastAPI, Request, Depends, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.params import Body
 
 from pydantic import BaseModel, Field
 
+import app.backends as backends
 import app.bib as bib
-from app.utils import Blockchain, HashMethod
-
-from web3 import Web3
-import random
-
-from hexbytes import HexBytes
+import app.canonical as canonical
+import app.chain as chain
+import app.database as database
+import app.dedupe as dedupe
+import app.submitter as submitter
+import app.merkle as merkle
+import app.state as state
+import app.metrics as metrics
+from app.config import settings
+from app.utils import Blockchain, HashMethod, TransactionStatus, TypeClassification
 
 from typing import List
-from sqlalchemy.orm import Session
-from . import crud, models, schemas
-from .database import SessionLocal, engine
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from . import async_crud, crud, schemas
+from .database import AsyncSessionLocal
 
 from datetime import datetime
 
 from http import HTTPStatus
 
 # Dependency
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
 
-DEFAULT_BLOCKCHAIN = Blockchain.ETHEREUM
-DEFAULT_HASHMETHOD = HashMethod.SHA256
+# a handler of the app.* loggers only: uvicorn has its own, so its records would be logged twice through the root logger
+_log_handler = logging.StreamHandler()
+_log_handler.setFormatter(logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+logging.getLogger('app').addHandler(_log_handler)
+logging.getLogger('app').setLevel(settings.log_level.upper())
+logging.getLogger('app').propagate = False
+logger = logging.getLogger(__name__)
 
 tags_metadata = [
     {"name": "Pure Functions", "description": "Pure functions of the functional programmation"},
@@ -57,7 +66,9 @@ app = FastAPI(
     title='PrivacyChain',
     description='REST API specification for PrivacyChain (Personal Data Persistence for DLT)',
     version='1.0.0',
-    openapi_tags=tags_metadata
+    openapi_tags=tags_metadata,
+    # the schema is built on the first request of /openapi.json (or /docs); None also removes /docs and /redoc
+    openapi_url='/openapi.json' if settings.openapi_docs else None
 )
 
 origins = ["*"]
@@ -70,6 +81,28 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(metrics.RequestMetricsMiddleware)
+
+@app.on_event("startup")
+def startup():
+    state.start()
+    if not settings.lazy_start:
+        # with lazy_start, the engines, the chain client and the dedupe index are created by their first use
+        database.start()
+        chain.start()
+        if settings.dedupe:
+            dedupe.start()
+    submitter.start()
+
+@app.on_event("shutdown")
+def shutdown():
+    # pending chain submissions are drained before the worker exits
+    submitter.stop(settings.shutdown_timeout)
+    dedupe.stop()
+    chain.stop()
+    state.stop()
+    bib.shutdown_executor()
+
 class MyCustomException(Exception):
     def __init__(self, message: str):
         self.message = message
@@ -78,11 +111,6 @@ class MyCustomException(Exception):
 async def MyCustomExceptionHandler(request: Request, exception: MyCustomException):
     return JSONResponse (status_code = 500, content = {"message": exception.message})
 
-class HexJsonEncoder(json.JSONEncoder):
-    def default(self, obj):
-        if isinstance(obj, HexBytes):
-            return obj.hex()
-        return super().default(obj)
     
 
 class Entity(BaseModel):
@@ -124,6 +152,41 @@ class Secure(BaseModel):
 class VerifySecureAnonymizeResponse(BaseModel):
     result: bool = Field(None, title="Verify Anonymized data", description="Verify Anonymized data")
 
+AnonymizeBatchResponse_Example = {
+    200: {
+        "description": "Success",
+        "content": {
+            "application/x-ndjson": {
+                "example": '{"content": "3d476e5fd240c4cf69d299b381e45c28024ab8eed735ba45f4f0746c65c7e3eb"}\n'
+                           '{"content": "5b2c3d4b5e0a3f7f4f8ad5a93b1e8e2b7c0cf9d6a1e2f3b4c5d6e7f8091a2b3c"}\n'
+            }
+        }
+    },
+}
+
+SecureAnonymizeBatchResponse_Example = {
+    200: {
+        "description": "Success",
+        "content": {
+            "application/x-ndjson": {
+                "example": '{"content": "b78676db55add54c5f50b3afc66d9255d546873b18d0febdf13430867427ecc4", "salt": "4efc1400-29b8-40b7-9bd7-7fce480b39e8"}\n'
+                           '{"content": "0f1e2d3c4b5a69788796a5b4c3d2e1f00f1e2d3c4b5a69788796a5b4c3d2e1f0", "salt": "9a1c5e1b-7d0f-4a43-8f3e-2b6d9c0e4f11"}\n'
+            }
+        }
+    },
+}
+
+SecureAnonymizeStreamResponse_Example = {
+    200: {
+        "description": "Success",
+        "content": {
+            "application/json": {
+                "example": {"content": "b78676db55add54c5f50b3afc66d9255d546873b18d0febdf13430867427ecc4", "salt": "4efc1400-29b8-40b7-9bd7-7fce480b39e8"}
+            }
+        }
+    },
+}
+
 VerifySecureAnonymizeResponse_Example = {
     200: {
         "description": "Success",
@@ -205,7 +268,7 @@ SetDefaultBlockchain_Example = {
         "description": "Success",
         "content": {
             "application/json": {
-                "example": {"blockchain_id": "Blockchain.ETHEREUM"}
+                "example": {"blockchain_id": "ETHEREUM"}
             }
         }
     },
@@ -244,6 +307,19 @@ RemoveOnchain_Example = {
     },
 }    
 
+RemoveOnChainBulk_Example = {
+    200: {
+        "description": "Success",
+        "content": {
+            "application/x-ndjson": {
+                "example": '{"locator": "72815157071", "datetime": null, "trackings": 1, "transaction_ids": ["0x2826ff7616850240ab914b986e50e353c607ef1014149d6b87f1946883d37668"]}\n'
+                           '{"locator": "36112390804", "datetime": "2021-09-14T19:50:47.108814", "trackings": 0, "transaction_ids": []}\n'
+                           '{"locators": 2, "trackings": 1, "not_found": 1, "erased_at": "2021-09-20T10:02:11.512207"}\n'
+            }
+        }
+    },
+}
+
 
 IndexOnChain_Example = {
     200: {
@@ -289,6 +365,49 @@ IndexSecureOnChain_Example = {
     },
 }    
 
+IndexOnChainBulk_Example = {
+    200: {
+        "description": "Success",
+        "content": {
+            "application/json": {
+                "example": {"index_ids": [251, 252, 253], "duplicates": [], "reused": 0}
+            }
+        }
+    },
+}
+
+VerifySecureImmutableRegisterBulk_Example = {
+    200: {
+        "description": "Success",
+        "content": {
+            "application/json": {
+                "example": {"results": [{"transaction_id": "0xa313998e80da563e74da68fdaeae1708f083276f838689d54c5679d1a88d284a", "result": True},
+                                        {"transaction_id": "0x2826ff7616850240ab914b986e50e353c607ef1014149d6b87f1946883d37668", "result": False},
+                                        {"transaction_id": "0x00", "result": None, "error": "Invalid transaction id"}],
+                            "summary": {"total": 3, "verified": 1, "mismatched": 1, "errors": 1}}
+            }
+        }
+    },
+}
+
+TrackingExport_Example = {
+    200: {
+        "description": "Success",
+        "content": {
+            "application/x-ndjson": {
+                "example": '{"tracking_id": 251, "canonical_data": "{cpf:72815157071, exam:HIV, datetime:2021-09-14T19:50:47.108814, result:POS}", '
+                           '"anonymized_data": "b78676db55add54c5f50b3afc66d9255d546873b18d0febdf13430867427ecc4", "blockchain_id": 2, '
+                           '"transaction_id": "0x2826ff7616850240ab914b986e50e353c607ef1014149d6b87f1946883d37668", '
+                           '"salt": "4efc1400-29b8-40b7-9bd7-7fce480b39e8", "hash_method": "SHA256", "tracking_dt": "2021-09-14T19:50:47.108814", '
+                           '"locator": "72815157071", "status": "CONFIRMED", "merkle_proof": null}\n'
+            },
+            "text/csv": {
+                "example": 'tracking_id,canonical_data,anonymized_data,blockchain_id,transaction_id,salt,hash_method,tracking_dt,locator,status,merkle_proof\r\n'
+            }
+        }
+    },
+}
+
 UnindexOnChain_Example = {
     200: {
         "description": "Success",
@@ -340,6 +459,8 @@ class verifySecureImmutable(BaseModel):
     content: str = Field(None, title="Entity content for request",
                          description="entity represent a object in json format in canonical form.")
     salt: str = Field(None, title="Salt", description="salt value result of UUIDv4 function.")    
+    merkle_proof: Optional[str] = Field(None, title="Merkle proof",
+                                        description="inclusion proof, when the transaction registers a Merkle root (optional, read from tracking when omitted).")
     
 class rectifyOnChain(BaseModel):
     content: str = Field(None, title="Entity content for request",
@@ -359,18 +480,47 @@ class removeOnChain(BaseModel):
 #def root():
 #    return {"PrivacyChain endpoints."}     
     
-"""
-@app.get('/classify/{entity}/{type}')
-def classification(entity: str, type: TypeClassification) -> json:
- 
+ClassifyResponse_Example = {
+    200: {
+        "description": "Success",
+        "content": {
+            "application/json": {
+                "example": {"PII": {"cpf": "72815157071"}, "PPII": {"datetime": "2021-09-14T19:50:47.108814"}, "NPII": {"exam": "HIV", "result": "POS"}}
+            }
+        }
+    },
+}
+
+@app.get('/classify/{entity}/{type}', tags=["Pure Functions"], responses=ClassifyResponse_Example)
+def classification(entity: str, type: TypeClassification, data: Entity = Body(
+    ...,
+    example={
+        "content": "{cpf:72815157071, exam:HIV, datetime:2021-09-14T19:50:47.108814, result:POS}"
+    },
+)) -> json:
+    """
         [EXPANDED] E → ⟦PII, PPII, NPII⟧ \n
         \t Classify the attributes of an entity E in PII, PPII and NPII
         
         [SUMMARIZED] E → ⟦PI, NPII⟧ \n
-        \t Classify the attributes of an entity E in PI and NPII
+        \t Classify the attributes of an entity E in PI and NPII \n
+        \t 'entity' is the entity type, whose schema classifies the attributes.
+    """
+    try:
+        return canonical.get_schema(entity).classify(data.content, type)
+    except Exception as e:
+        raise MyCustomException(message = str(e))
 
-    return entity
-"""
+def canonicalize_records(data: list, entity_type: Optional[str]) -> list:
+    """ Contents to anonymize of the records. With an entity type, each record keeps the canonical form of its content 
+        and only its PI attributes are anonymized. """
+    if not entity_type:
+        return [record.content for record in data]
+    anonymizable = []
+    for record, (canonical_data, pi) in zip(data, canonical.canonicalize_many([record.content for record in data], entity_type)):
+        record.content = canonical_data
+        anonymizable.append(pi)
+    return anonymizable
 
 @app.post('/simpleAnonymize/', tags=["Pure Functions"], response_model=AnonymizeResponse, responses=AnonymizeResponse_Example)
 def simple_anonymize(data: Entity = Body(
@@ -378,21 +528,61 @@ def simple_anonymize(data: Entity = Body(
     example={
         "content": "{cpf:72815157071, exam:HIV, datetime:2021-09-14T19:50:47.108814, result:POS}"
     },
-), hashMethod: Optional[str] = "SHA256") -> json:
+), hashMethod: Optional[str] = "SHA256", entityType: Optional[str] = None) -> json:
     """
         A = α (D, h) \n 
-        \t Anonymizes D by generates A through hash function h (optional), default SHA256.  
+        \t Anonymizes D by generates A through hash function h (optional), default SHA256.  \n
+        \t h may be keyed with the server pepper: HMAC_SHA256, HMAC_SHA512 or BLAKE2B.  \n
+        \t With an entityType, D is canonicalized by the schema of the type and only its PI attributes are anonymized.
     """
     anonymizedData = ""
 
     try:
-        hashData = {'content': hashlib.sha256(data.content.encode()).hexdigest()}
-        hashData = json.dumps(hashData)
-        anonymizedData = json.loads(hashData)
+        anonymizedData = {'content': bib.anonymize(canonicalize_records([data], entityType)[0], hashMethod)}
     except Exception as e:
         raise MyCustomException(message = str(e))
     return anonymizedData
 
+@app.post('/simpleAnonymize/batch/', tags=["Pure Functions"], responses=AnonymizeBatchResponse_Example)
+def simple_anonymize_batch(data: List[Entity] = Body(
+    ...,
+    example=[
+        {"content": "{cpf:72815157071, exam:HIV, datetime:2021-09-14T19:50:47.108814, result:POS}"},
+        {"content": "{cpf:72815157071, exam:COVID, datetime:2021-09-15T08:12:03.341281, result:NEG}"}
+    ],
+), hashMethod: Optional[str] = "SHA256", entityType: Optional[str] = None) -> StreamingResponse:
+    """
+        [A_1..A_n] = α ([D_1..D_n], h) \n 
+        \t Anonymizes a batch of D through hash function h (optional), default SHA256. Digests are streamed back as NDJSON, in order.  \n
+        \t With an entityType, each D is canonicalized by the schema of the type and only its PI attributes are anonymized.
+    """
+    if any(entity.content is None for entity in data):
+        raise HTTPException(status_code=400, detail='Every record must have a content.')
+    try:
+        method = bib.hash_method(hashMethod)
+        contents = canonicalize_records(data, entityType)
+        # digests are computed while streaming: a keyed method without pepper must fail here, not mid-response
+        bib.hash_function(method)
+        digests = bib.anonymize_batch(contents, method)
+    except Exception as e:
+        raise MyCustomException(message = str(e))
+    lines = (json.dumps({'content': digest}) + '\n' for digest in digests)
+    return StreamingResponse(lines, media_type='application/x-ndjson')
+
+@app.post('/simpleAnonymize/stream/', tags=["Pure Functions"], response_model=AnonymizeResponse, responses=AnonymizeResponse_Example)
+async def simple_anonymize_stream(request: Request, hashMethod: Optional[str] = "SHA256") -> json:
+    """
+        A = α (D, h) \n 
+        \t Anonymizes D, sent as the raw request body (UTF-8, canonical form), through hash function h (optional), default SHA256. \n
+        \t D is hashed as it arrives, so large documents are never held in memory. Same A as /simpleAnonymize/.
+    """
+    try:
+        anonymizer = bib.Anonymizer(hashMethod)
+        async for chunk in request.stream():
+            anonymizer.update(chunk)
+        return {'content': anonymizer.hexdigest()}
+    except Exception as e:
+        raise MyCustomException(message = str(e))
 
 @app.post('/secureAnonymize/', tags=["Operations"], response_model=AnonymizeResponse, responses=SecureAnonymizeResponse_Example)
 def secure_anonymize(data: Secure = Body(
@@ -401,10 +591,12 @@ def secure_anonymize(data: Secure = Body(
         "content": "{cpf:72815157071, exam:HIV, datetime:2021-09-14T19:50:47.108814, result:POS}",
         "salt": "4efc1400-29b8-40b7-9bd7-7fce480b39e8"
     },
-), hashMethod: Optional[str] = 'SHA256') -> bool:
+), hashMethod: Optional[str] = 'SHA256', entityType: Optional[str] = None) -> bool:
     """
         A = γ(D,s,h) \n 
-        \t Anonymizes D (with a salt 's') by generates A through hash function h (optional), default SHA256.  
+        \t Anonymizes D (with a salt 's') by generates A through hash function h (optional), default SHA256.  \n
+        \t h may be keyed with the server pepper and the salt stays in D: HMAC_SHA256, HMAC_SHA512 or BLAKE2B.  \n
+        \t With an entityType, D is canonicalized by the schema of the type and only its PI attributes are anonymized.
     """
     try:    
         anonymizedData = ""
@@ -414,18 +606,55 @@ def secure_anonymize(data: Secure = Body(
         else:
             salt = data.salt
 
-        # dict to object Entity
-        s_content = data.content[:-1] + ', salt:' + salt + "}"
-        entit_dict = {
-            'content': s_content
-        }
-
-        entity = Entity(**entit_dict)
-        anonymizedData = simple_anonymize(entity, hashMethod)
+        anonymizedData = {'content': bib.anonymize(bib.salted_content(canonicalize_records([data], entityType)[0], salt), hashMethod)}
     except Exception as e:
         raise MyCustomException(message = str(e))
     return anonymizedData
 
+@app.post('/secureAnonymize/batch/', tags=["Operations"], responses=SecureAnonymizeBatchResponse_Example)
+def secure_anonymize_batch(data: List[Secure] = Body(
+    ...,
+    example=[
+        {"content": "{cpf:72815157071, exam:HIV, datetime:2021-09-14T19:50:47.108814, result:POS}",
+         "salt": "4efc1400-29b8-40b7-9bd7-7fce480b39e8"},
+        {"content": "{cpf:72815157071, exam:COVID, datetime:2021-09-15T08:12:03.341281, result:NEG}"}
+    ],
+), hashMethod: Optional[str] = 'SHA256', entityType: Optional[str] = None) -> StreamingResponse:
+    """
+        [A_1..A_n] = γ([D_1..D_n],[s_1..s_n],h) \n 
+        \t Anonymizes a batch of D (each with a salt 's', generated when omitted) through hash function h (optional), default SHA256. \n
+        \t With an entityType, each D is canonicalized by the schema of the type and only its PI attributes are anonymized. \n
+        \t Digests and salts are streamed back as NDJSON, in order.
+    """
+    if any(secure.content is None for secure in data):
+        raise HTTPException(status_code=400, detail='Every record must have a content.')
+    try:
+        method = bib.hash_method(hashMethod)
+        salts = [secure.salt if secure.salt else bib.salt() for secure in data]
+        contents = [bib.salted_content(content, salt) for content, salt in zip(canonicalize_records(data, entityType), salts)]
+        bib.hash_function(method)
+        digests = bib.anonymize_batch(contents, method)
+    except Exception as e:
+        raise MyCustomException(message = str(e))
+    lines = (json.dumps({'content': digest, 'salt': salt}) + '\n' for digest, salt in zip(digests, salts))
+    return StreamingResponse(lines, media_type='application/x-ndjson')
+
+@app.post('/secureAnonymize/stream/', tags=["Operations"], responses=SecureAnonymizeStreamResponse_Example)
+async def secure_anonymize_stream(request: Request, salt: Optional[str] = None, hashMethod: Optional[str] = 'SHA256') -> json:
+    """
+        A = γ(D,s,h) \n 
+        \t Anonymizes D, sent as the raw request body (UTF-8, canonical form), with a salt 's' (optional, generated when omitted) through hash function h (optional), default SHA256. \n
+        \t D is hashed as it arrives, so large documents are never held in memory. Same A as /secureAnonymize/.
+    """
+    try:
+        salt = salt or bib.salt()
+        anonymizer = bib.Anonymizer(hashMethod, salt)
+        async for chunk in request.stream():
+            anonymizer.update(chunk)
+        return {'content': anonymizer.hexdigest(), 'salt': salt}
+    except Exception as e:
+        raise MyCustomException(message = str(e))
+
 @app.get('/verifySecureAnonymize/', tags=["Pure Functions"], response_model=VerifySecureAnonymizeResponse, responses=VerifySecureAnonymizeResponse_Example)
 def verify_secure_anonymize(data: Verify = Body(
     ...,
@@ -434,7 +663,7 @@ def verify_secure_anonymize(data: Verify = Body(
         "anonymized": "b78676db55add54c5f50b3afc66d9255d546873b18d0febdf13430867427ecc4",
         "salt": "4efc1400-29b8-40b7-9bd7-7fce480b39e8"
     },
-), hashMethod: Optional[str] = 'SHA256') -> bool:
+), hashMethod: Optional[str] = 'SHA256', entityType: Optional[str] = None) -> bool:
     """
         Γ(A,D,s,h)  \n 
         \t Verify whether the value 'A'  is the result of anonimyze secure of D with salt s and hash h    
@@ -446,7 +675,7 @@ def verify_secure_anonymize(data: Verify = Body(
         entit_dict['salt'] = data.salt
 
         secure = Secure(**entit_dict)
-        return_secure_anonymize = secure_anonymize(secure)['content']
+        return_secure_anonymize = secure_anonymize(secure, hashMethod=hashMethod, entityType=entityType)['content']
 
         if (return_secure_anonymize == data.anonymized):
             result = {'result': True}
@@ -470,20 +699,20 @@ def set_default_blockchain(blockchain: Blockchain):
          \t 1: "HYPERLEDGER" \n
          \t 2: "ETHEREUM (default)" \n
          \t 3: "BITCOIN" \n
+         \t 4: "MEMORY" (in-process ledger, for load tests and benchmarks) \n
+         \t Only blockchains with a registered backend can be adopted.
     """
-    blockchain = {
-        1: "HYPERLEDGER",
-        2: "ETHEREUM",
-        3: "BITCOIN"
-    }
-
     try:
-        DEFAULT_BLOCKCHAIN = blockchain.get(int(blockchain.value))
+        backends.get_backend(blockchain)
+        # shared by all the workers
+        state.get_store().set('default_blockchain', blockchain.name)
     except Exception as e:
-        DEFAULT_BLOCKCHAIN = Blockchain.ETHEREUM
         raise MyCustomException(message = str(e))
-    finally:
-        return DEFAULT_BLOCKCHAIN
+    return {'blockchain_id': default_blockchain().name}
+
+def default_blockchain() -> Blockchain:
+    """ Blockchain adopted by setDefaultBlockchain (PRIVACYCHAIN_BLOCKCHAIN until then) """
+    return backends.to_blockchain(state.get_store().get('default_blockchain', settings.blockchain))
 
 @app.post('/registerOnChain/', tags=["Operations"], response_model=RegisterOnChainResponse, responses=RegisterOnChainResponse_Example)
 def register_onchain(data: OnChain = Body(
@@ -491,34 +720,18 @@ def register_onchain(data: OnChain = Body(
     example={
         "content": "b78676db55add54c5f50b3afc66d9255d546873b18d0febdf13430867427ecc4"
     }
-    )) -> json:
+    ), blockchain: Optional[Blockchain] = None) -> json:
     """
         T_β=W(d,β) \n 
-        \t Persist array bytes d in blockchain β
+        \t Persist array bytes d in blockchain β (optional), default the one adopted by setDefaultBlockchain
     """
     try:
-        # HTTPProvider:
-        w3 = Web3(Web3.HTTPProvider('http://127.0.0.1:7545'))
-        
-        # Randomly to get 'to' and 'from' address of the ganache address list
-        lst_address = w3.eth.accounts
-        source = random.choice(lst_address)
-        target = random.choice(lst_address)
-
-        transaction_id_return = ""
-        
-        print("registerOnChain: " + data.content)
+        logger.debug('registerOnChain: %s', data.content)
         
-        # send Transaction
-        transaction_id_hex =  w3.eth.send_transaction({'to': target, 
-                                'from': source, 
-                                'value': 1,
-                                'data': data.content})
+        # send Transaction (in Ethereum, between random accounts of the node)
+        transaction_id = backends.get_backend(blockchain or default_blockchain()).submit(data.content)
         
-        transaction_id = {'transaction_id': transaction_id_hex.hex()}
-        transaction_id_json = json.dumps(transaction_id)
-        transaction_id_return = json.loads(transaction_id_json)
-        return transaction_id_return
+        return {'transaction_id': transaction_id}
     except Exception as e:
         raise MyCustomException(message = str(e))
 
@@ -536,27 +749,21 @@ def get_onchain(data: GetOnChain = Body(
     example={
         "transaction_id": "0x2826ff7616850240ab914b986e50e353c607ef1014149d6b87f1946883d37668"
     }
-    )) -> json:
+    ), blockchain: Optional[Blockchain] = None) -> json:
     """
         d=R(T_β,β) \n 
-        \t In blockchain β, get d bytes array (registered under transaction T_β) 
+        \t In blockchain β (optional, default the one adopted by setDefaultBlockchain), get d bytes array (registered under transaction T_β) 
     """  
     try:
-        # HTTPProvider:
-        w3 = Web3(Web3.HTTPProvider('http://127.0.0.1:7545'))
-    
-        # get Transaction
-        tx = w3.eth.get_transaction(data.transaction_id)
-        tx_dict = dict(tx)
-        tx_str = json.dumps(tx_dict, cls=HexJsonEncoder)
-        tx_json = json.loads(tx_str)
+        # get Transaction (mined transactions are cached)
+        tx_json = backends.get_backend(blockchain or default_blockchain()).get(data.transaction_id)
         
         return GetOnChainResponse.parse_obj(tx_json)
     except Exception as e:
         raise MyCustomException(message = str(e))
     
 @app.post('/indexOnChain/', tags=["Operations"], responses=IndexOnChain_Example)
-def index_onchain(data: "IndexOnChain" = Body(
+async def index_onchain(data: "IndexOnChain" = Body(
     ...,
     example={
         "to_wallet": "0x1eca7eD6322B410219Ef953634442AF33aB05BA3",
@@ -565,25 +772,39 @@ def index_onchain(data: "IndexOnChain" = Body(
         "locator": "72815157071",
         "datetime": "2021-09-14T19:50:47.108814"
     }
-    ), db: Session = Depends(get_db), hashMethod: Optional[str] = 'SHA256') -> json:
+    ), db: AsyncSession = Depends(get_async_db), hashMethod: Optional[str] = 'SHA256', blockchain: Optional[Blockchain] = None,
+    entityType: Optional[str] = None) -> json:
     """
         I(L_E,t,d,β) \n 
         \t Records in the blockchain β the data d of an entity E identified by the locator L_E, associating the timestamp t. 
     """  
     try:     
+        blockchain = blockchain or default_blockchain()
+
         # dict to object Entity
         entit_dict = {}
-        entit_dict['content'] = data.content
+        entit_dict['content'] = canonicalize_records([data], entityType)[0]
         entity = Entity(**entit_dict)
         
-        anonymizedData = simple_anonymize(entity)['content']
-
-        # dict to object OnChain
-        entit_dict = {}
-        entit_dict['content'] = anonymizedData
-        onchain = OnChain(**entit_dict)
-        
-        transaction_id = register_onchain(onchain)['transaction_id']
+        anonymizedData = simple_anonymize(entity, hashMethod=hashMethod)['content']
+
+        merkle_proof = None
+        anchor = await find_anchor(db, blockchain, anonymizedData)
+        if anchor:
+            # identical anonymized data already registered: its transaction is reused
+            transaction_id, merkle_proof = anchor
+            status = TransactionStatus.SUBMITTED.name
+        elif settings.async_submission or settings.merkle_anchoring:
+            transaction_id = None
+            status = TransactionStatus.PENDING.name
+        else:
+            # dict to object OnChain
+            entit_dict = {}
+            entit_dict['content'] = anonymizedData
+            onchain = OnChain(**entit_dict)
+            
+            transaction_id = (await run_in_threadpool(register_onchain, onchain, blockchain))['transaction_id']
+            status = TransactionStatus.SUBMITTED.name
  
         now = datetime.now()
         
@@ -591,25 +812,38 @@ def index_onchain(data: "IndexOnChain" = Body(
         entit_dict = {}
         entit_dict['canonical_data'] = data.content
         entit_dict['anonymized_data'] = anonymizedData       
-        entit_dict['blockchain_id'] = DEFAULT_BLOCKCHAIN
+        entit_dict['blockchain_id'] = blockchain
         entit_dict['transaction_id'] = transaction_id                       
         entit_dict['salt'] = ""                               
-        entit_dict['hash_method'] = HashMethod(DEFAULT_HASHMETHOD).name                                
+        entit_dict['hash_method'] = bib.hash_method(hashMethod).name                                
         entit_dict['tracking_dt'] = now.strftime("%Y-%m-%dT%H:%M:%S.%f")
         entit_dict['locator'] = data.locator
+        entit_dict['status'] = status
+        entit_dict['merkle_proof'] = merkle_proof
         trackingCreate = schemas.TrackingCreate(**entit_dict)
 
-        db_tracking = crud.get_tracking_by_transaction_id(db, transaction_id)
+        if anchor:
+            metrics.DEDUPE_REUSES.inc(endpoint='index')
+            return await async_crud.create_tracking(db=db, tracking=trackingCreate)
+
+        if settings.async_submission or settings.merkle_anchoring:
+            db_tracking = await async_crud.create_tracking(db=db, tracking=trackingCreate)
+            submitter.enqueue(db_tracking.tracking_id, anonymizedData, blockchain, db_tracking.locator)
+            return db_tracking
+
+        db_tracking = await async_crud.get_tracking_by_transaction_id(db, transaction_id)
         
         if db_tracking:
+            metrics.DEDUPE_HITS.inc(endpoint='index')
             raise HTTPException(status_code=400, detail="Transaction already registered")        
-        return crud.create_tracking(db=db, tracking=trackingCreate)
+        await remember_anchors(db, blockchain, [(anonymizedData, transaction_id, None)])
+        return await async_crud.create_tracking(db=db, tracking=trackingCreate)
     except Exception as e:
         raise MyCustomException(message = str(e))
 
 
 @app.post('/indexSecureOnChain/', tags=["Operations"], responses=IndexSecureOnChain_Example)
-def index_secure_onchain(data: IndexOnChainS = Body(
+async def index_secure_onchain(data: IndexOnChainS = Body(
     ...,
     example={
         "to_wallet": "0x1eca7eD6322B410219Ef953634442AF33aB05BA3",
@@ -619,22 +853,36 @@ def index_secure_onchain(data: IndexOnChainS = Body(
         "datetime": "2021-09-14T19:50:47.108814",
         "salt": "e3719002-8c09-4c8f-8da3-9f5ce34c2d76"
     }
-    ), db: Session = Depends(get_db), hashMethod: Optional[str] = 'SHA256') -> json:
+    ), db: AsyncSession = Depends(get_async_db), hashMethod: Optional[str] = 'SHA256', blockchain: Optional[Blockchain] = None,
+    entityType: Optional[str] = None) -> json:
     try:     
+        blockchain = blockchain or default_blockchain()
+
         # dict to object Secure
         secure_dict = {}
-        secure_dict['content'] = data.content
+        secure_dict['content'] = canonicalize_records([data], entityType)[0]
         secure_dict['salt'] = data.salt        
         secure = Secure(**secure_dict)
         
-        secureAnonymizedData = secure_anonymize(secure)['content']
-        
-        # dict to object OnChain
-        entit_dict = {}
-        entit_dict['content'] = secureAnonymizedData
-        onchain = OnChain(**entit_dict)
-       
-        transaction_id = register_onchain(onchain)['transaction_id']
+        secureAnonymizedData = secure_anonymize(secure, hashMethod=hashMethod)['content']
+
+        merkle_proof = None
+        anchor = await find_anchor(db, blockchain, secureAnonymizedData)
+        if anchor:
+            # identical anonymized data already registered: its transaction is reused
+            transaction_id, merkle_proof = anchor
+            status = TransactionStatus.SUBMITTED.name
+        elif settings.async_submission or settings.merkle_anchoring:
+            transaction_id = None
+            status = TransactionStatus.PENDING.name
+        else:
+            # dict to object OnChain
+            entit_dict = {}
+            entit_dict['content'] = secureAnonymizedData
+            onchain = OnChain(**entit_dict)
+           
+            transaction_id = (await run_in_threadpool(register_onchain, onchain, blockchain))['transaction_id']
+            status = TransactionStatus.SUBMITTED.name
 
         now = datetime.now()
         
@@ -642,98 +890,310 @@ def index_secure_onchain(data: IndexOnChainS = Body(
         entit_dict = {}
         entit_dict['canonical_data'] = data.content
         entit_dict['anonymized_data'] = secureAnonymizedData       
-        entit_dict['blockchain_id'] = DEFAULT_BLOCKCHAIN
+        entit_dict['blockchain_id'] = blockchain
         entit_dict['transaction_id'] = transaction_id                       
         entit_dict['salt'] =  data.salt
-        entit_dict['hash_method'] = HashMethod(DEFAULT_HASHMETHOD).name   
+        entit_dict['hash_method'] = bib.hash_method(hashMethod).name   
         entit_dict['tracking_dt'] = now.strftime("%Y-%m-%dT%H:%M:%S.%f")
         entit_dict['locator'] = data.locator                                     
+        entit_dict['status'] = status
+        entit_dict['merkle_proof'] = merkle_proof
         trackingCreate = schemas.TrackingCreate(**entit_dict)
 
-        db_tracking = crud.get_tracking_by_transaction_id(db, transaction_id)
+        if anchor:
+            metrics.DEDUPE_REUSES.inc(endpoint='index')
+            return await async_crud.create_tracking(db=db, tracking=trackingCreate)
+
+        if settings.async_submission or settings.merkle_anchoring:
+            db_tracking = await async_crud.create_tracking(db=db, tracking=trackingCreate)
+            submitter.enqueue(db_tracking.tracking_id, secureAnonymizedData, blockchain, db_tracking.locator)
+            return db_tracking
+
+        db_tracking = await async_crud.get_tracking_by_transaction_id(db, transaction_id)
         
         if db_tracking:
+            metrics.DEDUPE_HITS.inc(endpoint='index')
             raise HTTPException(status_code=400, detail="Transaction already registered")        
-        return crud.create_tracking(db=db, tracking=trackingCreate)
+        await remember_anchors(db, blockchain, [(secureAnonymizedData, transaction_id, None)])
+        return await async_crud.create_tracking(db=db, tracking=trackingCreate)
         
     except Exception as e:
         raise MyCustomException(message = str(e))
             
 
+async def find_anchor(db: AsyncSession, blockchain: Blockchain, anonymized_data: str) -> Optional[tuple]:
+    """ (transaction_id, merkle_proof) of identical anonymized data already registered on the blockchain, when deduplication is on """
+    index = dedupe.get_index()
+    if index is None:
+        return None
+    return (await index.find(db, blockchain, [anonymized_data])).get(anonymized_data)
+
+async def remember_anchors(db: AsyncSession, blockchain: Blockchain, anchors: list):
+    """ Records [(anonymized_data, transaction_id, merkle_proof)] for deduplication. Committed with the trackings """
+    index = dedupe.get_index()
+    if index is not None and anchors:
+        await index.remember(db, blockchain, anchors)
+
+async def index_bulk(db: AsyncSession, data: list, anonymized: list, salts: list, method: HashMethod, blockchain: Blockchain) -> dict:
+    """ Registers the anonymized data on-chain in one batch (or enqueues it) and inserts all trackings in one database transaction. 
+        With deduplication, anonymized data already anchored reuses its transaction and repeated anonymized data is submitted once. """
+    pending = settings.async_submission or settings.merkle_anchoring
+    tracking_dt = datetime.now().strftime("%Y-%m-%dT%H:%M:%S.%f")
+    index = dedupe.get_index()
+    anchors = await index.find(db, blockchain, anonymized) if index is not None else {}
+    # repeated anonymized data of the batch is submitted once
+    new = list(dict.fromkeys(anonymizedData for anonymizedData in anonymized if anonymizedData not in anchors))
+    if pending:
+        submitted = [None] * len(new)
+    else:
+        submitted = await run_in_threadpool(backends.get_backend(blockchain).submit_batch, new)
+    new_transactions = dict(zip(new, submitted))
+    submitted = [new_transactions.get(anonymizedData) for anonymizedData in anonymized]
+    trackings = []
+    duplicates = []
+    reused = 0
+    transaction_ids = {}
+    for record, anonymizedData, salt, transaction_id in zip(data, anonymized, salts, submitted):
+        merkle_proof = None
+        if anonymizedData in anchors:
+            transaction_id, merkle_proof = anchors[anonymizedData]
+            status = TransactionStatus.SUBMITTED.name
+            reused += 1
+        elif pending:
+            status = TransactionStatus.PENDING.name
+        elif isinstance(transaction_id, Exception):
+            # not sent (the rest of the batch may be on chain): stored PENDING and submitted in background
+            logger.warning('index_bulk: %s not submitted: %s', anonymizedData, transaction_id)
+            transaction_id = None
+            status = TransactionStatus.PENDING.name
+        else:
+            status = TransactionStatus.SUBMITTED.name
+            # the same transaction for other anonymized data
+            if transaction_ids.setdefault(transaction_id, anonymizedData) != anonymizedData:
+                duplicates.append(transaction_id)
+                continue
+        trackings.append(schemas.TrackingCreate(canonical_data=record.content,
+                                                anonymized_data=anonymizedData,
+                                                blockchain_id=blockchain,
+                                                transaction_id=transaction_id,
+                                                salt=salt,
+                                                hash_method=method.name,
+                                                tracking_dt=tracking_dt,
+                                                locator=record.locator,
+                                                status=status,
+                                                merkle_proof=merkle_proof))
+
+    existing = await async_crud.get_existing_transaction_ids(db, list(transaction_ids))
+    if existing:
+        duplicates.extend(existing)
+        trackings = [tracking for tracking in trackings if tracking.transaction_id not in existing]
+
+    if duplicates:
+        metrics.DEDUPE_HITS.inc(len(duplicates), endpoint='index_bulk')
+    if reused:
+        metrics.DEDUPE_REUSES.inc(reused, endpoint='index_bulk')
+    await remember_anchors(db, blockchain, [(anonymizedData, transaction_id, None)
+                                            for transaction_id, anonymizedData in transaction_ids.items()
+                                            if transaction_id not in existing])
+    tracking_ids = await async_crud.create_trackings(db, trackings)
+    for tracking_id, tracking in zip(tracking_ids, trackings):
+        if tracking.status == TransactionStatus.PENDING.name:
+            submitter.enqueue(tracking_id, tracking.anonymized_data, blockchain, tracking.locator)
+    return {'index_ids': tracking_ids, 'duplicates': duplicates, 'reused': reused}
+
+@app.post('/indexOnChain/bulk/', tags=["Operations"], responses=IndexOnChainBulk_Example)
+async def index_onchain_bulk(data: List[IndexOnChain] = Body(
+    ...,
+    example=[
+        {
+            "to_wallet": "0x1eca7eD6322B410219Ef953634442AF33aB05BA3",
+            "from_wallet": "0x190e97032E45A1c3E1D7E2B1460b62098A5419ab",
+            "content": "{cpf:72815157071, exam:HIV, datetime:2021-09-14T19:50:47.108814, result:POS}",
+            "locator": "72815157071",
+            "datetime": "2021-09-14T19:50:47.108814"
+        }
+    ]
+    ), db: AsyncSession = Depends(get_async_db), hashMethod: Optional[str] = 'SHA256', blockchain: Optional[Blockchain] = None,
+    entityType: Optional[str] = None) -> json:
+    """
+        [I(L_E,t,d,β)] \n 
+        \t Records a batch of data d in the blockchain β, as indexOnChain, inserting all the trackings in a single database transaction. \n
+        \t Repeated transaction ids are not inserted and are returned in 'duplicates'; 'reused' counts the records whose 
+        anonymized data was already registered (its transaction is reused).
+    """
+    try:
+        method = bib.hash_method(hashMethod)
+        contents = canonicalize_records(data, entityType)
+        anonymized = await run_in_threadpool(lambda: list(bib.anonymize_batch(contents, method)))
+        return await index_bulk(db, data, anonymized, [""] * len(data), method, blockchain or default_blockchain())
+    except Exception as e:
+        raise MyCustomException(message = str(e))
+
+@app.post('/indexSecureOnChain/bulk/', tags=["Operations"], responses=IndexOnChainBulk_Example)
+async def index_secure_onchain_bulk(data: List[IndexOnChainS] = Body(
+    ...,
+    example=[
+        {
+            "to_wallet": "0x1eca7eD6322B410219Ef953634442AF33aB05BA3",
+            "from_wallet": "0x190e97032E45A1c3E1D7E2B1460b62098A5419ab",
+            "content": "{cpf:72815157071, exam:HIV, datetime:2021-09-14T19:50:47.108814, result:POS}",
+            "locator": "72815157071",
+            "datetime": "2021-09-14T19:50:47.108814",
+            "salt": "e3719002-8c09-4c8f-8da3-9f5ce34c2d76"
+        }
+    ]
+    ), db: AsyncSession = Depends(get_async_db), hashMethod: Optional[str] = 'SHA256', blockchain: Optional[Blockchain] = None,
+    entityType: Optional[str] = None) -> json:
+    """
+        [I(L_E,t,γ(d,s),β)] \n 
+        \t Records a batch of data d, securely anonymized with salt s (generated when omitted), as indexSecureOnChain, 
+        inserting all the trackings in a single database transaction. \n
+        \t Repeated transaction ids are not inserted and are returned in 'duplicates'; 'reused' counts the records whose 
+        anonymized data was already registered (its transaction is reused).
+    """
+    try:
+        method = bib.hash_method(hashMethod)
+        salts = [record.salt if record.salt else bib.salt() for record in data]
+        contents = [bib.salted_content(content, salt) for content, salt in zip(canonicalize_records(data, entityType), salts)]
+        anonymized = await run_in_threadpool(lambda: list(bib.anonymize_batch(contents, method)))
+        return await index_bulk(db, data, anonymized, salts, method, blockchain or default_blockchain())
+    except Exception as e:
+        raise MyCustomException(message = str(e))
+
 @app.post('/unindexOnChain/', tags=["Operations"], responses=UnindexOnChain_Example)
-def unindex_onchain(data: UnindexOnChain = Body(
+async def unindex_onchain(data: UnindexOnChain = Body(
     ...,
     example={
         "locator": "72815157071",
         "datetime": "2021-09-14T19:50:47.108814"
     }
-    ), db: Session = Depends(get_db)) -> json:
+    ), db: AsyncSession = Depends(get_async_db)) -> json:
     """
         Δ(L_E,t) \n
         \t Dissociation an previous indexation on-chain for L_E locator in 't' moment. When omiss 't', all registers for L_E are deleted. \n
         \t In pratice is the delete of the tuple 〈L_E |t|β|T_β |…〉 
     """
     try:
-        print('unindexOnChain')
-        print('data.locator: ' + data.locator)
-        print('data.datetime: ' + data.datetime)
         # get list of transactions for deleting
-        db_trackings = crud.get_trackings_for_unindex(db, data.locator, data.datetime)
+        db_trackings = await async_crud.get_trackings_for_unindex(db, data.locator, data.datetime)
         
-        print('db_trackings: ' +  str(len(db_trackings)))
+        logger.debug('unindexOnChain: locator %s, datetime %s: %d trackings', data.locator, data.datetime, len(db_trackings))
         
         if len(db_trackings) == 0:
             raise HTTPException(status_code=400, detail="Nothing to unindex.")        
-        return crud.delete_trackings_for_unindex(db, data.locator, data.datetime) 
+        return await async_crud.delete_trackings_for_unindex(db, data.locator, data.datetime) 
     except Exception as e:
         raise MyCustomException(message = str(e))
 
 @app.get('/verifySecureImmutableRegister/', tags=["Operations"], responses=VerifySecureImmutableRegister_Example)
-def verify_secure_immutable_register(data: verifySecureImmutable = Body(
+async def verify_secure_immutable_register(data: verifySecureImmutable = Body(
     ...,
     example={
         "transaction_id": "0xa313998e80da563e74da68fdaeae1708f083276f838689d54c5679d1a88d284a",
         "content": "{cpf:72815157071, exam:HIV, datetime:2021-09-14T19:50:47.108814, result:POS, salt: e3719002-8c09-4c8f-8da3-9f5ce34c2d76}",
         "salt": "e3719002-8c09-4c8f-8da3-9f5ce34c2d76"
     }
-    ), hashMethod: Optional[str] = 'SHA256') -> bool:
+    ), db: AsyncSession = Depends(get_async_db), hashMethod: Optional[str] = 'SHA256', blockchain: Optional[Blockchain] = None,
+    entityType: Optional[str] = None) -> bool:
     """
         In pratice:\n
         \t 1. Get in blockchain β, the data A' registered with a transactionId (T_β): A'=R(T_β,β), 
             \t \t - call getOnChain(blockchain_id, transaction_id)
         \t 2. Calculate secure anonimization of D, with salt s, and hash h: A=γ(D,s,h), 
             \t \t - call secureAnonymize(content, salt)
-        \t 3. Return True if A=A' or False otherwise.
+        \t 3. Return True if A=A' or False otherwise. \n
+        \t When A' is a Merkle root (Merkle-batched anchoring), return True if the inclusion proof of A leads to A'.
     """
     try:
-        # HTTPProvider:
-        w3 = Web3(Web3.HTTPProvider('http://127.0.0.1:7545'))
-    
-        # get Transaction
-        tx = w3.eth.get_transaction(data.transaction_id)
-        anonymized_data_in_blockchain = tx.input[2:] 
+        # get Transaction (mined transactions are cached)
+        tx = await run_in_threadpool(backends.get_backend(blockchain or default_blockchain()).get, data.transaction_id)
+        anonymized_data_in_blockchain = tx['input'][2:] 
         
         # calculate secure anonimization 
         entit_dict = {}
-        entit_dict['content'] = data.content
+        entit_dict['content'] = canonicalize_records([data], entityType)[0]
         entit_dict['salt'] = data.salt
 
         secure = Secure(**entit_dict)
-        return_secure_anonymize = secure_anonymize(secure)['content']
+        return_secure_anonymize = secure_anonymize(secure, hashMethod=hashMethod)['content']
 
         if (return_secure_anonymize == anonymized_data_in_blockchain):
-            result = {'result': True}
-        else:
-             result = {'result': False}    
-             
-        resultDump = json.dumps(result)
-        resultJson = json.loads(resultDump)
-    
-        return resultJson
+            return {'result': True}
+
+        # anonymized data anchored in a Merkle root
+        proof = data.merkle_proof
+        if not proof:
+            db_tracking = await async_crud.get_tracking_by_anonymized_data(db, data.transaction_id, return_secure_anonymize)
+            proof = db_tracking.merkle_proof if db_tracking else None
+
+        return {'result': bool(proof) and merkle.verify_proof(return_secure_anonymize, proof, anonymized_data_in_blockchain)}
+
+    except Exception as e:
+        raise MyCustomException(message = str(e))
+
+@app.post('/verifySecureImmutableRegister/bulk/', tags=["Operations"], responses=VerifySecureImmutableRegisterBulk_Example)
+async def verify_secure_immutable_register_bulk(data: List[verifySecureImmutable] = Body(
+    ...,
+    example=[
+        {
+            "transaction_id": "0xa313998e80da563e74da68fdaeae1708f083276f838689d54c5679d1a88d284a",
+            "content": "{cpf:72815157071, exam:HIV, datetime:2021-09-14T19:50:47.108814, result:POS}",
+            "salt": "e3719002-8c09-4c8f-8da3-9f5ce34c2d76"
+        }
+    ]
+    ), db: AsyncSession = Depends(get_async_db), hashMethod: Optional[str] = 'SHA256', blockchain: Optional[Blockchain] = None,
+    entityType: Optional[str] = None) -> json:
+    """
+        [Γ(R(T_β,β),D,s,h)] \n
+        \t verifySecureImmutableRegister of a batch of (T_β, D, s): the transactions are read in JSON-RPC batch requests 
+        and the anonymizations are calculated in parallel. \n
+        \t Returns the result of each item, in order (None with an 'error' when the transaction can not be read), and a summary.
+    """
+    try:
+        method = bib.hash_method(hashMethod)
+        if any(item.content is None or item.salt is None for item in data):
+            raise ValueError('content and salt are required')
+        contents = [bib.salted_content(content, item.salt) for content, item in zip(canonicalize_records(data, entityType), data)]
+        anonymized = await run_in_threadpool(lambda: list(bib.anonymize_batch(contents, method)))
+
+        valid_ids = list(dict.fromkeys(item.transaction_id for item in data if is_transaction_id(item.transaction_id)))
+        txs = dict(zip(valid_ids, await run_in_threadpool(backends.get_backend(blockchain or default_blockchain()).get_many, valid_ids)))
+
+        results = []
+        unproved = []
+        for item, anonymizedData in zip(data, anonymized):
+            tx = txs.get(item.transaction_id)
+            if isinstance(tx, Exception):
+                # error of its JSON-RPC item: the other transactions of the batch were read
+                results.append({'transaction_id': item.transaction_id, 'result': None, 'error': str(tx)})
+                continue
+            if tx is None:
+                error = 'Transaction not found' if item.transaction_id in txs else 'Invalid transaction id'
+                results.append({'transaction_id': item.transaction_id, 'result': None, 'error': error})
+                continue
+            results.append({'transaction_id': item.transaction_id, 'result': tx['input'][2:] == anonymizedData})
+            if not results[-1]['result'] and not item.merkle_proof:
+                unproved.append((item.transaction_id, anonymizedData))
+
+        # anonymized data anchored in a Merkle root
+        proofs = await async_crud.get_merkle_proofs(db, unproved) if unproved else {}
+        for result, item, anonymizedData in zip(results, data, anonymized):
+            if result['result'] is False:
+                proof = item.merkle_proof or proofs.get((item.transaction_id, anonymizedData))
+                result['result'] = bool(proof) and merkle.verify_proof(anonymizedData, proof, txs[item.transaction_id]['input'][2:])
+
+        summary = {'total': len(results),
+                   'verified': sum(1 for result in results if result['result'] is True),
+                   'mismatched': sum(1 for result in results if result['result'] is False),
+                   'errors': sum(1 for result in results if result['result'] is None)}
+        return {'results': results, 'summary': summary}
 
     except Exception as e:
         raise MyCustomException(message = str(e))
 
+def is_transaction_id(transaction_id: str) -> bool:
+    return bool(transaction_id) and re.fullmatch(r'0x[0-9a-fA-F]{64}', transaction_id) is not None
+
 
 @app.post('/rectifyOffChain/', tags=["Transactions"], status_code=HTTPStatus.NO_CONTENT)
 def rectify_offchain():
@@ -746,7 +1206,7 @@ def rectify_offchain():
     return Response(status_code=HTTPStatus.NO_CONTENT.value)
 
 @app.post('/rectifyOnChain/', tags=["Transactions"], responses=RectifyOnChain_Example)
-def rectify_onchain(data: rectifyOnChain = Body(
+async def rectify_onchain(data: rectifyOnChain = Body(
     ...,
     example={
         "content": "{cpf:72815157071, exam:HIV, datetime:2021-09-14T19:50:47.108814, result:POS}",
@@ -756,28 +1216,77 @@ def rectify_onchain(data: rectifyOnChain = Body(
         "locator": "72815157071",
         "datetime": "2021-09-14T19:50:47.108814"
     }
-    ), db: Session = Depends(get_db), hashMethod: Optional[str] = 'SHA256') -> json:
-
+    ), db: AsyncSession = Depends(get_async_db), hashMethod: Optional[str] = 'SHA256', blockchain: Optional[Blockchain] = None,
+    entityType: Optional[str] = None) -> json:
+    """
+        Δ(L_E) + I(L_E,t,γ(d,s),β) \n
+        \t Rectifies the data of the entity identified by the locator L_E: dissociates all its previous indexations and indexes the new data d securely. \n
+        \t Both happen in a single database transaction, which is rolled back if the blockchain registration fails.
+    """
     try:     
-        # unindex_onchain all locator's registers
-        entit_dict = {}
-        entit_dict['locator'] = data.locator
-        entit_dict['datetime'] = ""
+        blockchain = blockchain or default_blockchain()
+        salt = data.salt if data.salt else bib.salt()
 
-        locators_registers = UnindexOnChain(**entit_dict)
-        unindex_onchain(locators_registers, db)
-        
-        #index_secure_onchain for locator
-        entit_dict = {}
-        entit_dict['to_wallet'] = 'random'
-        entit_dict['from_wallet'] = 'random'
-        entit_dict['content'] = data.content
-        entit_dict['locator'] = data.locator
-        entit_dict['datetime'] = data.datetime
-        entit_dict['salt'] =  data.salt
-        
-        index_locator = IndexOnChainS(**entit_dict)
-        return index_secure_onchain(index_locator, db)     
+        # dict to object Secure
+        secure_dict = {}
+        secure_dict['content'] = canonicalize_records([data], entityType)[0]
+        secure_dict['salt'] = salt
+        secure = Secure(**secure_dict)
+
+        secureAnonymizedData = secure_anonymize(secure, hashMethod=hashMethod)['content']
+        pending = settings.async_submission or settings.merkle_anchoring
+        anchor = await find_anchor(db, blockchain, secureAnonymizedData)
+        merkle_proof = None
+
+        try:
+            # unindex all locator's registers
+            erased = await async_crud.delete_trackings_returning(db, data.locator, "")
+            if not erased:
+                raise HTTPException(status_code=400, detail="Nothing to unindex.")
+
+            if anchor:
+                # identical anonymized data already registered: its transaction is reused
+                transaction_id, merkle_proof = anchor
+                status = TransactionStatus.SUBMITTED.name
+                metrics.DEDUPE_REUSES.inc(endpoint='rectify')
+            elif pending:
+                transaction_id = None
+                status = TransactionStatus.PENDING.name
+            else:
+                # dict to object OnChain
+                entit_dict = {}
+                entit_dict['content'] = secureAnonymizedData
+                onchain = OnChain(**entit_dict)
+
+                transaction_id = (await run_in_threadpool(register_onchain, onchain, blockchain))['transaction_id']
+                status = TransactionStatus.SUBMITTED.name
+                await remember_anchors(db, blockchain, [(secureAnonymizedData, transaction_id, None)])
+
+            # dict to object schemas.TrackingCreate
+            entit_dict = {}
+            entit_dict['canonical_data'] = data.content
+            entit_dict['anonymized_data'] = secureAnonymizedData
+            entit_dict['blockchain_id'] = blockchain
+            entit_dict['transaction_id'] = transaction_id
+            entit_dict['salt'] = salt
+            entit_dict['hash_method'] = bib.hash_method(hashMethod).name
+            entit_dict['tracking_dt'] = datetime.now()
+            entit_dict['locator'] = data.locator
+            entit_dict['status'] = status
+            entit_dict['merkle_proof'] = merkle_proof
+            trackingCreate = schemas.TrackingCreate(**entit_dict)
+
+            db_tracking = await async_crud.insert_tracking(db, trackingCreate)
+            # after the insert: an anchor reused by the new tracking is kept
+            await async_crud.delete_erased_anchors(db, erased)
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+
+        if pending and not anchor:
+            submitter.enqueue(db_tracking['tracking_id'], secureAnonymizedData, blockchain, db_tracking['locator'])
+        return db_tracking
 
     except Exception as e:
         raise MyCustomException(message = str(e))
@@ -793,13 +1302,13 @@ def remove_offchain():
     return Response(status_code=HTTPStatus.NO_CONTENT.value)
 
 @app.post('/removeOnChain/', tags=["Transactions"], responses=RemoveOnchain_Example)
-def remove_onchain(data: removeOnChain = Body(
+async def remove_onchain(data: removeOnChain = Body(
     ...,
     example={
         "locator": "72815157071",
         "datetime": "2021-09-14T19:50:47.108814"
     }
-    ), db: Session = Depends(get_db), hashMethod: Optional[str] = 'SHA256') -> json:
+    ), db: AsyncSession = Depends(get_async_db), hashMethod: Optional[str] = 'SHA256') -> json:
     try:
         # unindex_onchain all locator's registers
         entit_dict = {}
@@ -807,30 +1316,164 @@ def remove_onchain(data: removeOnChain = Body(
         entit_dict['datetime'] = ""
 
         locators_registers = removeOnChain(**entit_dict)
-        return unindex_onchain(locators_registers, db)
+        return await unindex_onchain(locators_registers, db)
+
+    except Exception as e:
+        raise MyCustomException(message = str(e))
+
+@app.post('/removeOnChain/bulk/', tags=["Transactions"], responses=RemoveOnChainBulk_Example)
+async def remove_onchain_bulk(data: List[removeOnChain] = Body(
+    ...,
+    example=[
+        {"locator": "72815157071"},
+        {"locator": "36112390804", "datetime": "2021-09-14T19:50:47.108814"}
+    ]
+    )) -> StreamingResponse:
+    """
+        [Δ(L_E_1,t_1)..Δ(L_E_n,t_n)] \n
+        \t Right to be forgotten of many entities: dissociates all the indexations of each locator L_E, or only the one in the moment 't' when given. \n
+        \t Trackings are deleted by set-based statements of up to PRIVACYCHAIN_ERASURE_CHUNK_SIZE locators, each chunk in its own database transaction. \n
+        \t The erasure receipt is streamed as NDJSON: the transaction ids removed for each locator, in order, and a final summary line.
+    """
+    try:
+        erasures = erasure_requests([(item.locator, item.datetime) for item in data])
+    except Exception as e:
+        raise MyCustomException(message = str(e))
+    return StreamingResponse(erasure_receipt(erasures), media_type='application/x-ndjson')
 
+@app.post('/removeOnChain/bulk/file/', tags=["Transactions"], responses=RemoveOnChainBulk_Example)
+async def remove_onchain_bulk_file(request: Request) -> StreamingResponse:
+    """
+        [Δ(L_E_1,t_1)..Δ(L_E_n,t_n)] \n
+        \t As /removeOnChain/bulk/, for an erasure list sent as the raw request body (UTF-8 CSV): one locator per line, optionally followed by ',t'. \n
+        \t A first line 'locator' or 'locator,datetime' is taken as a header.
+    """
+    try:
+        rows = [row for row in csv.reader(io.StringIO((await request.body()).decode('utf-8-sig'))) if row and row[0].strip()]
+        if rows and [column.strip().lower() for column in rows[0]] in (['locator'], ['locator', 'datetime']):
+            rows = rows[1:]
+        erasures = erasure_requests([(row[0], row[1] if len(row) > 1 else None) for row in rows])
     except Exception as e:
         raise MyCustomException(message = str(e))
+    return StreamingResponse(erasure_receipt(erasures), media_type='application/x-ndjson')
+
+def erasure_requests(items: list) -> list:
+    """ Distinct (locator, datetime) of an erasure list, in order; datetime None erases all the trackings of the locator """
+    erasures = {}
+    for locator, datetime_ in items:
+        locator = (locator or '').strip()
+        if not locator:
+            raise ValueError('Locator is required.')
+        datetime_ = (datetime_ or '').strip() or None
+        if datetime_:
+            crud.to_timestamp(datetime_)
+        erasures[(locator, datetime_)] = None
+    return list(erasures)
+
+async def erasure_receipt(erasures: list):
+    async with AsyncSessionLocal() as db:
+        size = settings.erasure_chunk_size
+        trackings = 0
+        not_found = 0
+        for i in range(0, len(erasures), size):
+            chunk = erasures[i:i + size]
+            try:
+                deleted_pairs, deleted = await async_crud.delete_trackings_bulk(
+                    db, [locator for locator, datetime_ in chunk if datetime_ is None],
+                    [(locator, datetime_) for locator, datetime_ in chunk if datetime_ is not None])
+                await db.commit()
+            except Exception as e:
+                await db.rollback()
+                logger.error('bulk erasure stopped after %d of %d locators: %s', i, len(erasures), e)
+                yield json.dumps({'error': str(e), 'erased_locators': i, 'locators': len(erasures)}) + '\n'
+                return
+            removed = {}
+            for locator, tracking_dt, transaction_id, _, _ in deleted_pairs:
+                removed.setdefault((locator, tracking_dt), []).append(transaction_id)
+            for locator, tracking_dt, transaction_id, _, _ in deleted:
+                removed.setdefault(locator, []).append(transaction_id)
+            lines = []
+            for locator, datetime_ in chunk:
+                transaction_ids = removed.get((locator, crud.to_timestamp(datetime_)) if datetime_ else locator, [])
+                trackings += len(transaction_ids)
+                not_found += not transaction_ids
+                # trackings still PENDING have no transaction; a Merkle root transaction is listed once
+                lines.append(json.dumps({'locator': locator, 'datetime': datetime_, 'trackings': len(transaction_ids),
+                                         'transaction_ids': [transaction_id for transaction_id in dict.fromkeys(transaction_ids)
+                                                             if transaction_id]}) + '\n')
+            yield ''.join(lines)
+        logger.info('bulk erasure: %d locators, %d trackings', len(erasures), trackings)
+        yield json.dumps({'locators': len(erasures), 'trackings': trackings, 'not_found': not_found,
+                          'erased_at': datetime.now().isoformat()}) + '\n'
+
+EXPORT_COLUMNS = ['tracking_id'] + crud.TRACKING_COLUMNS
+
+async def export_rows(format: str, locator: str, blockchain_id: int, start: datetime, end: datetime):
+    async with AsyncSessionLocal() as db:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        if format == 'csv':
+            writer.writerow(EXPORT_COLUMNS)
+        count = 0
+        async for row in async_crud.stream_trackings(db, locator, blockchain_id, start, end, settings.export_page_size):
+            row = {column: row[column] for column in EXPORT_COLUMNS}
+            row['tracking_dt'] = row['tracking_dt'].isoformat() if row['tracking_dt'] else None
+            if format == 'csv':
+                writer.writerow(row.values())
+            else:
+                buffer.write(json.dumps(row) + '\n')
+            count += 1
+            if count % 500 == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+
+@app.get("/tracking/export", tags=["Operations"], responses=TrackingExport_Example)
+async def export_trackings(format: str = 'ndjson', locator: Optional[str] = None, blockchain_id: Optional[int] = None,
+                           start: Optional[datetime] = None, end: Optional[datetime] = None):
+    """
+        Export of the tracking registers \n
+        \t Streams all the trackings, in tracking_id order, as NDJSON (format=ndjson) or CSV (format=csv). \n
+        \t Optional filters: locator, blockchain_id and tracking timestamp from start (inclusive) to end (exclusive).
+    """
+    if format not in ('ndjson', 'csv'):
+        raise MyCustomException(message = 'Invalid export format: ' + format)
+    media_type = 'text/csv' if format == 'csv' else 'application/x-ndjson'
+    return StreamingResponse(export_rows(format, locator, blockchain_id, start, end), media_type=media_type,
+                             headers={'Content-Disposition': 'attachment; filename=tracking.' + format})
+
+@app.get('/metrics', include_in_schema=False)
+def get_metrics():
+    """
+        Latency histograms (request, hashing, blockchain, database) and counters, in the Prometheus text format
+    """
+    return PlainTextResponse(metrics.exposition(), media_type='text/plain; version=0.0.4')
 
 #@app.post("/tracking/", response_model=schemas.Tracking)
-def create_tracking(tracking: schemas.TrackingCreate, db: Session = Depends(get_db)):
-    db_tracking = crud.get_tracking_by_transaction_id(db, transaction_id=tracking.transaction_id)
+async def create_tracking(tracking: schemas.TrackingCreate, db: AsyncSession = Depends(get_async_db)):
+    db_tracking = await async_crud.get_tracking_by_transaction_id(db, transaction_id=tracking.transaction_id)
     if db_tracking:
         raise HTTPException(status_code=400, detail="Transaction already registered")
-    print("main: post tracking")
-    return crud.create_tracking(db=db, tracking=tracking)
+    logger.debug('post tracking')
+    return await async_crud.create_tracking(db=db, tracking=tracking)
 
 #@app.get("/tracking/", response_model=List[schemas.Tracking])
-def read_trackings(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    trackings = crud.get_trackings(db, skip=skip, limit=limit)
+async def read_trackings(skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_async_db)):
+    trackings = await async_crud.get_trackings(db, skip=skip, limit=limit)
     return trackings
 
-#@app.get("/tracking/{tracking_id}", response_model=schemas.Tracking)
-def read_tracking(tracking_id: int, db: Session = Depends(get_db)):
-    db_tracking = crud.get_tracking(db, tracking_id= tracking_id)
+@app.get("/tracking/{tracking_id}", tags=["Operations"], response_model=schemas.Tracking)
+async def read_tracking(tracking_id: int, db: AsyncSession = Depends(get_async_db)):
+    """
+        Tracking register of an indexation. \n
+        \t With asynchronous submission, the transaction_id is filled and the status moves from PENDING to SUBMITTED and CONFIRMED (or FAILED) in background.
+    """
+    db_tracking = await async_crud.get_tracking(db, tracking_id= tracking_id)
     if db_tracking is None:
         raise HTTPException(status_code=404, detail="Tracking not found")
     return db_tracking
 
 if __name__ == "__main__":
-    uvicorn.run(app, host="127.0.0.1", port=8000)
+    from app import server
+    server.main()
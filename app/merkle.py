@@ -0,0 +1,41 @@
+import hashlib
+import json
+
+# Leaves and internal nodes are hashed with distinct prefixes (as in RFC 6962), so an
+# internal node can never be presented as a leaf. An odd node is promoted to the next level.
+LEAF_PREFIX = b'\x00'
+NODE_PREFIX = b'\x01'
+
+def leaf_hash(digest: str) -> bytes:
+    return hashlib.sha256(LEAF_PREFIX + digest.encode()).digest()
+
+def node_hash(left: bytes, right: bytes) -> bytes:
+    return hashlib.sha256(NODE_PREFIX + left + right).digest()
+
+def merkle_tree(digests: list):
+    """ Returns the root (hex) of the tree of digests and the inclusion proof of each digest """
+    level = [leaf_hash(digest) for digest in digests]
+    proofs = [[] for _ in digests]
+    positions = list(range(len(digests)))
+    while len(level) > 1:
+        for leaf, position in enumerate(positions):
+            sibling = position ^ 1
+            if sibling < len(level):
+                proofs[leaf].append(['L' if sibling < position else 'R', level[sibling].hex()])
+        level = [node_hash(level[i], level[i + 1]) if i + 1 < len(level) else level[i]
+                 for i in range(0, len(level), 2)]
+        positions = [position // 2 for position in positions]
+    return level[0].hex(), [json.dumps(proof) for proof in proofs]
+
+def merkle_root(digests: list) -> str:
+    return merkle_tree(digests)[0]
+
+def verify_proof(digest: str, proof: str, root: str) -> bool:
+    """ True if digest is a leaf of the tree with the given root, according to the proof (as returned by merkle_tree) """
+    node = leaf_hash(digest)
+    for side, sibling in json.loads(proof):
+        if side == 'L':
+            node = node_hash(bytes.fromhex(sibling), node)
+        else:
+            node = node_hash(node, bytes.fromhex(sibling))
+    return node.hex() == root.lower().replace('0x', '', 1)
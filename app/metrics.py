@@ -0,0 +1,132 @@
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+from starlette.routing import Match
+
+logger = logging.getLogger(__name__)
+
+# latency buckets, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REGISTRY = []
+
+def _labels(names: tuple, values: tuple, extra: str = '') -> str:
+    pairs = ['{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"')) for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+class Counter:
+    """ Monotonic counter, by label values """
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def expose(self) -> list:
+        lines = ['# HELP {} {}'.format(self.name, self.documentation), '# TYPE {} counter'.format(self.name)]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append('{}{} {}'.format(self.name, _labels(self.labelnames, key), value))
+        return lines
+
+class Histogram:
+    """ Cumulative histogram of observations (seconds), by label values """
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def observe(self, value: float, **labels):
+        key = tuple(labels[name] for name in self.labelnames)
+        with self._lock:
+            counts, total = self._values.get(key) or ([0] * (len(self.buckets) + 1), 0.0)
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._values[key] = (counts, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - begin, **labels)
+
+    def expose(self) -> list:
+        lines = ['# HELP {} {}'.format(self.name, self.documentation), '# TYPE {} histogram'.format(self.name)]
+        with self._lock:
+            for key, (counts, total) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, count in zip(self.buckets + (float('inf'),), counts):
+                    cumulative += count
+                    le = '+Inf' if bound == float('inf') else repr(bound)
+                    lines.append('{}_bucket{} {}'.format(self.name, _labels(self.labelnames, key, 'le="' + le + '"'), cumulative))
+                lines.append('{}_sum{} {}'.format(self.name, _labels(self.labelnames, key), total))
+                lines.append('{}_count{} {}'.format(self.name, _labels(self.labelnames, key), cumulative))
+        return lines
+
+def exposition() -> str:
+    """ All metrics in the Prometheus text format (version 0.0.4) """
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.expose())
+    return '\n'.join(lines) + '\n'
+
+REQUEST_SECONDS = Histogram('privacychain_request_duration_seconds', 'Total request time, by endpoint', ('method', 'endpoint', 'status'))
+HASH_SECONDS = Histogram('privacychain_hash_duration_seconds', 'Anonymization (hashing) time, pool processes included', ('method',))
+CHAIN_SECONDS = Histogram('privacychain_chain_duration_seconds', 'Blockchain backend call time', ('backend', 'operation'))
+DB_SECONDS = Histogram('privacychain_db_query_duration_seconds', 'Tracking database statement time', ('statement',))
+CHAIN_ERRORS = Counter('privacychain_chain_errors_total', 'Failed blockchain backend calls', ('backend', 'operation'))
+DEDUPE_HITS = Counter('privacychain_dedupe_hits_total', 'Indexations not inserted because their transaction was already registered', ('endpoint',))
+DEDUPE_REUSES = Counter('privacychain_dedupe_reuses_total', 'Indexations that reused the transaction of identical anonymized data', ('endpoint',))
+
+class RequestMetricsMiddleware:
+    """ ASGI middleware: total time of each request (until the response is sent), by route """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        begin = time.perf_counter()
+        status = [500]
+
+        async def send_observed(message):
+            if message['type'] == 'http.response.start':
+                status[0] = message['status']
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_observed)
+        finally:
+            elapsed = time.perf_counter() - begin
+            endpoint = route_path(scope)
+            REQUEST_SECONDS.observe(elapsed, method=scope['method'], endpoint=endpoint, status=status[0])
+            logger.debug('%s %s %d %.1f ms', scope['method'], endpoint, status[0], elapsed * 1000)
+
+def route_path(scope) -> str:
+    """ Path template of the route of a request (bounded label values, unlike the request paths) """
+    for route in scope['app'].router.routes:
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return route.path
+    return 'unmatched'
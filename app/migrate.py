@@ -0,0 +1,66 @@
+# PrivacyChain schema migrations
+# Applies, in order, the migrations/NNN_*.sql files not yet recorded in the schema_version table.
+# usage: python -m app.migrate [--list]
+
+import argparse
+import os
+import re
+
+from sqlalchemy import text
+
+from app.database import create_tables, engine
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'migrations')
+
+def migrations() -> list:
+    """ (version, path) of the migration files, in order """
+    found = []
+    for name in os.listdir(MIGRATIONS_DIR):
+        match = re.match(r'^(\d+)_.*\.sql$', name)
+        if match:
+            found.append((int(match.group(1)), os.path.join(MIGRATIONS_DIR, name)))
+    return sorted(found)
+
+def statements(sql: str) -> list:
+    # migrations are plain DDL: one statement per ';' at the end of a line
+    sql = '\n'.join(line for line in sql.splitlines() if not line.strip().startswith('--'))
+    return [statement.strip() for statement in re.split(r';\s*$', sql, flags=re.MULTILINE) if statement.strip()]
+
+def applied_versions(connection) -> set:
+    connection.execute(text('CREATE TABLE IF NOT EXISTS schema_version '
+                            '(version integer PRIMARY KEY, applied_at timestamp without time zone DEFAULT now())'))
+    return {row[0] for row in connection.execute(text('SELECT version FROM schema_version'))}
+
+def connect():
+    # autocommit, so that indexes can be created CONCURRENTLY (without locking the tracking table)
+    return engine.connect().execution_options(isolation_level='AUTOCOMMIT')
+
+def migrate():
+    if engine.dialect.name != 'postgresql':
+        # SQLite: the tables are created from the models, at startup
+        create_tables()
+        print('migrate: tables of the models created on ' + engine.dialect.name)
+        return
+    with connect() as connection:
+        applied = applied_versions(connection)
+        for version, path in migrations():
+            if version in applied:
+                continue
+            print('migrate: applying ' + os.path.basename(path))
+            with open(path) as file:
+                for statement in statements(file.read()):
+                    connection.execute(text(statement))
+            connection.execute(text('INSERT INTO schema_version (version) VALUES (:version)'), {'version': version})
+        print('migrate: schema at version ' + str(max([version for version, _ in migrations()], default=0)))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Apply PrivacyChain schema migrations')
+    parser.add_argument('--list', action='store_true', help='only list the migrations and whether they are applied')
+    args = parser.parse_args()
+    if args.list:
+        with connect() as connection:
+            applied = applied_versions(connection)
+        for version, path in migrations():
+            print(('applied  ' if version in applied else 'pending  ') + os.path.basename(path))
+    else:
+        migrate()
@@ -1,15 +1,39 @@
-from sqlalchemy import Boolean, Column, ForeignKey, Integer, String
+import datetime as dt
+
+from sqlalchemy import Boolean, Column, DateTime, ForeignKey, Index, Integer, String
 from .database import Base
 
 class Tracking(Base):
     __tablename__ = "tracking"
     
-    tracking_id = Column(Integer, primary_key=True, index=True, autoincrement=True)
+    tracking_id = Column(Integer, primary_key=True, autoincrement=True)
     canonical_data = Column(String)
     anonymized_data = Column(String)
-    blockchain_id = Column(Integer, index=True) 
+    blockchain_id = Column(Integer)
     transaction_id = Column(String)
     salt = Column(String)
     hash_method = Column(String)
-    tracking_dt = Column(String)
+    tracking_dt = Column(DateTime)
     locator = Column(String)
+    status = Column(String)
+    merkle_proof = Column(String)
+    # time of the last status change (receipt timeout of the SUBMITTED trackings)
+    status_dt = Column(DateTime, default=dt.datetime.now)
+    # worker submitting the tracking (SUBMITTING)
+    claimed_by = Column(String)
+
+    # see migrations/
+    __table_args__ = (
+        Index('tracking_status_idx', status),
+        Index('tracking_locator_tracking_dt_idx', locator, tracking_dt),
+        Index('tracking_transaction_id_idx', transaction_id),
+    )
+
+class Anchor(Base):
+    """ Transaction of an anonymized data registered on a blockchain (digest-level deduplication) """
+    __tablename__ = "anchor"
+
+    blockchain_id = Column(Integer, primary_key=True)
+    anonymized_data = Column(String, primary_key=True)
+    transaction_id = Column(String, nullable=False)
+    merkle_proof = Column(String)
@@ -0,0 +1,66 @@
+import random
+import threading
+import time
+
+from app.config import settings
+
+class NonceManager:
+    """ Nonces of a pool of sender accounts, counted in process.
+
+        An account is synchronized with the node (its pending transaction count) on first use, after a failed send and
+        every resync_interval seconds, but only while none of its transactions is in flight: the gaps left by failed
+        sends and dropped transactions are filled by the next transactions. Transactions go to the account with fewest
+        in flight, and an account waiting for synchronization gets none until its transactions in flight are done.
+    """
+
+    def __init__(self, client, addresses: list, resync_interval: float):
+        self.client = client
+        self.addresses = list(addresses)
+        self.resync_interval = resync_interval
+        self._next = {}
+        self._synced_at = {}
+        self._inflight = {address: 0 for address in self.addresses}
+        self._stale = set()
+        self._lock = threading.Lock()
+
+    def acquire(self, count: int = 1) -> tuple:
+        """ (address, first nonce) of count consecutive nonces of the least busy account """
+        with self._lock:
+            address = min(self.addresses, key=lambda address: (address in self._stale and self._inflight[address] > 0,
+                                                               self._inflight[address], random.random()))
+            if self._inflight[address] == 0 and (address not in self._next or address in self._stale or
+                                                 time.monotonic() - self._synced_at[address] > self.resync_interval):
+                self._next[address] = self.client.w3.eth.get_transaction_count(address, 'pending')
+                self._synced_at[address] = time.monotonic()
+                self._stale.discard(address)
+            nonce = self._next[address]
+            self._next[address] += count
+            self._inflight[address] += count
+            return address, nonce
+
+    def release(self, address: str, count: int, sent: bool):
+        """ The transactions of acquire are done; when they were not (all) sent, the account is synchronized again """
+        with self._lock:
+            self._inflight[address] -= count
+            if not sent:
+                self._stale.add(address)
+
+def sender_keys() -> list:
+    """ Private keys of the sender accounts: PRIVACYCHAIN_CHAIN_PRIVATE_KEYS and/or derived from PRIVACYCHAIN_CHAIN_MNEMONIC """
+    keys = [key.strip() for key in (settings.chain_private_keys or '').split(',') if key.strip()]
+    if settings.chain_mnemonic:
+        from eth_account import Account
+        Account.enable_unaudited_hdwallet_features()
+        for i in range(settings.chain_mnemonic_accounts):
+            keys.append(Account.from_mnemonic(settings.chain_mnemonic, account_path="m/44'/60'/0'/0/" + str(i)).key.hex())
+    return keys
+
+def intrinsic_gas(data: str) -> int:
+    """ Gas of a value transfer with data (hex), at the highest (pre-Istanbul) price of non-zero bytes """
+    data = bytes.fromhex(data[2:] if data.startswith('0x') else data)
+    return 21000 + sum(4 if byte == 0 else 68 for byte in data)
+
+def sign_transactions(key: str, transactions: list) -> list:
+    """ Raw signed transactions (hex). Module level, so that batches can be signed in the process pool """
+    from eth_account import Account
+    return [Account.sign_transaction(transaction, key).rawTransaction.hex() for transaction in transactions]
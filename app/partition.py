@@ -0,0 +1,168 @@
+# PrivacyChain tracking storage layout
+# Converts the tracking table (script.sql) to a partitioned layout, or back:
+#   hash     partitioned by hash of the locator: the trackings of an entity are in one partition, so the queries by
+#            locator (unindex, rectify, remove: right to be forgotten) only read, delete and vacuum that partition
+#   archive  partitioned by month of tracking_dt, each month partitioned by hash of the locator: old months stay
+#            untouched by the current load, erasures still reach a single partition per month
+#   plain    one table (script.sql)
+# usage: python -m app.partition [--status] [--layout hash|archive|plain] [--partitions 16] [--months-ahead 3] [--drop-old]
+#        python -m app.partition --add-months 3     (archive layout: creates the partitions of the coming months)
+#
+# The conversion copies the trackings in one transaction that locks the table: stop the API (or run it in a
+# maintenance window). The previous table is kept as tracking_old (its partitions and indexes with the suffix _old)
+# until --drop-old, or until dropped by hand once the conversion is checked.
+
+import argparse
+import datetime as dt
+
+from sqlalchemy import text
+
+from app.crud import TRACKING_COLUMNS
+from app.database import engine
+
+LAYOUTS = ('plain', 'hash', 'archive')
+
+COLUMNS_DDL = '''
+    tracking_id integer NOT NULL GENERATED BY DEFAULT AS IDENTITY,
+    canonical_data character varying COLLATE pg_catalog."default",
+    anonymized_data character varying COLLATE pg_catalog."default",
+    blockchain_id integer,
+    transaction_id character varying COLLATE pg_catalog."default",
+    salt character varying COLLATE pg_catalog."default",
+    hash_method character varying COLLATE pg_catalog."default",
+    tracking_dt timestamp without time zone DEFAULT now(),
+    locator character varying COLLATE pg_catalog."default",
+    status character varying COLLATE pg_catalog."default",
+    merkle_proof character varying COLLATE pg_catalog."default",
+    status_dt timestamp without time zone DEFAULT now(),
+    claimed_by character varying COLLATE pg_catalog."default"'''
+
+def current_layout(connection) -> str:
+    strategy = connection.execute(text(
+        "SELECT partstrat FROM pg_partitioned_table WHERE partrelid = to_regclass('tracking')")).scalar()
+    return {None: 'plain', 'h': 'hash', 'r': 'archive'}.get(strategy, strategy)
+
+def partitions(connection, table: str = 'tracking') -> list:
+    """ (name, bounds, estimated rows) of the leaf partitions of the table """
+    return list(connection.execute(text(
+        "SELECT c.relname, pg_get_expr(c.relpartbound, c.oid), c.reltuples::bigint "
+        "FROM pg_partition_tree(to_regclass(:table)) p JOIN pg_class c ON c.oid = p.relid "
+        "WHERE p.isleaf AND p.level > 0 ORDER BY c.relname"), {'table': table}))
+
+def month(value: dt.date, offset: int = 0) -> dt.date:
+    months = value.year * 12 + value.month - 1 + offset
+    return dt.date(months // 12, months % 12 + 1, 1)
+
+def hash_partitions(connection, parent: str, count: int):
+    for remainder in range(count):
+        connection.execute(text('CREATE TABLE {0}_h{1:02d} PARTITION OF {0} FOR VALUES WITH (MODULUS {2}, REMAINDER {1})'
+                                .format(parent, remainder, count)))
+
+def month_partition(connection, parent: str, first: dt.date, count: int) -> bool:
+    """ Creates the partition of the month (hash partitioned by locator), unless it exists """
+    name = 'tracking_{:%Ym%m}'.format(first)
+    if connection.execute(text('SELECT to_regclass(:name)'), {'name': name}).scalar():
+        return False
+    connection.execute(text("CREATE TABLE {} PARTITION OF {} FOR VALUES FROM ('{}') TO ('{}') PARTITION BY HASH (locator)"
+                            .format(name, parent, first, month(first, 1))))
+    hash_partitions(connection, name, count)
+    return True
+
+def rename_old(connection):
+    """ tracking becomes tracking_old: its partitions, indexes and identity sequence get the suffix _old """
+    if connection.execute(text("SELECT to_regclass('tracking_old')")).scalar():
+        raise SystemExit('partition: tracking_old exists (previous conversion): drop it first')
+    # pg_partition_tree is empty for a plain table
+    relations = [row[0] for row in connection.execute(text(
+        "SELECT relid::regclass::text FROM pg_partition_tree('tracking')"))] or ['tracking']
+    for name in [row[0] for row in connection.execute(text(
+            "SELECT indexrelid::regclass::text FROM pg_index WHERE indrelid::regclass::text = ANY(:relations)"),
+            {'relations': relations})]:
+        connection.execute(text('ALTER INDEX {0} RENAME TO {0}_old'.format(name)))
+    sequence = connection.execute(text("SELECT pg_get_serial_sequence('tracking', 'tracking_id')")).scalar()
+    for name in relations:
+        connection.execute(text('ALTER TABLE {0} RENAME TO {0}_old'.format(name)))
+    if sequence:
+        connection.execute(text('ALTER SEQUENCE {0} RENAME TO {1}_old'.format(sequence, sequence.split('.')[-1])))
+
+def convert(layout: str, count: int, months_ahead: int, drop_old: bool):
+    with engine.begin() as connection:
+        previous = current_layout(connection)
+        connection.execute(text('LOCK TABLE tracking IN ACCESS EXCLUSIVE MODE'))
+        comments = list(connection.execute(text(
+            "SELECT a.attname, col_description(a.attrelid, a.attnum) FROM pg_attribute a "
+            "WHERE a.attrelid = to_regclass('tracking') AND a.attnum > 0 AND NOT a.attisdropped")))
+        table_comment = connection.execute(text("SELECT obj_description(to_regclass('tracking'), 'pg_class')")).scalar()
+        rename_old(connection)
+
+        partition_by = {'plain': '', 'hash': ' PARTITION BY HASH (locator)', 'archive': ' PARTITION BY RANGE (tracking_dt)'}
+        connection.execute(text('CREATE TABLE tracking ({}){}'.format(COLUMNS_DDL, partition_by[layout])))
+        if layout == 'hash':
+            hash_partitions(connection, 'tracking', count)
+        elif layout == 'archive':
+            first = connection.execute(text('SELECT min(tracking_dt) FROM tracking_old')).scalar() or dt.datetime.now()
+            first = month(first.date())
+            last = month(dt.date.today(), months_ahead)
+            while first <= last:
+                month_partition(connection, 'tracking', first, count)
+                first = month(first, 1)
+            # trackings without timestamp, or beyond the months created
+            connection.execute(text('CREATE TABLE tracking_default PARTITION OF tracking DEFAULT'))
+
+        # the primary key of a partitioned table would have to include the partition key, which may be NULL:
+        # tracking_id stays unique through the identity sequence
+        if layout == 'plain':
+            connection.execute(text('ALTER TABLE tracking ADD CONSTRAINT tracking_pkey PRIMARY KEY (tracking_id)'))
+        else:
+            connection.execute(text('CREATE INDEX tracking_tracking_id_idx ON tracking USING btree (tracking_id)'))
+        columns = ', '.join(['tracking_id'] + TRACKING_COLUMNS + ['status_dt', 'claimed_by'])
+        copied = connection.execute(text('INSERT INTO tracking ({0}) SELECT {0} FROM tracking_old'.format(columns))).rowcount
+        # indexes of models.Tracking (migrations/), built after the copy
+        connection.execute(text('CREATE INDEX tracking_status_idx ON tracking USING btree (status)'))
+        connection.execute(text('CREATE INDEX tracking_locator_tracking_dt_idx ON tracking USING btree (locator, tracking_dt)'))
+        connection.execute(text('CREATE INDEX tracking_transaction_id_idx ON tracking USING btree (transaction_id)'))
+        connection.execute(text("SELECT setval(pg_get_serial_sequence('tracking', 'tracking_id'), "
+                                "(SELECT coalesce(max(tracking_id), 0) + 1 FROM tracking), false)"))
+        if table_comment:
+            connection.execute(text("COMMENT ON TABLE tracking IS :comment").bindparams(comment=table_comment))
+        for column, comment in comments:
+            if comment:
+                connection.execute(text('COMMENT ON COLUMN tracking.{} IS :comment'.format(column)).bindparams(comment=comment))
+        if drop_old:
+            connection.execute(text('DROP TABLE tracking_old'))
+    print('partition: tracking converted from {} to {} layout ({} trackings)'.format(previous, layout, copied))
+    if not drop_old:
+        print('partition: previous table kept as tracking_old (DROP TABLE tracking_old once checked)')
+
+def add_months(months_ahead: int, count: int):
+    with engine.begin() as connection:
+        if current_layout(connection) != 'archive':
+            raise SystemExit('partition: tracking is not in archive layout')
+        first = month(dt.date.today())
+        for i in range(months_ahead + 1):
+            if month_partition(connection, 'tracking', month(first, i), count):
+                print('partition: created tracking_{:%Ym%m}'.format(month(first, i)))
+
+def status():
+    with engine.connect() as connection:
+        print('partition: tracking in {} layout'.format(current_layout(connection)))
+        for name, bounds, rows in partitions(connection):
+            print('{:<28} {:>12} {}'.format(name, max(rows, 0), bounds))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Convert the PrivacyChain tracking table to a partitioned layout')
+    parser.add_argument('--status', action='store_true', help='only show the layout and the partitions')
+    parser.add_argument('--layout', choices=LAYOUTS, help='converts the tracking table to this layout')
+    parser.add_argument('--partitions', type=int, default=16, help='hash partitions by locator (of each month, in archive layout)')
+    parser.add_argument('--months-ahead', type=int, default=3, help='archive layout: months created beyond the current one')
+    parser.add_argument('--add-months', type=int, metavar='MONTHS', help='archive layout: creates the partitions of the coming months')
+    parser.add_argument('--drop-old', action='store_true', help='drops the previous table after the conversion')
+    args = parser.parse_args()
+    if engine.dialect.name != 'postgresql':
+        raise SystemExit('partition: partitioned layouts need PostgreSQL')
+    if args.layout:
+        convert(args.layout, args.partitions, args.months_ahead, args.drop_old)
+    elif args.add_months is not None:
+        add_months(args.add_months, args.partitions)
+    else:
+        status()
@@ -1,3 +1,4 @@
+from datetime import datetime
 from typing import List, Optional
 from pydantic import BaseModel
 
@@ -5,11 +6,13 @@ class TrackingBase(BaseModel):
     canonical_data: str
     anonymized_data: str
     blockchain_id: int
-    transaction_id: str
+    transaction_id: Optional[str]
     salt: str
     hash_method: str
-    tracking_dt: str
+    tracking_dt: datetime
     locator: str
+    status: Optional[str]
+    merkle_proof: Optional[str]
     
 class TrackingCreate(TrackingBase):
     pass
@@ -19,11 +22,13 @@ class Tracking(TrackingBase):
     canonical_data: str
     anonymized_data: str
     blockchain_id: int
-    transaction_id: str
+    transaction_id: Optional[str]
     salt: str
     hash_method: str
-    tracking_dt: str
+    tracking_dt: datetime
     locator: str
+    status: Optional[str]
+    merkle_proof: Optional[str]
     
     class Config:
         orm_mode = True
\ No newline at end of file
@@ -0,0 +1,42 @@
+# PrivacyChain server
+# Runs the API in worker processes (one per cpu by default) that share the port and the state store (default blockchain).
+# usage: python -m app.server [--host 0.0.0.0] [--port 8000] [--workers 8]
+#
+# On SIGTERM or SIGINT, the workers stop accepting connections and finish the requests in progress. They then drain
+# the pending chain submissions (for up to PRIVACYCHAIN_SHUTDOWN_TIMEOUT seconds) before exiting.
+
+import argparse
+import os
+import tempfile
+
+import uvicorn
+
+from app.config import settings
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the PrivacyChain API')
+    parser.add_argument('--host', default=settings.host)
+    parser.add_argument('--port', type=int, default=settings.port)
+    parser.add_argument('--workers', type=int, default=settings.workers, help='worker processes (default: one per cpu)')
+    args = parser.parse_args()
+
+    cpus = os.cpu_count() or 1
+    workers = args.workers or cpus
+    # the workers read their settings from the environment
+    if workers > 1:
+        if not settings.state_path:
+            # a state store for this launch only, as the in-process state of a single worker
+            path = os.path.join(tempfile.gettempdir(), 'privacychain_state_{}.db'.format(args.port))
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+            os.environ['PRIVACYCHAIN_STATE_PATH'] = path
+        if settings.batch_pool_workers is None:
+            # one hashing pool per worker: share the cpus among them
+            os.environ['PRIVACYCHAIN_BATCH_POOL_WORKERS'] = str(max(1, cpus // workers))
+
+    uvicorn.run('app.main:app', host=args.host, port=args.port, workers=workers,
+                log_level=settings.log_level.lower())
+
+if __name__ == "__main__":
+    main()
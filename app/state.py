@@ -0,0 +1,60 @@
+import sqlite3
+import threading
+
+from app.config import settings
+
+class StateStore:
+    """ Small key/value state shared by the workers of a host (SQLite file), or kept in this process (no path).
+
+        Values are cached in the process and read again only when another worker has written (PRAGMA data_version).
+    """
+
+    def __init__(self, path: str = None):
+        self._values = {}
+        self._version = None
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=10)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value TEXT)')
+
+    def get(self, key: str, default: str = None) -> str:
+        with self._lock:
+            if self._db is not None:
+                version = self._db.execute('PRAGMA data_version').fetchone()[0]
+                if version != self._version:
+                    self._values = dict(self._db.execute('SELECT key, value FROM state'))
+                    self._version = version
+            return self._values.get(key, default)
+
+    def set(self, key: str, value: str):
+        with self._lock:
+            if self._db is not None:
+                self._db.execute('INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)', (key, value))
+            self._values[key] = value
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
+
+_store = None
+_store_lock = threading.Lock()
+
+def start() -> StateStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = StateStore(settings.state_path)
+    return _store
+
+def stop():
+    global _store
+    with _store_lock:
+        if _store is not None:
+            _store.close()
+            _store = None
+
+def get_store() -> StateStore:
+    return _store or start()
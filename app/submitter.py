@@ -0,0 +1,284 @@
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+import app.backends as backends
+import app.dedupe as dedupe
+import app.merkle as merkle
+from app import crud
+from app.config import settings
+from app.database import SessionLocal
+from app.utils import Blockchain, TransactionStatus
+
+logger = logging.getLogger(__name__)
+
+class TransactionSubmitter:
+    """ Submits anonymized data to the blockchain in background and tracks the receipts of the transactions.
+
+        With merkle_anchoring, the anonymized data collected during batch_interval (up to batch_size) is
+        registered in a single transaction with the root of its Merkle tree.
+
+        Each batch is claimed in the database before it is submitted (SUBMITTING, claimed by this worker for lease
+        seconds): the trackings are submitted by a single worker, and those left behind by a stopped or crashed worker
+        are taken over by any worker once their lease expires.
+    """
+
+    def __init__(self, batch_size: int, max_attempts: int, poll_interval: float,
+                 merkle_anchoring: bool = False, batch_interval: float = 0, receipt_timeout: float = 600,
+                 lease: float = 60):
+        self.queue = queue.Queue()
+        self.batch_size = batch_size
+        self.merkle_anchoring = merkle_anchoring
+        self.batch_interval = batch_interval
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.receipt_timeout = receipt_timeout
+        self.lease = lease
+        self.owner = '{}:{}'.format(socket.gethostname(), os.getpid())
+        self._receipts_after = 0
+        # tracking_id of the enqueued items, not enqueued again by the recovery
+        self._queued = set()
+        self._queued_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._threads = []
+
+    def start(self):
+        try:
+            self._recover()
+        except Exception as e:
+            logger.error('could not recover pending trackings: %s', e)
+        self._threads = [threading.Thread(target=self._submit_loop, name='privacychain-submitter', daemon=True),
+                         threading.Thread(target=self._receipt_loop, name='privacychain-receipts', daemon=True)]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout: float = None):
+        """ Stops after submitting everything already enqueued (or after timeout seconds) """
+        self._stopping.set()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for thread in self._threads:
+            thread.join(None if deadline is None else max(0, deadline - time.monotonic()))
+        if not self.queue.empty():
+            # taken over by the other workers, or the next start, once their lease expires
+            logger.warning('%d submissions left pending', self.queue.qsize())
+
+    def enqueue(self, tracking_id: int, content: str, blockchain: Blockchain, locator: str = None):
+        # the locator of the tracking selects its partition when the transaction is updated (app/partition.py)
+        self._put((tracking_id, content, 0, backends.to_blockchain(blockchain), locator))
+
+    def _put(self, item: tuple):
+        with self._queued_lock:
+            if item[0] in self._queued:
+                return
+            self._queued.add(item[0])
+        self.queue.put(item)
+
+    def _take(self, item: tuple) -> tuple:
+        with self._queued_lock:
+            self._queued.discard(item[0])
+        return item
+
+    def _recover(self):
+        # trackings left PENDING or SUBMITTING by a stopped or crashed worker (of this or a previous launch)
+        db = SessionLocal()
+        try:
+            for tracking in crud.get_unclaimed_trackings(db, self.lease):
+                self.enqueue(tracking.tracking_id, tracking.anonymized_data, tracking.blockchain_id, tracking.locator)
+        finally:
+            db.close()
+
+    def _claim(self, batch: list) -> list:
+        """ The items of the batch claimed by this worker; the others are submitted by another one """
+        db = SessionLocal()
+        try:
+            claimed = crud.claim_trackings(db, [item[0] for item in batch], self.owner, self.lease)
+        except Exception as e:
+            logger.warning('could not claim %d trackings: %s', len(batch), e)
+            claimed = set()
+            updates = []
+            for item in batch:
+                updates.extend(self._retry(*item))
+            self._update(updates)
+        finally:
+            db.close()
+        if len(claimed) < len(batch):
+            logger.debug('%d trackings claimed by another worker', len(batch) - len(claimed))
+        return [item for item in batch if item[0] in claimed]
+
+    def _submit_loop(self):
+        while True:
+            try:
+                batch = [self._take(self.queue.get(timeout=0.5))]
+            except queue.Empty:
+                if self._stopping.is_set():
+                    return
+                continue
+            deadline = time.monotonic() + self.batch_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                try:
+                    if timeout > 0 and not self._stopping.is_set():
+                        batch.append(self._take(self.queue.get(timeout=timeout)))
+                    else:
+                        batch.append(self._take(self.queue.get_nowait()))
+                except queue.Empty:
+                    break
+            batch = self._claim(batch)
+            if not batch:
+                continue
+            if self.merkle_anchoring:
+                # one Merkle root per blockchain
+                for blockchain in dict.fromkeys(item[3] for item in batch):
+                    self._anchor([item for item in batch if item[3] == blockchain], blockchain)
+            else:
+                self._submit(batch)
+
+    def _submit(self, batch: list):
+        updates = []
+        anchors = {}
+        # one submit_batch per blockchain (batched JSON-RPC requests, pooled nonces, local signing)
+        for blockchain in dict.fromkeys(item[3] for item in batch):
+            items = [item for item in batch if item[3] == blockchain]
+            try:
+                transaction_ids = backends.get_backend(blockchain).submit_batch([content for _, content, _, _, _ in items])
+            except Exception as e:
+                logger.warning('%d trackings not submitted: %s', len(items), e)
+                for tracking_id, content, attempts, _, locator in items:
+                    updates.extend(self._retry(tracking_id, content, attempts, blockchain, locator))
+                continue
+            for (tracking_id, content, attempts, _, locator), transaction_id in zip(items, transaction_ids):
+                if isinstance(transaction_id, Exception):
+                    # only the items not sent are retried: the others are on chain already
+                    logger.warning('tracking %s not submitted: %s', tracking_id, transaction_id)
+                    updates.extend(self._retry(tracking_id, content, attempts, blockchain, locator))
+                    continue
+                updates.append((tracking_id, transaction_id, TransactionStatus.SUBMITTED.name, None, locator))
+                anchors.setdefault(blockchain, []).append((content, transaction_id, None))
+        self._update(updates, anchors)
+
+    def _anchor(self, batch: list, blockchain: Blockchain):
+        root, proofs = merkle.merkle_tree([content for _, content, _, _, _ in batch])
+        try:
+            transaction_id = backends.get_backend(blockchain).submit(root)
+        except Exception as e:
+            logger.warning('Merkle root of %d trackings not submitted: %s', len(batch), e)
+            updates = []
+            for tracking_id, content, attempts, _, locator in batch:
+                updates.extend(self._retry(tracking_id, content, attempts, blockchain, locator))
+            self._update(updates)
+            return
+        self._update([(tracking_id, transaction_id, TransactionStatus.SUBMITTED.name, proof, locator)
+                      for (tracking_id, _, _, _, locator), proof in zip(batch, proofs)],
+                     {blockchain: [(content, transaction_id, proof) for (_, content, _, _, _), proof in zip(batch, proofs)]})
+
+    def _retry(self, tracking_id: int, content: str, attempts: int, blockchain: Blockchain, locator: str) -> list:
+        if attempts + 1 < self.max_attempts:
+            self._put((tracking_id, content, attempts + 1, blockchain, locator))
+            return []
+        return [(tracking_id, None, TransactionStatus.FAILED.name, None, locator)]
+
+    def _update(self, updates: list, anchors: dict = None):
+        """ anchors: the submitted [(anonymized_data, transaction_id, merkle_proof)] by blockchain, for deduplication """
+        if not updates:
+            return
+        db = SessionLocal()
+        try:
+            crud.update_trackings_transaction(db, updates)
+            index = dedupe.get_index()
+            if index is not None:
+                for blockchain, blockchain_anchors in (anchors or {}).items():
+                    index.remember_sync(db, blockchain, blockchain_anchors)
+        except Exception as e:
+            logger.error('could not update trackings: %s', e)
+        finally:
+            db.close()
+
+    def _receipt_loop(self):
+        recovery = time.monotonic() + self.lease
+        while not self._stopping.wait(self.poll_interval):
+            try:
+                self._poll_receipts()
+            except Exception as e:
+                logger.warning('could not poll receipts: %s', e)
+            if time.monotonic() >= recovery:
+                recovery = time.monotonic() + self.lease
+                try:
+                    self._recover()
+                except Exception as e:
+                    logger.warning('could not recover pending trackings: %s', e)
+
+    def _poll_receipts(self):
+        db = SessionLocal()
+        try:
+            # keyset pages: trackings whose receipt never comes do not keep the newer ones from being polled
+            page_size = settings.chain_batch_size * 10
+            trackings = crud.get_trackings_by_status(db, TransactionStatus.SUBMITTED.name, limit=page_size,
+                                                     after=self._receipts_after)
+            self._receipts_after = trackings[-1].tracking_id if len(trackings) == page_size else 0
+            # with Merkle anchoring many trackings share the same transaction: the time it was last submitted
+            transaction_ids = {}
+            for tracking in trackings:
+                submitted = transaction_ids.setdefault(tracking.blockchain_id, {})
+                status_dt = tracking.status_dt or datetime.min
+                submitted[tracking.transaction_id] = max(submitted.get(tracking.transaction_id, status_dt), status_dt)
+            cutoff = datetime.now() - timedelta(seconds=self.receipt_timeout)
+            confirmed = []
+            failed = []
+            for blockchain_id, submitted in transaction_ids.items():
+                ids = list(submitted)
+                try:
+                    statuses = backends.get_backend(blockchain_id).statuses(ids)
+                except Exception as e:
+                    logger.warning('could not poll %d receipts of blockchain %s: %s', len(ids), blockchain_id, e)
+                    continue
+                for transaction_id, status in zip(ids, statuses):
+                    if status is True:
+                        confirmed.append(transaction_id)
+                    elif status is False:
+                        failed.append(transaction_id)
+                    elif submitted[transaction_id] < cutoff:
+                        # dropped, never mined, or lost by the MEMORY ledger on restart
+                        logger.warning('transaction %s not mined after %s seconds', transaction_id, self.receipt_timeout)
+                        failed.append(transaction_id)
+            if confirmed:
+                crud.update_trackings_status(db, confirmed, TransactionStatus.CONFIRMED.name)
+            if failed:
+                crud.update_trackings_status(db, failed, TransactionStatus.FAILED.name)
+                crud.delete_anchors(db, failed)
+        finally:
+            db.close()
+
+_submitter = None
+
+def start() -> TransactionSubmitter:
+    global _submitter
+    if _submitter is None:
+        if settings.merkle_anchoring:
+            _submitter = TransactionSubmitter(settings.merkle_batch_size,
+                                              settings.submission_max_attempts,
+                                              settings.receipt_poll_interval,
+                                              merkle_anchoring=True,
+                                              batch_interval=settings.merkle_batch_interval,
+                                              receipt_timeout=settings.receipt_timeout,
+                                              lease=settings.submission_lease)
+        else:
+            _submitter = TransactionSubmitter(settings.submission_batch_size,
+                                              settings.submission_max_attempts,
+                                              settings.receipt_poll_interval,
+                                              receipt_timeout=settings.receipt_timeout,
+                                              lease=settings.submission_lease)
+        _submitter.start()
+    return _submitter
+
+def stop(timeout: float = None):
+    global _submitter
+    if _submitter is not None:
+        _submitter.stop(timeout)
+        _submitter = None
+
+def enqueue(tracking_id: int, content: str, blockchain: Blockchain, locator: str = None):
+    (_submitter or start()).enqueue(tracking_id, content, blockchain, locator)
@@ -0,0 +1,63 @@
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+
+class TransactionCache:
+    """ Cache of mined transactions (immutable), by transaction hash.
+
+        First tier: in-process LRU. Second tier (optional): SQLite file, shared by the workers of a host.
+    """
+
+    def __init__(self, size: int, path: str = None):
+        self.size = size
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.execute('CREATE TABLE IF NOT EXISTS transactions (transaction_id TEXT PRIMARY KEY, data TEXT)')
+
+    @staticmethod
+    def key(transaction_id: str) -> str:
+        transaction_id = transaction_id.lower()
+        return transaction_id if transaction_id.startswith('0x') else '0x' + transaction_id
+
+    def get(self, transaction_id: str):
+        key = self.key(transaction_id)
+        with self._lock:
+            tx = self._lru.get(key)
+            if tx is not None:
+                self._lru.move_to_end(key)
+                return tx
+            if self._db is None:
+                return None
+            row = self._db.execute('SELECT data FROM transactions WHERE transaction_id = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            tx = json.loads(row[0])
+            self._remember(key, tx)
+            return tx
+
+    def put(self, transaction_id: str, tx: dict):
+        # a transaction can only be cached once it is in a block
+        if tx.get('blockNumber') is None:
+            return
+        key = self.key(transaction_id)
+        with self._lock:
+            self._remember(key, tx)
+            if self._db is not None:
+                self._db.execute('INSERT OR IGNORE INTO transactions (transaction_id, data) VALUES (?, ?)',
+                                 (key, json.dumps(tx)))
+
+    def _remember(self, key: str, tx: dict):
+        self._lru[key] = tx
+        self._lru.move_to_end(key)
+        while len(self._lru) > self.size:
+            self._lru.popitem(last=False)
+
+    def close(self):
+        if self._db is not None:
+            self._db.close()
@@ -5,6 +5,7 @@ class Blockchain(str, Enum):
     HYPERLEDGER = 1
     ETHEREUM = 2
     BITCOIN = 3
+    MEMORY = 4
 
 @unique
 class TypeClassification(str, Enum):
@@ -22,5 +23,15 @@ class HashMethod(str, Enum):
     SHA1 = 2
     SHA256 = 3
     SHA512 = 4
-    
-    
\ No newline at end of file
+    # keyed with the server pepper (PRIVACYCHAIN_ANONYMIZATION_PEPPER)
+    HMAC_SHA256 = 5
+    HMAC_SHA512 = 6
+    BLAKE2B = 7
+
+@unique
+class TransactionStatus(str, Enum):
+    PENDING = 1
+    SUBMITTED = 2
+    CONFIRMED = 3
+    FAILED = 4
+    SUBMITTING = 5
@@ -0,0 +1,229 @@
+# PrivacyChain benchmark: end-to-end API throughput and latency
+#
+# Drives indexOnChain, indexSecureOnChain, verifySecureImmutableRegister, rectifyOnChain, unindexOnChain and
+# removeOnChain (in this order, one phase per operation) with a given concurrency and number of requests, against
+# the API served by uvicorn in this process. Reports throughput, p50/p95/p99 latency and the mean time per request
+# spent hashing, in the blockchain backend and in the database.
+#
+# usage: python -m benchmarks.api_endtoend --requests 2000 --concurrency 32 --output results.json
+#
+# The blockchain is the in-process MEMORY ledger by default (--blockchain ETHEREUM uses PRIVACYCHAIN_CHAIN_URL).
+# The trackings are written to a scratch schema (privacychain_benchmark) of the PostgreSQL database, dropped at the end,
+# or, with --database-url sqlite:// (in-memory store) or sqlite:///path.db, to a scratch SQLite database.
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import socket
+import statistics
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import uvicorn
+from requests.adapters import HTTPAdapter
+from sqlalchemy import event, text
+
+import app.backends as backends
+import app.bib as bib
+from app import database, models  # noqa: F401 (the models register their tables in Base.metadata)
+from app.config import settings
+from app.main import app
+
+SCHEMA = 'privacychain_benchmark'
+
+class Stages:
+    """ Time spent per stage (hash, chain, db) by all the requests of the running phase """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.totals = {'hash': 0.0, 'chain': 0.0, 'db': 0.0}
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            self.totals[stage] += seconds
+
+    def timed(self, stage: str, function):
+        def wrapper(*args, **kwargs):
+            begin = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.add(stage, time.perf_counter() - begin)
+        return wrapper
+
+stages = Stages()
+
+class TimedBackend(backends.BlockchainBackend):
+    """ Blockchain backend that accounts its calls to the chain stage """
+
+    def __init__(self, backend: backends.BlockchainBackend):
+        for name in ('submit', 'get', 'statuses'):
+            setattr(self, name, stages.timed('chain', getattr(backend, name)))
+        self._submit_batch = stages.timed('chain', backend.submit_batch)
+        self._get_many = stages.timed('chain', backend.get_many)
+
+    def submit_batch(self, contents: list) -> list:
+        return self._submit_batch(contents)
+
+    def get_many(self, transaction_ids: list) -> list:
+        return self._get_many(transaction_ids)
+
+def instrument():
+    bib.anonymize = stages.timed('hash', bib.anonymize)
+    for blockchain, factory in list(backends.BACKENDS.items()):
+        backends.register(blockchain, lambda factory=factory: TimedBackend(factory()))
+
+def instrument_engine(engine):
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        context._benchmark_begin = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(connection, cursor, statement, parameters, context, executemany):
+        stages.add('db', time.perf_counter() - context._benchmark_begin)
+
+def scratch_database(database_url: str):
+    """ Binds the application sessions to engines on the scratch schema (or SQLite database), with the tables created """
+    if database_url.startswith('sqlite') and not database.is_memory_url(database_url):
+        # a file next to the given one, so that the given database is left as it is
+        path = database_url[len('sqlite:///'):]
+        database_url = 'sqlite:///' + os.path.join(os.path.dirname(path), SCHEMA + '.db')
+        database.remove_database(database_url[len('sqlite:///'):])
+    engine, async_engine = database.create_engines(database_url, SCHEMA)
+    if engine.dialect.name == 'postgresql':
+        with engine.begin() as connection:
+            connection.execute(text('DROP SCHEMA IF EXISTS ' + SCHEMA + ' CASCADE'))
+            connection.execute(text('CREATE SCHEMA ' + SCHEMA))
+    database.Base.metadata.create_all(engine)
+    database.SessionLocal.configure(bind=engine)
+    database.AsyncSessionLocal.configure(bind=async_engine)
+    instrument_engine(engine)
+    instrument_engine(async_engine.sync_engine)
+    return engine
+
+def drop_scratch_database(engine):
+    if engine.dialect.name == 'postgresql':
+        with engine.begin() as connection:
+            connection.execute(text('DROP SCHEMA ' + SCHEMA + ' CASCADE'))
+    else:
+        engine.dispose()
+        database.remove_database(engine.url.database)
+
+def serve() -> tuple:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        port = sock.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(app, host='127.0.0.1', port=port, log_level='warning', access_log=False))
+    server.install_signal_handlers = lambda: None
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread, 'http://127.0.0.1:' + str(port)
+
+def run_phase(url: str, operation: str, payloads: list, concurrency: int) -> tuple:
+    """ Sends the payloads to the operation with concurrency threads, returns (metrics, responses) """
+    method = 'GET' if operation == 'verifySecureImmutableRegister' else 'POST'
+    session = requests.Session()
+    session.mount('http://', HTTPAdapter(pool_connections=1, pool_maxsize=concurrency))
+    latencies = [None] * len(payloads)
+    responses = [None] * len(payloads)
+
+    def call(i):
+        begin = time.perf_counter()
+        response = session.request(method, url + '/' + operation + '/', json=payloads[i])
+        latencies[i] = time.perf_counter() - begin
+        responses[i] = response.json() if response.status_code == 200 else None
+
+    stages.reset()
+    begin = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(call, range(len(payloads))))
+    elapsed = time.perf_counter() - begin
+    session.close()
+
+    latencies_ms = [latency * 1000 for latency in latencies]
+    cuts = statistics.quantiles(latencies_ms, n=100) if len(latencies_ms) > 1 else latencies_ms * 99
+    metrics = {'requests': len(payloads),
+               'errors': sum(1 for response in responses if response is None),
+               'elapsed_s': round(elapsed, 3),
+               'throughput_rps': round(len(payloads) / elapsed, 1),
+               'latency_ms': {'mean': round(statistics.mean(latencies_ms), 3),
+                              'p50': round(cuts[49], 3),
+                              'p95': round(cuts[94], 3),
+                              'p99': round(cuts[98], 3)},
+               'stages_ms': {stage: round(total * 1000 / len(payloads), 3) for stage, total in stages.totals.items()}}
+    return metrics, responses
+
+def record(i: int, result: str) -> str:
+    return '{cpf:%011d, exam:HIV, datetime:2021-09-14T19:50:47.108814, result:%s}' % (i, result)
+
+def run(url: str, count: int, concurrency: int) -> dict:
+    results = {}
+
+    def phase(operation, payloads):
+        with contextlib.redirect_stdout(io.StringIO()):
+            metrics, responses = run_phase(url, operation, payloads, concurrency)
+        results[operation] = metrics
+        print(json.dumps({'operation': operation, **metrics}))
+        return responses
+
+    phase('indexOnChain', [{'content': record(i, 'POS'), 'locator': 'I%010d' % i, 'datetime': ''} for i in range(count)])
+    salts = [str(uuid.uuid4()) for _ in range(count)]
+    secure = [{'content': record(i, 'POS'), 'locator': 'S%010d' % i, 'datetime': '', 'salt': salts[i]} for i in range(count)]
+    trackings = phase('indexSecureOnChain', secure)
+    phase('verifySecureImmutableRegister', [{'transaction_id': tracking['transaction_id'] if tracking else '0x',
+                                             'content': item['content'], 'salt': item['salt']}
+                                            for tracking, item in zip(trackings, secure)])
+    phase('rectifyOnChain', [{'content': record(i, 'NEG'), 'salt': '', 'locator': 'S%010d' % i, 'datetime': ''} for i in range(count)])
+    phase('unindexOnChain', [{'locator': 'I%010d' % i, 'datetime': ''} for i in range(count)])
+    phase('removeOnChain', [{'locator': 'S%010d' % i, 'datetime': ''} for i in range(count)])
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end throughput and latency of the PrivacyChain API')
+    parser.add_argument('--database-url', default=database.SQLALCHEMY_DATABASE_URL,
+                        help='PostgreSQL database for the scratch schema, sqlite:// (in-memory store) or sqlite:///path.db')
+    parser.add_argument('--blockchain', default='MEMORY', help='MEMORY (in-process ledger) or ETHEREUM (node at PRIVACYCHAIN_CHAIN_URL)')
+    parser.add_argument('--requests', type=int, default=1000, help='requests per operation')
+    parser.add_argument('--concurrency', type=int, default=16, help='concurrent clients')
+    parser.add_argument('--output', help='JSON file for the results')
+    args = parser.parse_args()
+
+    instrument()
+    engine = scratch_database(args.database_url)
+    server, thread, url = serve()
+    try:
+        response = requests.post(url + '/setDefaultBlockchain/' + backends.to_blockchain(args.blockchain).value)
+        response.raise_for_status()
+        results = run(url, args.requests, args.concurrency)
+    finally:
+        server.should_exit = True
+        thread.join()
+        drop_scratch_database(engine)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'config': {'blockchain': args.blockchain.upper(),
+                                  'database': engine.dialect.name,
+                                  'requests': args.requests,
+                                  'concurrency': args.concurrency,
+                                  'async_submission': settings.async_submission,
+                                  'merkle_anchoring': settings.merkle_anchoring},
+                       'environment': {'python': platform.python_version(),
+                                       'platform': platform.platform(),
+                                       'cpus': os.cpu_count()},
+                       'operations': results}, file, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# PrivacyChain benchmark: worker cold start
+#
+# Reports where the import of the API (app.main) spends its time, by top-level package (python -X importtime), then
+# starts the API with uvicorn in a new process for each startup mode and measures, from the process start:
+#   ready           first response of the API (GET /metrics: no database nor blockchain)
+#   first request   latency of the first indexOnChain that follows, which pays what the lazy mode did not create
+# Modes: eager (default settings) and lazy (PRIVACYCHAIN_LAZY_START=true, PRIVACYCHAIN_OPENAPI_DOCS=false).
+#
+# usage: python -m benchmarks.startup --runs 5 --output results.json
+#
+# The trackings are written to an in-memory store (sqlite://) by default, and the blockchain is the MEMORY ledger.
+
+import argparse
+import json
+import os
+import platform
+import re
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+import requests
+
+from app.utils import Blockchain
+
+MODES = {'eager': {},
+         'lazy': {'PRIVACYCHAIN_LAZY_START': 'true', 'PRIVACYCHAIN_OPENAPI_DOCS': 'false'}}
+
+def import_breakdown(env: dict, top: int = 12) -> dict:
+    """ Self time (ms) of the modules imported by app.main, summed by top-level package """
+    output = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app.main'],
+                            env=env, capture_output=True, text=True, check=True).stderr
+    packages = defaultdict(int)
+    for line in output.splitlines():
+        match = re.match(r'import time:\s+(\d+) \|\s+\d+ \|\s*(\S+)', line)
+        if match:
+            packages[match.group(2).split('.')[0]] += int(match.group(1))
+    ordered = sorted(packages.items(), key=lambda item: item[1], reverse=True)
+    breakdown = {package: round(us / 1000, 1) for package, us in ordered[:top]}
+    breakdown['other'] = round(sum(us for _, us in ordered[top:]) / 1000, 1)
+    breakdown['total'] = round(sum(packages.values()) / 1000, 1)
+    return breakdown
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def cold_start(env: dict, timeout: float = 60) -> dict:
+    port = free_port()
+    url = 'http://127.0.0.1:' + str(port)
+    begin = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-m', 'uvicorn', 'app.main:app', '--port', str(port),
+                                '--log-level', 'warning', '--no-access-log'], env=env)
+    try:
+        while True:
+            if process.poll() is not None or time.perf_counter() - begin > timeout:
+                raise RuntimeError('the API did not start')
+            try:
+                if requests.get(url + '/metrics', timeout=1).status_code == 200:
+                    break
+            except requests.ConnectionError:
+                time.sleep(0.01)
+        ready = time.perf_counter() - begin
+        requests.post(url + '/setDefaultBlockchain/' + Blockchain.MEMORY.value).raise_for_status()
+        first = time.perf_counter()
+        requests.post(url + '/indexOnChain/', json={
+            'content': '{cpf:00000000001, exam:HIV, datetime:2021-09-14T19:50:47.108814, result:POS}',
+            'locator': 'C0000000001', 'datetime': ''}).raise_for_status()
+        return {'ready_s': ready, 'first_request_ms': (time.perf_counter() - first) * 1000}
+    finally:
+        process.terminate()
+        process.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description='Cold start of a PrivacyChain API worker')
+    parser.add_argument('--database-url', default='sqlite://', help='tracking store of the started workers')
+    parser.add_argument('--runs', type=int, default=5, help='starts per mode (medians are reported)')
+    parser.add_argument('--output', help='JSON file for the results')
+    args = parser.parse_args()
+
+    env = dict(os.environ, PRIVACYCHAIN_DATABASE_URL=args.database_url)
+    env['PYTHONPATH'] = os.pathsep.join(filter(None, [os.getcwd(), env.get('PYTHONPATH')]))
+    breakdown = import_breakdown(env)
+    print(json.dumps({'import_ms': breakdown}))
+    results = {}
+    for mode, overrides in MODES.items():
+        runs = [cold_start(dict(env, **overrides)) for _ in range(args.runs)]
+        results[mode] = {'runs': args.runs,
+                         'ready_s': round(statistics.median(run['ready_s'] for run in runs), 3),
+                         'first_request_ms': round(statistics.median(run['first_request_ms'] for run in runs), 1)}
+        print(json.dumps({'mode': mode, **results[mode]}))
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({'config': {'database_url': args.database_url, 'runs': args.runs},
+                       'environment': {'python': platform.python_version(),
+                                       'platform': platform.platform(),
+                                       'cpus': os.cpu_count()},
+                       'import_ms': breakdown,
+                       'modes': results}, file, indent=2)
+
+if __name__ == "__main__":
+    main()
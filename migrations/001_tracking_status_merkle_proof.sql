@@ -0,0 +1,9 @@
+-- PrivacyChain migration 001
+-- Transaction status (asynchronous submission) and Merkle inclusion proof (Merkle-batched anchoring) of the trackings.
+
+ALTER TABLE tracking ADD COLUMN IF NOT EXISTS status character varying COLLATE pg_catalog."default";
+
+ALTER TABLE tracking ADD COLUMN IF NOT EXISTS merkle_proof character varying COLLATE pg_catalog."default";
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS tracking_status_idx
+    ON tracking USING btree (status);
@@ -0,0 +1,18 @@
+-- PrivacyChain migration 002
+-- Indexes for the unindex/rectify/remove queries (by locator and timestamp) and for the transaction lookups.
+-- tracking_dt is a timestamp (tables created from the ORM model had it as character varying).
+-- The unique index fails if the table already holds repeated transaction ids outside Merkle batches:
+--   SELECT transaction_id FROM tracking WHERE merkle_proof IS NULL GROUP BY transaction_id HAVING count(*) > 1;
+
+ALTER TABLE tracking ALTER COLUMN tracking_dt TYPE timestamp without time zone
+    USING tracking_dt::timestamp without time zone;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS tracking_locator_tracking_dt_idx
+    ON tracking USING btree (locator, tracking_dt);
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS tracking_transaction_id_idx
+    ON tracking USING btree (transaction_id);
+
+-- Trackings of a Merkle batch share the transaction of the root
+CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS tracking_transaction_id_key
+    ON tracking USING btree (transaction_id) WHERE merkle_proof IS NULL;
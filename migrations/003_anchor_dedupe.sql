@@ -0,0 +1,24 @@
+-- PrivacyChain migration 003
+-- Digest-level deduplication: the transaction of each anonymized data registered on a blockchain (anchor).
+-- Indexations of identical anonymized data reuse the transaction instead of submitting it again, so trackings
+-- outside Merkle batches may share a transaction too: transaction_id is no longer unique in tracking.
+
+CREATE TABLE IF NOT EXISTS anchor
+(
+    blockchain_id integer NOT NULL,
+    anonymized_data character varying COLLATE pg_catalog."default" NOT NULL,
+    transaction_id character varying COLLATE pg_catalog."default" NOT NULL,
+    merkle_proof character varying COLLATE pg_catalog."default",
+    CONSTRAINT anchor_pkey PRIMARY KEY (blockchain_id, anonymized_data)
+);
+
+-- the first transaction of each anonymized data already registered
+INSERT INTO anchor (blockchain_id, anonymized_data, transaction_id, merkle_proof)
+    SELECT DISTINCT ON (blockchain_id, anonymized_data) blockchain_id, anonymized_data, transaction_id, merkle_proof
+      FROM tracking
+     WHERE transaction_id IS NOT NULL AND anonymized_data IS NOT NULL AND blockchain_id IS NOT NULL
+       AND status IS DISTINCT FROM 'FAILED'
+     ORDER BY blockchain_id, anonymized_data, tracking_id
+    ON CONFLICT DO NOTHING;
+
+DROP INDEX CONCURRENTLY IF EXISTS tracking_transaction_id_key;
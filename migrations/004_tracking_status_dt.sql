@@ -0,0 +1,5 @@
+-- PrivacyChain migration 004
+-- Time of the last status change of the trackings: the SUBMITTED trackings whose transaction is not mined within
+-- PRIVACYCHAIN_RECEIPT_TIMEOUT are marked FAILED. Existing trackings take the time of the migration.
+
+ALTER TABLE tracking ADD COLUMN IF NOT EXISTS status_dt timestamp without time zone DEFAULT now();
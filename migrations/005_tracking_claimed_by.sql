@@ -0,0 +1,5 @@
+-- PrivacyChain migration 005
+-- Per-tracking claim of the background submissions: a worker marks the PENDING trackings it submits SUBMITTING,
+-- claimed by itself, for PRIVACYCHAIN_SUBMISSION_LEASE seconds, so that each tracking is submitted by one worker only.
+
+ALTER TABLE tracking ADD COLUMN IF NOT EXISTS claimed_by character varying COLLATE pg_catalog."default";
@@ -27,6 +27,10 @@ CREATE TABLE "privacychain".tracking
     hash_method character varying COLLATE pg_catalog."default",
     tracking_dt timestamp without time zone DEFAULT now(),
     locator character varying COLLATE pg_catalog."default",
+    status character varying COLLATE pg_catalog."default",
+    merkle_proof character varying COLLATE pg_catalog."default",
+    status_dt timestamp without time zone DEFAULT now(),
+    claimed_by character varying COLLATE pg_catalog."default",
     CONSTRAINT tracking_pkey PRIMARY KEY (tracking_id)
 )
 
@@ -57,10 +61,57 @@ COMMENT ON COLUMN "privacychain".tracking.salt
     IS '36-character random string generated using the uuid4 function - see RFC 4122';
 
 COMMENT ON COLUMN "privacychain".tracking.hash_method
-    IS 'String identifying the method used in the anonymization of personal data. Domain: MD5, SHA1, SHA256, SHA512';
+    IS 'String identifying the method used in the anonymization of personal data. Domain: MD5, SHA1, SHA256, SHA512, HMAC_SHA256, HMAC_SHA512, BLAKE2B (keyed with the server pepper, not stored)';
 
 COMMENT ON COLUMN "privacychain".tracking.tracking_dt
     IS 'timestamp identifying when the tuple is persisted in the database';
 
 COMMENT ON COLUMN "privacychain".tracking.locator
-    IS 'identification of entity holding personal data';
\ No newline at end of file
+    IS 'identification of entity holding personal data';
+
+COMMENT ON COLUMN "privacychain".tracking.status
+    IS 'state of the blockchain transaction. Domain: PENDING, SUBMITTING, SUBMITTED, CONFIRMED, FAILED';
+
+COMMENT ON COLUMN "privacychain".tracking.merkle_proof
+    IS 'inclusion proof (JSON list of [side, sibling hash]) of anonymized_data in the Merkle tree whose root is registered in transaction_id. NULL when anonymized_data itself is registered';
+
+COMMENT ON COLUMN "privacychain".tracking.status_dt
+    IS 'timestamp of the last change of status';
+
+COMMENT ON COLUMN "privacychain".tracking.claimed_by
+    IS 'worker (host:pid) submitting the transaction while status is SUBMITTING';
+
+CREATE INDEX tracking_status_idx
+    ON "privacychain".tracking USING btree (status);
+
+CREATE INDEX tracking_locator_tracking_dt_idx
+    ON "privacychain".tracking USING btree (locator, tracking_dt);
+
+CREATE INDEX tracking_transaction_id_idx
+    ON "privacychain".tracking USING btree (transaction_id);
+
+-- DROP TABLE "privacychain".anchor;
+CREATE TABLE "privacychain".anchor
+(
+    blockchain_id integer NOT NULL,
+    anonymized_data character varying COLLATE pg_catalog."default" NOT NULL,
+    transaction_id character varying COLLATE pg_catalog."default" NOT NULL,
+    merkle_proof character varying COLLATE pg_catalog."default",
+    CONSTRAINT anchor_pkey PRIMARY KEY (blockchain_id, anonymized_data)
+);
+
+ALTER TABLE "privacychain".anchor
+    OWNER to postgres;
+
+COMMENT ON TABLE "privacychain".anchor
+    IS 'Transaction of each anonymized data registered in a blockchain, reused by indexations of identical anonymized data';
+
+-- Schema migrations (migrations/NNN_*.sql, applied with: python -m app.migrate) already included in this script
+CREATE TABLE "privacychain".schema_version
+(
+    version integer NOT NULL,
+    applied_at timestamp without time zone DEFAULT now(),
+    CONSTRAINT schema_version_pkey PRIMARY KEY (version)
+);
+
+INSERT INTO "privacychain".schema_version (version) VALUES (1), (2), (3);
@@ -0,0 +1,80 @@
+import hashlib
+import hmac
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app.bib as bib
+import app.metrics as metrics
+from app.config import settings
+from app.main import app
+
+CONTENT = '{cpf:72815157071, exam:HIV, datetime:2021-09-14T19:50:47.108814, result:POS}'
+SALT = '4efc1400-29b8-40b7-9bd7-7fce480b39e8'
+
+@pytest.fixture
+def pepper(monkeypatch):
+    """ Sets the pepper of the keyed hash methods (None: unset); the keyed contexts are rebuilt with it """
+    def set_pepper(value):
+        monkeypatch.setattr(settings, 'anonymization_pepper', value)
+        monkeypatch.setattr(bib, '_keyed_contexts', {})
+    return set_pepper
+
+@pytest.fixture
+def client():
+    # no startup: the anonymization endpoints use neither the database nor the blockchain
+    return TestClient(app)
+
+def test_keyed_methods_use_the_pepper_as_key(pepper):
+    pepper('pepper')
+    salted = bib.salted_content(CONTENT, SALT).encode()
+    assert bib.anonymize(bib.salted_content(CONTENT, SALT), 'HMAC_SHA256') == hmac.new(b'pepper', salted, 'sha256').hexdigest()
+    assert bib.anonymize(bib.salted_content(CONTENT, SALT), 'HMAC_SHA512') == hmac.new(b'pepper', salted, 'sha512').hexdigest()
+    assert bib.anonymize(bib.salted_content(CONTENT, SALT), 'BLAKE2B') == hashlib.blake2b(salted, key=b'pepper').hexdigest()
+
+def test_keyed_digests_are_the_same_by_record_batch_and_stream(pepper):
+    pepper('pepper')
+    contents = [CONTENT.replace('HIV', 'HIV%d' % i) for i in range(10)]
+    for method in ('HMAC_SHA256', 'HMAC_SHA512', 'BLAKE2B'):
+        expected = [bib.anonymize(content, method) for content in contents]
+        assert bib.anonymize_many(contents, method) == expected
+        anonymizer = bib.Anonymizer(method, SALT)
+        anonymizer.update(CONTENT.encode())
+        assert anonymizer.hexdigest() == bib.anonymize(bib.salted_content(CONTENT, SALT), method)
+
+@pytest.mark.parametrize('path', ['/simpleAnonymize/batch/', '/secureAnonymize/batch/'])
+def test_keyed_batch_without_pepper_fails_before_streaming(pepper, client, path):
+    pepper(None)
+    response = client.post(path + '?hashMethod=HMAC_SHA256', json=[{'content': CONTENT, 'salt': SALT}])
+    assert response.status_code == 500
+    assert response.json() == {'message': 'HMAC_SHA256 anonymization needs a pepper (PRIVACYCHAIN_ANONYMIZATION_PEPPER)'}
+
+def test_keyed_batch_with_pepper(pepper, client):
+    pepper('pepper')
+    response = client.post('/secureAnonymize/batch/?hashMethod=BLAKE2B', json=[{'content': CONTENT, 'salt': SALT}])
+    assert response.status_code == 200
+    assert [json.loads(line) for line in response.text.splitlines()] == [
+        {'content': bib.anonymize(bib.salted_content(CONTENT, SALT), 'BLAKE2B'), 'salt': SALT}]
+
+def test_batch_records_without_content_are_rejected(client):
+    for path in ('/simpleAnonymize/batch/', '/secureAnonymize/batch/'):
+        response = client.post(path, json=[{'content': CONTENT}, {'salt': SALT}])
+        assert response.status_code == 400
+        assert response.json()['detail'] == 'Every record must have a content.'
+    # the salt is generated when omitted
+    response = client.post('/secureAnonymize/batch/', json=[{'content': CONTENT, 'salt': None}])
+    assert response.status_code == 200 and json.loads(response.text.splitlines()[0])['salt']
+
+def test_pool_hashing_time_is_observed_in_this_process(monkeypatch):
+    monkeypatch.setattr(settings, 'batch_pool_threshold', 4)
+    monkeypatch.setattr(settings, 'batch_chunk_size', 2)
+    observations = []
+    monkeypatch.setattr(metrics.HASH_SECONDS, 'observe', lambda value, **labels: observations.append(labels))
+    contents = [CONTENT.replace('HIV', 'HIV%d' % i) for i in range(6)]
+    try:
+        assert list(bib.anonymize_batch(contents, 'SHA256')) == [hashlib.sha256(content.encode()).hexdigest()
+                                                                 for content in contents]
+    finally:
+        bib.shutdown_executor()
+    assert observations == [{'method': 'SHA256'}] * 3
@@ -0,0 +1,65 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import app.database as database
+import app.dedupe as dedupe
+from app.config import settings
+from app.main import app
+
+CONTENT = '{cpf:72815157071, exam:HIV, datetime:2021-09-14T19:50:47.108814, result:POS}'
+
+def test_bloom_filter_has_no_false_negatives():
+    bloom = dedupe.BloomFilter(10000, 0.001)
+    keys = ['2:%064x' % i for i in range(10000)]
+    for key in keys:
+        bloom.add(key)
+    assert all(key in bloom for key in keys)
+    # far below 1% at the capacity (0.1% expected)
+    assert sum(('3:%064x' % i) in bloom for i in range(10000)) < 100
+
+@pytest.fixture
+def client(monkeypatch):
+    """ API on an in-memory tracking store, with synchronous submission to the MEMORY ledger """
+    engine, async_engine = database.create_engines('sqlite://')
+    database.create_tables(engine)
+    monkeypatch.setitem(database.SessionLocal.kw, 'bind', engine)
+    monkeypatch.setitem(database.AsyncSessionLocal.kw, 'bind', async_engine)
+    monkeypatch.setattr(settings, 'lazy_start', True)
+    monkeypatch.setattr(settings, 'dedupe', True)
+    monkeypatch.setattr(settings, 'async_submission', False)
+    monkeypatch.setattr(settings, 'merkle_anchoring', False)
+    dedupe.stop()
+    with TestClient(app) as client:
+        yield client
+    dedupe.stop()
+    engine.dispose()
+
+def index(client, locator: str) -> dict:
+    response = client.post('/indexOnChain/bulk/?blockchain=4', json=[{'content': CONTENT, 'locator': locator, 'datetime': ''}])
+    assert response.status_code == 200
+    return response.json()
+
+def test_anchored_digest_is_reused_for_a_new_locator(client):
+    first = index(client, '72815157071')
+    assert first['reused'] == 0
+    second = index(client, '11111111111')
+    assert second['reused'] == 1
+    assert second['duplicates'] == []
+    trackings = [client.get('/tracking/%d' % tracking_id).json() for tracking_id in first['index_ids'] + second['index_ids']]
+    assert trackings[0]['anonymized_data'] == trackings[1]['anonymized_data']
+    assert trackings[0]['transaction_id'] == trackings[1]['transaction_id']
+    assert trackings[1]['locator'] == '11111111111'
+
+def test_erasure_deletes_the_anchors_no_tracking_holds(client):
+    first = client.get('/tracking/%d' % index(client, '72815157071')['index_ids'][0]).json()
+    index(client, '11111111111')
+    # another tracking still holds the anchor
+    assert client.post('/removeOnChain/', json={'locator': '72815157071'}).status_code == 200
+    assert index(client, '22222222222')['reused'] == 1
+    response = client.post('/removeOnChain/bulk/', json=[{'locator': '11111111111'}, {'locator': '22222222222'}])
+    assert response.status_code == 200
+    # registered again, with a tracking behind its transaction
+    again = index(client, '72815157071')
+    assert again['reused'] == 0
+    tracking = client.get('/tracking/%d' % again['index_ids'][0]).json()
+    assert tracking['transaction_id'] and tracking['transaction_id'] != first['transaction_id']
@@ -0,0 +1,33 @@
+import hashlib
+
+import pytest
+
+import app.merkle as merkle
+
+def digests(count: int) -> list:
+    return [hashlib.sha256(str(i).encode()).hexdigest() for i in range(count)]
+
+@pytest.mark.parametrize('count', [1, 2, 3, 5, 7, 8, 9, 33])
+def test_every_proof_leads_to_the_root(count):
+    leaves = digests(count)
+    root, proofs = merkle.merkle_tree(leaves)
+    assert root == merkle.merkle_root(leaves)
+    for leaf, proof in zip(leaves, proofs):
+        assert merkle.verify_proof(leaf, proof, root)
+        # roots as read from a transaction input
+        assert merkle.verify_proof(leaf, proof, '0x' + root.upper())
+
+@pytest.mark.parametrize('count', [3, 5, 9])
+def test_a_proof_does_not_verify_other_data(count):
+    leaves = digests(count)
+    root, proofs = merkle.merkle_tree(leaves)
+    assert not merkle.verify_proof(digests(count + 1)[-1], proofs[0], root)
+    assert not merkle.verify_proof(leaves[0], proofs[1], root)
+    assert not merkle.verify_proof(leaves[-1], proofs[-1], merkle.merkle_root(leaves[:-1]))
+
+def test_an_internal_node_is_not_a_leaf():
+    leaves = digests(4)
+    root, _ = merkle.merkle_tree(leaves)
+    left = merkle.node_hash(merkle.leaf_hash(leaves[0]), merkle.leaf_hash(leaves[1])).hex()
+    right = merkle.node_hash(merkle.leaf_hash(leaves[2]), merkle.leaf_hash(leaves[3])).hex()
+    assert not merkle.verify_proof(left, '[["R", "%s"]]' % right, root)
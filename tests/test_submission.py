@@ -0,0 +1,116 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+import app.backends as backends
+import app.database as database
+import app.submitter as submitter
+from app import crud, models
+from app.config import settings
+from app.utils import Blockchain, TransactionStatus
+
+class StubClient:
+    """ ChainClient of a node that rejects some data (and takes the rest of the JSON-RPC batch) """
+
+    def __init__(self, rejected: set):
+        self.rejected = rejected
+        self.sent = []
+        self.w3 = SimpleNamespace(eth=SimpleNamespace(get_transaction_count=lambda address, block: 0))
+
+    def accounts(self) -> list:
+        return ['0x1eca7eD6322B410219Ef953634442AF33aB05BA3']
+
+    def batch_request(self, calls: list, errors: bool = False) -> list:
+        results = []
+        for _, (transaction,) in calls:
+            if transaction['data'] in self.rejected:
+                error = ValueError({'code': -32000, 'message': 'rejected'})
+                if not errors:
+                    raise error
+                results.append(error)
+            else:
+                self.sent.append(transaction['data'])
+                results.append('0x%064x' % len(self.sent))
+        return results
+
+@pytest.fixture
+def backend():
+    return backends.EthereumBackend(client=StubClient({'0xbb'}), keys=[])
+
+def test_submit_batch_returns_the_error_of_each_item(backend):
+    results = backend.submit_batch(['aa', 'bb', 'cc'])
+    assert results[0] == '0x%064x' % 1 and results[2] == '0x%064x' % 2
+    assert isinstance(results[1], ValueError)
+    assert backend.client.sent == ['0xaa', '0xcc']
+    with pytest.raises(ValueError):
+        backend.submit('bb')
+
+def test_submitter_retries_only_the_items_not_sent(backend, monkeypatch):
+    monkeypatch.setattr(backends, 'get_backend', lambda blockchain: backend)
+    updates = []
+    transaction_submitter = submitter.TransactionSubmitter(batch_size=10, max_attempts=3, poll_interval=1)
+    monkeypatch.setattr(transaction_submitter, '_update', lambda rows, anchors=None: updates.extend(rows))
+    transaction_submitter._submit([(1, 'aa', 0, Blockchain.ETHEREUM, 'L1'),
+                                   (2, 'bb', 0, Blockchain.ETHEREUM, 'L2'),
+                                   (3, 'cc', 0, Blockchain.ETHEREUM, 'L3')])
+    assert [(tracking_id, status) for tracking_id, _, status, _, _ in updates] == [
+        (1, TransactionStatus.SUBMITTED.name), (3, TransactionStatus.SUBMITTED.name)]
+    assert transaction_submitter.queue.get_nowait() == (2, 'bb', 1, Blockchain.ETHEREUM, 'L2')
+    assert transaction_submitter.queue.empty()
+    assert backend.client.sent == ['0xaa', '0xcc']
+
+@pytest.fixture
+def db(monkeypatch):
+    """ Session of an in-memory tracking store, also used by the submitter """
+    engine, _ = database.create_engines('sqlite://')
+    database.create_tables(engine)
+    monkeypatch.setitem(database.SessionLocal.kw, 'bind', engine)
+    session = database.SessionLocal()
+    yield session
+    session.close()
+    engine.dispose()
+
+def test_receipt_poll_pages_past_stuck_trackings_and_fails_the_expired(db, monkeypatch):
+    ledger = backends.MemoryLedger()
+    monkeypatch.setattr(backends, '_backends', {Blockchain.MEMORY: ledger})
+    monkeypatch.setattr(settings, 'chain_batch_size', 1)
+    mined, = ledger.submit_batch(['aa'])
+    now = datetime.now()
+    # a page of trackings on a blockchain without backend, before the MEMORY ones
+    db.add_all([models.Tracking(blockchain_id=int(Blockchain.BITCOIN.value), transaction_id='0x%064x' % i,
+                                status=TransactionStatus.SUBMITTED.name, status_dt=now) for i in range(10)])
+    db.add_all([models.Tracking(blockchain_id=int(Blockchain.MEMORY.value), transaction_id=mined,
+                                status=TransactionStatus.SUBMITTED.name, status_dt=now),
+                models.Tracking(blockchain_id=int(Blockchain.MEMORY.value), transaction_id='0x%064x' % 100,
+                                status=TransactionStatus.SUBMITTED.name, status_dt=now),
+                models.Tracking(blockchain_id=int(Blockchain.MEMORY.value), transaction_id='0x%064x' % 101,
+                                status=TransactionStatus.SUBMITTED.name, status_dt=now - timedelta(hours=1))])
+    db.commit()
+    transaction_submitter = submitter.TransactionSubmitter(batch_size=10, max_attempts=3, poll_interval=1,
+                                                           receipt_timeout=600)
+    transaction_submitter._poll_receipts()
+    transaction_submitter._poll_receipts()
+    db.expire_all()
+    statuses = {tracking.transaction_id: tracking.status for tracking in db.query(models.Tracking)}
+    assert statuses.pop(mined) == TransactionStatus.CONFIRMED.name
+    # not mined yet, and not mined within the receipt timeout
+    assert statuses.pop('0x%064x' % 100) == TransactionStatus.SUBMITTED.name
+    assert statuses.pop('0x%064x' % 101) == TransactionStatus.FAILED.name
+    assert set(statuses.values()) == {TransactionStatus.SUBMITTED.name}
+
+def test_each_tracking_is_claimed_by_a_single_worker(db):
+    now = datetime.now()
+    db.add_all([models.Tracking(tracking_id=1, status=TransactionStatus.PENDING.name, status_dt=now),
+                models.Tracking(tracking_id=2, status=TransactionStatus.PENDING.name, status_dt=now),
+                models.Tracking(tracking_id=3, status=TransactionStatus.SUBMITTED.name, status_dt=now),
+                # claimed by a worker that stopped before submitting it
+                models.Tracking(tracking_id=4, status=TransactionStatus.SUBMITTING.name, claimed_by='gone:1',
+                                status_dt=now - timedelta(minutes=5))])
+    db.commit()
+    assert crud.claim_trackings(db, [1, 3, 4], 'host:1', lease=60) == {1, 4}
+    assert crud.claim_trackings(db, [1, 2, 4], 'host:2', lease=60) == {2}
+    # a retry of the same worker
+    assert crud.claim_trackings(db, [1], 'host:1', lease=60) == {1}
+    assert [tracking.tracking_id for tracking in crud.get_unclaimed_trackings(db, lease=60)] == []
+    assert [tracking.tracking_id for tracking in crud.get_unclaimed_trackings(db, lease=0)] == [1, 2, 4]
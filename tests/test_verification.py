@@ -0,0 +1,64 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+import app.audit as audit
+import app.backends as backends
+import app.bib as bib
+import app.database as database
+from app import models
+from app.main import app
+from app.utils import Blockchain
+
+CONTENT = '{cpf:72815157071, exam:HIV, datetime:2021-09-14T19:50:47.108814, result:POS}'
+SALT = '4efc1400-29b8-40b7-9bd7-7fce480b39e8'
+
+class UnreadableLedger(backends.MemoryLedger):
+    """ MEMORY ledger whose node returns a JSON-RPC error for some transactions """
+
+    def __init__(self, unreadable: set):
+        super().__init__()
+        self.unreadable = unreadable
+
+    def get_many(self, transaction_ids: list) -> list:
+        return [ValueError({'code': -32000, 'message': 'header not found'}) if transaction_id in self.unreadable else tx
+                for transaction_id, tx in zip(transaction_ids, super().get_many(transaction_ids))]
+
+@pytest.fixture
+def client(monkeypatch):
+    engine, async_engine = database.create_engines('sqlite://')
+    database.create_tables(engine)
+    monkeypatch.setitem(database.SessionLocal.kw, 'bind', engine)
+    monkeypatch.setitem(database.AsyncSessionLocal.kw, 'bind', async_engine)
+    yield TestClient(app)
+    engine.dispose()
+
+def test_bulk_verify_reports_the_item_errors_of_the_node(client, monkeypatch):
+    ledger = UnreadableLedger(set())
+    readable, unreadable = ledger.submit_batch([bib.anonymize(bib.salted_content(CONTENT, SALT), 'SHA256')] * 2)
+    ledger.unreadable.add(unreadable)
+    monkeypatch.setattr(backends, '_backends', {Blockchain.MEMORY: ledger})
+    response = client.post('/verifySecureImmutableRegister/bulk/?blockchain=4',
+                           json=[{'transaction_id': readable, 'content': CONTENT, 'salt': SALT},
+                                 {'transaction_id': unreadable, 'content': CONTENT, 'salt': SALT}])
+    assert response.status_code == 200
+    results = response.json()['results']
+    assert results[0]['result'] is True
+    assert results[1]['result'] is None and 'header not found' in results[1]['error']
+    assert response.json()['summary'] == {'total': 2, 'verified': 1, 'mismatched': 0, 'errors': 1}
+
+def test_audit_skips_the_blockchains_it_can_not_read(client, tmp_path):
+    ledger = backends.MemoryLedger()
+    anchored, = ledger.submit_batch(['aa'])
+    db = database.SessionLocal()
+    db.add_all([models.Tracking(blockchain_id=int(Blockchain.ETHEREUM.value), transaction_id=anchored, anonymized_data='aa'),
+                models.Tracking(blockchain_id=int(Blockchain.ETHEREUM.value), transaction_id='0x%064x' % 1, anonymized_data='bb'),
+                models.Tracking(blockchain_id=int(Blockchain.MEMORY.value), transaction_id='0x%064x' % 2, anonymized_data='cc')])
+    db.commit()
+    db.close()
+    state = audit.Audit({int(Blockchain.ETHEREUM.value): ledger}, chunk_size=2, concurrency=2,
+                        checkpoint_path=str(tmp_path / 'checkpoint.json'), report_path=str(tmp_path / 'report.ndjson')).run()
+    assert (state['audited'], state['mismatches'], state['errors'], state['skipped']) == (2, 1, 0, 1)
+    with open(tmp_path / 'report.ndjson') as report:
+        assert [json.loads(line)['problem'] for line in report] == ['not_found']